@@ -1,6 +1,21 @@
-from db import get_conn
+from db import execute, get_conn, get_stream
+from db_config import (FTS_CONFIG, LO_COMPRESSION, LO_COMPRESSION_LEVEL, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL,
+                       USE_READ_MODELS)
 import psycopg
-from datetime import date
+from psycopg import sql
+import base64
+import csv
+import functools
+import hashlib
+import inspect
+import io
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime, time
+from time import monotonic
 from calendar import monthrange
 # with this we can handle null and empty values
 def _to_int(x):
@@ -9,16 +24,181 @@ def _to_int(x):
 
 def _is_blank(x) -> bool:
     return x is None or (isinstance(x, str) and x.strip() == "")
+# large objects are streamed in chunks of this many bytes, so memory use does not grow with the file size
+LO_CHUNK_SIZE = 1024 * 1024
+_INV_WRITE = 0x20000   # lo_open modes, see libpq-fs.h
+_INV_READ  = 0x40000
+
+# formats that are compressed already, zlib would cost time and save nothing
+_COMPRESSED_MAGIC = (b"\xff\xd8\xff", b"\x89PNG", b"GIF8", b"PK\x03\x04", b"\x1f\x8b", b"(\xb5/\xfd",
+                     b"BZh", b"\xfd7zXZ", b"7z\xbc\xaf", b"Rar!", b"ID3", b"OggS", b"fLaC")
+
+def _pick_codec(head: bytes) -> str:
+    """'zlib' or 'none' for a file starting with head (LO_COMPRESSION in db_config turns compression off)."""
+    if LO_COMPRESSION != "zlib" or not head:
+        return "none"
+    if (head.startswith(_COMPRESSED_MAGIC) or head[4:8] == b"ftyp"           # mp4 / mov / heic
+            or (head[:4] == b"RIFF" and head[8:12] in (b"WEBP", b"AVI "))):
+        return "none"
+    # unknown format: keep zlib only if a quick trial on the head actually shrinks it
+    return "zlib" if len(zlib.compress(head, 1)) < 0.9 * len(head) else "none"
+
+def _lo_write(cur, f, *, chunk_size=LO_CHUNK_SIZE, progress=None, total=None, hasher=None, codec="none"):
+    """Stream the binary file object f into a new Large Object inside cur's transaction.
+    Returns (oid, bytes stored). With codec='zlib' the chunks are compressed on the way.
+    progress(bytes_done, total) is called after every chunk, hasher (if given) is updated with every chunk."""
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    cur.execute("SELECT lo_create(0)")
+    oid = cur.fetchone()[0]
+    cur.execute("SELECT lo_open(%s, %s)", (oid, _INV_WRITE))
+    fd = cur.fetchone()[0]
+    comp = zlib.compressobj(LO_COMPRESSION_LEVEL) if codec == "zlib" else None
+    done = stored = 0
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        data = comp.compress(chunk) if comp else chunk
+        if data:
+            cur.execute("SELECT lowrite(%s, %s)", (fd, data))
+            stored += len(data)
+        if hasher:
+            hasher.update(chunk)
+        done += len(chunk)
+        if progress:
+            progress(done, total)
+    if comp:
+        data = comp.flush()
+        cur.execute("SELECT lowrite(%s, %s)", (fd, data))
+        stored += len(data)
+    cur.execute("SELECT lo_close(%s)", (fd,))
+    # large objects are private to their owner (admin), let the read-only role open them too
+    cur.execute(sql.SQL('GRANT SELECT ON LARGE OBJECT {} TO "user"').format(sql.SQL(str(int(oid)))))
+    return oid, stored
+
+def _lo_read(cur, oid, out, *, offset=0, length=None, chunk_size=LO_CHUNK_SIZE, progress=None) -> int:
+    """Copy bytes [offset, offset+length) of Large Object oid into the writable object out, chunk by chunk.
+    Compressed objects are decompressed on the way, offset and length count uncompressed bytes.
+    Returns the number of bytes written."""
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    if offset < 0 or (length is not None and length < 0):
+        raise ValueError("offset and length must not be negative")
+    cur.execute("SELECT codec, size FROM lo_blob WHERE lo_oid=%s", (oid,))
+    row = cur.fetchone()
+    cur.execute("SELECT lo_open(%s, %s)", (oid, _INV_READ))
+    fd = cur.fetchone()[0]
+    if row and row[0] == "zlib":
+        done = _lo_read_zlib(cur, fd, out, row[1], offset, length, chunk_size, progress)
+        cur.execute("SELECT lo_close(%s)", (fd,))
+        return done
+    cur.execute("SELECT lo_lseek64(%s, 0, 2)", (fd,))   # 2 = SEEK_END, gives the size
+    size = cur.fetchone()[0]
+    start = min(offset, size)
+    end = size if length is None else min(size, start + length)
+    cur.execute("SELECT lo_lseek64(%s, %s, 0)", (fd, start))
+    done = 0
+    while start + done < end:
+        cur.execute("SELECT loread(%s, %s)", (fd, min(chunk_size, end - start - done)))
+        chunk = cur.fetchone()[0]
+        if not chunk:
+            break
+        out.write(chunk)
+        done += len(chunk)
+        if progress:
+            progress(done, end - start)
+    cur.execute("SELECT lo_close(%s)", (fd,))
+    return done
+
+def _lo_read_zlib(cur, fd, out, size, offset, length, chunk_size, progress) -> int:
+    # zlib streams cannot seek, decompress from the start and keep only the requested window
+    start = min(offset, size)
+    end = size if length is None else min(size, start + length)
+    read_size = chunk_size if length is None else min(chunk_size, max(length, 64 * 1024))
+    d = zlib.decompressobj()
+    pos = done = 0   # pos = uncompressed bytes seen so far
+    while pos < end:
+        cur.execute("SELECT loread(%s, %s)", (fd, read_size))
+        buf = cur.fetchone()[0]
+        if not buf:
+            break
+        while buf and pos < end:
+            data = d.decompress(buf, chunk_size)   # bounded, highly compressible chunks can expand a lot
+            buf = d.unconsumed_tail
+            lo, hi = max(start - pos, 0), min(end - pos, len(data))
+            if hi > lo:
+                out.write(data[lo:hi])
+                done += hi - lo
+                if progress:
+                    progress(done, end - start)
+            pos += len(data)
+    return done
+
 # get oid from large objects
-def lo_save_file(path: str) -> int:
-    """Create a Large Object from a local file and return its OID."""
-    with open(path, "rb") as f:
-        data = f.read()
+def lo_save_file(path: str, *, chunk_size: int = LO_CHUNK_SIZE, progress=None, codec: str | None = None) -> int:
+    """Store a local file as a Large Object and return its OID (an existing OID if the content is already stored).
+    No row references the object yet, so it is marked as held (lo_blob.held_at): it is not unlinked when the
+    refcount drops to 0, lo_gc.py removes it when it is unreferenced and the grace period since this save is over.
+    The file is streamed in chunk_size pieces, progress(bytes_done, total_bytes) is called after each one.
+    codec 'zlib' or 'none' overrides the automatic choice (_pick_codec)."""
     with get_conn() as (conn, cur):
-        cur.execute("SELECT lo_from_bytea(0, %s)", (psycopg.Binary(data),))
-        oid = cur.fetchone()[0]
+        oid = _lo_write_path(cur, path, chunk_size=chunk_size, progress=progress, codec=codec)
+        cur.execute("UPDATE lo_blob SET held_at = now() WHERE lo_oid=%s", (oid,))
         conn.commit()
         return oid
+
+def _file_digest(path) -> bytes:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(LO_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.digest()
+
+def _lo_write_path(cur, path, *, chunk_size=LO_CHUNK_SIZE, progress=None, codec=None) -> int:
+    """OID holding the content of the file at path. Files are deduplicated by SHA-256 (table lo_blob):
+    if the same content is already stored its OID is reused and nothing is uploaded.
+    The row lock keeps the object from being unlinked until the transaction ends, so the caller has to
+    reference it in the same transaction (lo_save_file marks it as held instead)."""
+    size = os.path.getsize(path)
+    cur.execute("SELECT lo_oid FROM lo_blob WHERE digest=%s FOR SHARE", (_file_digest(path),))
+    row = cur.fetchone()
+    if row:
+        if progress:
+            progress(size, size)
+        return row[0]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        if codec is None:
+            codec = _pick_codec(f.read(64 * 1024))
+            f.seek(0)
+        oid, stored = _lo_write(cur, f, chunk_size=chunk_size, progress=progress, total=size, hasher=h, codec=codec)
+    cur.execute("""INSERT INTO lo_blob (lo_oid, digest, size, codec, stored_size) VALUES (%s, %s, %s, %s, %s)
+                   ON CONFLICT (digest) DO NOTHING RETURNING lo_oid""", (oid, h.digest(), size, codec, stored))
+    if cur.fetchone() is None:
+        # the same content was stored by a concurrent save in the meantime, keep that copy
+        cur.execute("SELECT lo_unlink(%s)", (oid,))
+        cur.execute("SELECT lo_oid FROM lo_blob WHERE digest=%s FOR SHARE", (h.digest(),))
+        oid = cur.fetchone()[0]
+    return oid
+
+def lo_export_file(oid: int, dest, *, offset: int = 0, length: int | None = None,
+                   chunk_size: int = LO_CHUNK_SIZE, progress=None) -> int:
+    """Stream a Large Object to dest, a local path or a writable binary file object.
+    offset/length pick a byte range (e.g. length=64 for just the header). Returns the number of bytes written."""
+    with get_conn() as (conn, cur):
+        if isinstance(dest, (str, os.PathLike)):
+            with open(dest, "wb") as f:
+                return _lo_read(cur, oid, f, offset=offset, length=length,
+                                chunk_size=chunk_size, progress=progress)
+        return _lo_read(cur, oid, dest, offset=offset, length=length,
+                        chunk_size=chunk_size, progress=progress)
+
+def lo_read_bytes(oid: int, offset: int = 0, length: int = 4096) -> bytes:
+    """Read a small byte range of a Large Object into memory, for previews and file type sniffing."""
+    buf = io.BytesIO()
+    lo_export_file(oid, buf, offset=offset, length=length)
+    return buf.getvalue()
 # verify the date
 def validate_date_parts(year, month, day, *, label="date"):
     def norm(name, v):
@@ -62,18 +242,356 @@ def validate_date_parts(year, month, day, *, label="date"):
 
     return (y, m, d)
 
+# batch writes: every *_many function takes a list of rows, each row is the arguments of the
+# single-row function as a tuple (positional) or dict (keyword). All rows go through one connection
+# and one transaction, each statement is sent with executemany (pipelined, so no round trip per row).
+# errors="raise": all or nothing, the first bad row rolls everything back and is raised.
+# errors="collect": bad rows are skipped, the rest is committed, returns [(row index, message), ...].
+# translate turns a database error into the ValueError the single-row function raises (None keeps it).
+def _bind(fn, row) -> dict:
+    b = inspect.signature(fn).bind(**row) if isinstance(row, dict) else inspect.signature(fn).bind(*row)
+    b.apply_defaults()
+    return b.arguments
+
+def _part(v):
+    return None if _is_blank(v) else _to_int(v) if isinstance(v, str) else v
+
+def _write_many(fn, rows, stmts, prepare, errors, lookup=None, translate=None) -> list:
+    if errors not in ("raise", "collect"):
+        raise ValueError("errors must be 'raise' or 'collect'")
+    failed, bound = [], []
+    for i, row in enumerate(rows):
+        try:
+            bound.append((i, _bind(fn, row)))
+        except TypeError as e:
+            if errors == "raise":
+                raise ValueError(f"row {i}: {e}") from e
+            failed.append((i, str(e)))
+
+    with get_conn() as (conn, cur):
+        # lookup reads what prepare needs from the database (e.g. stored date parts) in one query
+        ctx = lookup(cur, [a for _, a in bound]) if lookup else None
+        params = []
+        for i, a in bound:
+            try:
+                params.append((i, prepare(a, ctx)))
+            except ValueError as e:
+                if errors == "raise":
+                    raise ValueError(f"row {i}: {e}") from e
+                failed.append((i, str(e)))
+
+        cur.execute("SAVEPOINT write_many")
+        refused = None
+        # the refused statement's error is caught inside the pipeline, leaving it then only raises
+        # PipelineAborted, which is dropped (psycopg would log it if the error was still propagating)
+        try:
+            with conn.pipeline():
+                try:
+                    for n, stmt in enumerate(stmts):
+                        cur.executemany(stmt, [p[n] for _, p in params])
+                except psycopg.Error as e:
+                    refused = e
+        except psycopg.Error as e:
+            refused = refused or e
+        if refused:
+            if errors == "raise":
+                raise (translate and translate(refused)) or refused
+            # something in the batch was refused, redo it row by row to find out which
+            cur.execute("ROLLBACK TO SAVEPOINT write_many")
+            for i, p in params:
+                cur.execute("SAVEPOINT write_row")
+                try:
+                    for stmt, args in zip(stmts, p):
+                        cur.execute(stmt, args)
+                except psycopg.Error as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT write_row")
+                    failed.append((i, str((translate and translate(e)) or e).strip()))
+                else:
+                    cur.execute("RELEASE SAVEPOINT write_row")
+        conn.commit()
+    return sorted(failed)
+
+def _delete_many(table, id_col, ids) -> int:
+    # one statement for the whole list, the foreign keys are all SET NULL / CASCADE so nothing is refused
+    with get_conn() as (conn, cur):
+        cur.execute(f"DELETE FROM {table} WHERE {id_col} = ANY(%s)", (list(ids),))
+        conn.commit()
+        return cur.rowcount
+
+def _stored_dates(table, id_col, date_cols, id_arg):
+    """lookup for the *_update_many functions with dates: {id: (year, month, day)} of the given rows."""
+    def lookup(cur, bound):
+        ids = [a[id_arg] for a in bound]
+        cur.execute(f"SELECT {id_col}, {', '.join(date_cols)} FROM {table} WHERE {id_col} = ANY(%s)", (ids,))
+        return {r[0]: r[1:] for r in cur.fetchall()}
+    return lookup
+
+def _merged_date(a, stored, id_arg, what):
+    # same rule as the single-row *_update: given parts are merged with the stored ones and validated
+    y, m, d = _part(a["year"]), _part(a["month"]), _part(a["day"])
+    if y is not None or m is not None or d is not None:
+        base = stored.get(a[id_arg])
+        if base is None:
+            raise ValueError(f"{what} not found")
+        validate_date_parts(y if y is not None else base[0], m if m is not None else base[1],
+                            d if d is not None else base[2], label=f"{what} date")
+    return y, m, d
+
+# the *_search filters are described as (column, how) pairs in argument order,
+# "ilike" means substring match and "eq" means the value is an integer compared exactly.
+# The statements are prepared (db.execute), so the query text should not depend on the values: "eq" filters are
+# always there in a (NULL or equal) form, "ilike" filters only when given (a generic plan of "%s IS NULL OR
+# col ILIKE %s" could not use the trigram indexes), so each search has one prepared variant per set of text filters.
+def _where(filters, values):
+    where, args = [], []
+    for (col, how), v in zip(filters, values):
+        if how == "ilike":
+            if v:
+                where.append(f"{col} ILIKE %s"); args.append(f"%{v}%")
+        else:
+            n = _to_int(v) if v else None
+            where.append(f"(%s::int IS NULL OR {col} = %s)"); args += [n, n]
+    return (" AND ".join(where) if where else "1=1"), args
+
+# keyset pagination: the cursor is the ORDER BY key of the last row, packed so callers treat it as opaque
+PAGE_SIZE = 200
+
+def _encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("invalid page cursor")
+    if not isinstance(key, list):
+        raise ValueError("invalid page cursor")
+    return key
+
+def _page(name, select_sql, clause, args, keys, page_size, after):
+    """Run select_sql filtered by clause and return (rows, next_cursor) for one page.
+    keys are expressions over the select output columns that give a unique, non-null sort order."""
+    if page_size < 1:
+        raise ValueError("page_size must be at least 1")
+    key_list = ", ".join(keys)
+    args = list(args)
+    query = f"SELECT q.*, {key_list} FROM ({select_sql} WHERE {clause}) q"
+    if after:
+        key = _decode_cursor(after)
+        if len(key) != len(keys):
+            raise ValueError("invalid page cursor")
+        query += f" WHERE ({key_list}) > ({', '.join(['%s'] * len(keys))})"
+        args += key
+    query += f" ORDER BY {key_list} LIMIT %s"
+    args.append(page_size)
+    with get_conn() as (conn, cur):
+        execute(cur, name, query, tuple(args))
+        raw = cur.fetchall()
+    n = len(keys)
+    rows = [r[:-n] for r in raw]
+    next_cursor = _encode_cursor(raw[-1][-n:]) if len(raw) == page_size else None
+    return rows, next_cursor
+
+# date range searches run on the generated DATE columns (see bootstrap_db) and their B-tree indexes.
+# partial dates count as the first day of the known period (2024-03 is 2024-03-01),
+# exact_only=True keeps only rows that have a full year-month-day
+def _date_arg(v, name) -> date:
+    if isinstance(v, date):
+        return v
+    try:
+        return date.fromisoformat(str(v).strip())
+    except ValueError:
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD).")
+
+def _between(select_sql, date_col, precision_col, order, date_from, date_to, exact_only, where=(), args=()):
+    lo, hi = _date_arg(date_from, "date_from"), _date_arg(date_to, "date_to")
+    if hi < lo:
+        raise ValueError("date_to is before date_from")
+    where = [f"{date_col} BETWEEN %s AND %s", *where]
+    if exact_only:
+        where.append(f"{precision_col} = 'day'")
+    with get_conn() as (conn, cur):
+        cur.execute(f"{select_sql} WHERE {' AND '.join(where)} ORDER BY {date_col}, {order}", (lo, hi, *args))
+        return cur.fetchall()
+
+# full-text search on the comments: *_comment_tsv is generated in the FTS_CONFIG text search configuration
+# (see bootstrap_db) and has a GIN index. With files=True the text extracted from the attached file
+# (lo_text, filled by lo_text.py) is searched in the same query and a row matches if either one does.
+# q takes web search syntax: words, "a phrase", or, -word.
+# Rows are the *_search columns behind (rank, snippet), best match first; the snippet marks matches with « »
+# and starts with "[file]" when only the attachment matched.
+# The cursor is (rank, id) of the last row, so later pages do not repeat or skip rows.
+FTS_HEADLINE = "StartSel=«, StopSel=», MaxWords=25, MinWords=8, MaxFragments=2, FragmentDelimiter=\" … \""
+
+def _text_page(select_sql, table, id_col, tsv_col, text_col, file_col, q, files, page_size, after):
+    if page_size < 1:
+        raise ValueError("page_size must be at least 1")
+    if _is_blank(q):
+        return [], None
+    where, args = "", []
+    if after:
+        key = _decode_cursor(after)
+        if len(key) != 2:
+            raise ValueError("invalid page cursor")
+        where = "WHERE h.rank < %s OR (h.rank = %s AND h.id > %s)"
+        args = [key[0], key[0], key[1]]
+    # each branch runs on its own GIN index, a row found by both keeps the better rank
+    file_hits = f"""
+            UNION ALL
+            SELECT t.{id_col}, ts_rank_cd(x.tsv, query.q), false
+            FROM lo_text x JOIN {table} t ON t.{file_col} = x.lo_oid, query
+            WHERE x.tsv @@ query.q""" if files else ""
+    # rank every match (needed for the order) but build snippets only for the rows of this page;
+    # float8 so the rank survives the round trip through the cursor exactly
+    query = f"""
+        WITH query AS (SELECT websearch_to_tsquery(%s::regconfig, %s) AS q),
+        hits AS (
+            SELECT id, max(rank)::float8 AS rank, bool_or(in_comment) AS in_comment
+            FROM (
+                SELECT t.{id_col} AS id, ts_rank_cd(t.{tsv_col}, query.q) AS rank, true AS in_comment
+                FROM {table} t, query
+                WHERE t.{tsv_col} @@ query.q{file_hits}
+            ) m
+            GROUP BY id
+        ),
+        page AS (
+            SELECT * FROM hits h {where} ORDER BY h.rank DESC, h.id LIMIT %s
+        )
+        SELECT page.rank,
+               CASE WHEN page.in_comment THEN ts_headline(%s::regconfig, s.{text_col}, query.q, %s)
+                    ELSE '[file] ' || ts_headline(%s::regconfig,
+                        (SELECT x.body FROM lo_text x WHERE x.lo_oid = s.{file_col}), query.q, %s) END,
+               s.*, page.id
+        FROM page JOIN ({select_sql}) s ON s.{id_col} = page.id, query
+        ORDER BY page.rank DESC, page.id
+    """
+    with get_conn() as (conn, cur):
+        execute(cur, f"{table}_text_page", query, (FTS_CONFIG, q.strip(), *args, page_size,
+                                                   FTS_CONFIG, FTS_HEADLINE, FTS_CONFIG, FTS_HEADLINE))
+        raw = cur.fetchall()
+    rows = [r[:-1] for r in raw]
+    next_cursor = _encode_cursor((raw[-1][0], raw[-1][-1])) if len(raw) == page_size else None
+    return rows, next_cursor
+
+# bulk readers for reports, exports and nightly jobs: rows come from a server-side cursor itersize at a time
+# and are never materialized with fetchall(). The pooled connection is held until the generator is exhausted or closed.
+STREAM_ITERSIZE = 2000
+
+def _stream(name, select_sql, clause, args, order, itersize):
+    if itersize < 1:
+        raise ValueError("itersize must be at least 1")
+    with get_stream(name, itersize) as (conn, cur):
+        cur.execute(f"{select_sql} WHERE {clause} ORDER BY {order}", tuple(args))
+        yield from cur
+
+def export_csv(path: str, headers, rows) -> int:
+    """Write headers and then rows (any iterable, e.g. a *_iter generator) to a CSV file. Returns the row count."""
+    n = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(headers)
+        for r in rows:
+            w.writerow(r)
+            n += 1
+    return n
+
+# results of the view/search/page calls of tables that rarely change (clinics, departments, doctors), kept in this
+# process for RESULT_CACHE_TTL seconds, least recently used first out above RESULT_CACHE_MAX_ENTRIES.
+# Every write function in this module drops the entries that read the tables it writes. Writes from other
+# processes (another client, bulk_import.py) show up when the entry expires.
+_CACHE_LOCK = threading.Lock()
+_CACHE = OrderedDict()   # (function, args, kwargs) -> (expires, tables, result)
+_CACHE_GEN = {}          # table (None: all) -> invalidations so far, a read that overlapped one is not stored
+_CACHE_STATS = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "invalidated": 0}
+
+def _fresh(result):
+    # callers may sort or extend what they get, hand out copies of the row lists
+    if isinstance(result, tuple):
+        return tuple(list(x) if isinstance(x, list) else x for x in result)
+    return list(result) if isinstance(result, list) else result
+
+def _cached(*tables):
+    def wrap(fn):
+        sig = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            # bound arguments with defaults filled in, so f() and f("") share an entry
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (fn.__name__, tuple(bound.arguments.items()))
+            try:
+                hash(key)
+            except TypeError:
+                return fn(*args, **kwargs)
+            now = monotonic()
+            with _CACHE_LOCK:
+                hit = _CACHE.get(key)
+                if hit is not None and hit[0] > now:
+                    _CACHE.move_to_end(key)
+                    _CACHE_STATS["hits"] += 1
+                    return _fresh(hit[2])
+                if hit is not None:
+                    del _CACHE[key]
+                    _CACHE_STATS["expired"] += 1
+                _CACHE_STATS["misses"] += 1
+                gen = [_CACHE_GEN.get(t, 0) for t in (None,) + tables]
+            result = fn(*args, **kwargs)
+            if RESULT_CACHE_TTL > 0 and RESULT_CACHE_MAX_ENTRIES > 0:
+                with _CACHE_LOCK:
+                    if gen == [_CACHE_GEN.get(t, 0) for t in (None,) + tables]:
+                        _CACHE[key] = (now + RESULT_CACHE_TTL, tables, _fresh(result))
+                        _CACHE.move_to_end(key)
+                        while len(_CACHE) > RESULT_CACHE_MAX_ENTRIES:
+                            _CACHE.popitem(last=False)
+                            _CACHE_STATS["evicted"] += 1
+            return result
+        return call
+    return wrap
+
+def _writes(*tables):
+    # also on errors: a collect-mode batch commits the good rows before reporting the bad ones
+    def wrap(fn):
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                cache_invalidate(*tables)
+        return call
+    return wrap
+
+def cache_invalidate(*tables):
+    """Drop cached results that read any of the given tables (all of them when none are given)."""
+    with _CACHE_LOCK:
+        for t in tables or (None,):
+            _CACHE_GEN[t] = _CACHE_GEN.get(t, 0) + 1
+        stale = [k for k, (_, deps, _) in _CACHE.items() if not tables or set(deps) & set(tables)]
+        for k in stale:
+            del _CACHE[k]
+        _CACHE_STATS["invalidated"] += len(stale)
+
+def cache_stats() -> dict:
+    """Hit/miss/eviction counters of the result cache in this process plus the number of entries."""
+    with _CACHE_LOCK:
+        out = dict(_CACHE_STATS)
+        out["entries"] = len(_CACHE)
+    lookups = out["hits"] + out["misses"]
+    out["hit_rate"] = out["hits"] / lookups if lookups else 0.0
+    return out
+
 # PERSON 
 def person_search(q: str):
     q = (q or "").strip()
     with get_conn() as (conn, cur):
         if not q:
-            cur.execute("""
+            execute(cur, "person_search", """
                 SELECT personnumer, full_name
                 FROM person
                 ORDER BY personnumer;
             """)
         else:
-            cur.execute("""
+            execute(cur, "person_search", """
                 SELECT personnumer, full_name
                 FROM person
                 WHERE personnumer ILIKE %s OR full_name ILIKE %s
@@ -81,6 +599,7 @@ def person_search(q: str):
             """, (f"%{q}%", f"%{q}%"))
         return cur.fetchall()
 
+@_writes("person")
 def person_insert(personnumer: str, full_name: str):
     with get_conn() as (conn, cur):
         cur.execute("""
@@ -90,6 +609,7 @@ def person_insert(personnumer: str, full_name: str):
         """, (personnumer, full_name))
         conn.commit()
 
+@_writes("person")
 def person_update_name(personnumer: str, full_name: str | None):
     if _is_blank(full_name):
         return
@@ -98,50 +618,38 @@ def person_update_name(personnumer: str, full_name: str | None):
         conn.commit()
 
 #  PATIENTS
+_PATIENT_SELECT = """
+    SELECT 
+           pe.personnumer   AS patient_personnumer,
+           pe.full_name     AS patient_name,
+           pa.doctor_personnumer,
+           dp.full_name     AS doctor_name
+    FROM patient pa
+    JOIN person pe ON pe.personnumer = pa.personnumer
+    -- left join because doctor_personnumer is not set to NOT NULL
+    LEFT JOIN doctor d ON d.personnumer = pa.doctor_personnumer
+    LEFT JOIN person dp ON dp.personnumer = d.personnumer
+"""
+_PATIENT_FILTERS = (("pe.full_name", "ilike"), ("pe.personnumer", "ilike"),
+                    ("dp.full_name", "ilike"), ("pa.doctor_personnumer", "ilike"))
+_PATIENT_KEYS = ("patient_personnumer",)
+
 def patient_view():
-    with get_conn() as (conn, cur):
-        cur.execute("""
-            SELECT 
-                   pe.personnumer   AS patient_personnumer,
-                   pe.full_name     AS patient_name,
-                   pa.doctor_personnumer,
-                   dp.full_name     AS doctor_name
-            FROM patient pa
-            JOIN person pe ON pe.personnumer = pa.personnumer
-            -- left join because doctor_personnumer is not set to NOT NULL
-            LEFT JOIN doctor d ON d.personnumer = pa.doctor_personnumer
-            LEFT JOIN person dp ON dp.personnumer = d.personnumer
-            ORDER BY pa.personnumer;
-        """)
-        return cur.fetchall()
+    return patient_search()
 
 def patient_search(patient_name="", patient_personnumer="", doctor_name="", doctor_personnumer=""):
-    where, args = [], []
-    if patient_name:
-        where.append("pe.full_name ILIKE %s");           args.append(f"%{patient_name}%")
-    if patient_personnumer:
-        where.append("pe.personnumer ILIKE %s");         args.append(f"%{patient_personnumer}%")
-    if doctor_name:
-        where.append("dp.full_name ILIKE %s");           args.append(f"%{doctor_name}%")
-    if doctor_personnumer:
-        where.append("pa.doctor_personnumer ILIKE %s");  args.append(f"%{doctor_personnumer}%")
-    clause = " AND ".join(where) if where else "1=1"
-    with get_conn() as (conn, cur):
-        cur.execute(f"""
-            SELECT 
-                   pe.personnumer   AS patient_personnumer,
-                   pe.full_name     AS patient_name,
-                   pa.doctor_personnumer,
-                   dp.full_name     AS doctor_name
-            FROM patient pa
-            JOIN person pe ON pe.personnumer = pa.personnumer
-            LEFT JOIN doctor d ON d.personnumer = pa.doctor_personnumer
-            LEFT JOIN person dp ON dp.personnumer = d.personnumer
-            WHERE {clause}
-            ORDER BY pa.personnumer;
-        """, tuple(args))
+    clause, args = _where(_PATIENT_FILTERS, (patient_name, patient_personnumer, doctor_name, doctor_personnumer))
+    with get_conn() as (conn, cur):
+        execute(cur, "patient_search", f"{_PATIENT_SELECT} WHERE {clause} ORDER BY pa.personnumer;", tuple(args))
         return cur.fetchall()
 
+def patient_page(patient_name="", patient_personnumer="", doctor_name="", doctor_personnumer="",
+                 *, page_size=PAGE_SIZE, after=None):
+    """One page of patient_search. Returns (rows, next_cursor), next_cursor is None on the last page."""
+    clause, args = _where(_PATIENT_FILTERS, (patient_name, patient_personnumer, doctor_name, doctor_personnumer))
+    return _page("patient_page", _PATIENT_SELECT, clause, args, _PATIENT_KEYS, page_size, after)
+
+@_writes("person", "patient")
 def patient_insert(patient_personnumer: str, patient_name: str, doctor_personnumer: str | None):
     with get_conn() as (conn, cur):
         cur.execute("""
@@ -156,6 +664,7 @@ def patient_insert(patient_personnumer: str, patient_name: str, doctor_personnum
         """, (patient_personnumer, (doctor_personnumer or None)))
         conn.commit()
 
+@_writes("person", "patient")
 def patient_update(patient_personnumer: str,
                    new_doctor_personnumer: str | None = None,
                    new_patient_name: str | None = None):
@@ -168,58 +677,136 @@ def patient_update(patient_personnumer: str,
                         (new_patient_name, patient_personnumer))
         conn.commit()
 
+@_writes("person", "patient")
 def patient_delete(patient_personnumer: str):
     with get_conn() as (conn, cur):
         cur.execute("DELETE FROM patient WHERE personnumer=%s", (patient_personnumer,))
         conn.commit()
 
+@_writes("person", "patient")
+def patient_insert_many(rows, *, errors="raise"):
+    """Batch patient_insert, see _write_many."""
+    return _write_many(patient_insert, rows, (
+        "INSERT INTO person (personnumer, full_name) VALUES (%s, %s) ON CONFLICT (personnumer) DO NOTHING",
+        "INSERT INTO patient (personnumer, doctor_personnumer) VALUES (%s, %s) ON CONFLICT (personnumer) DO NOTHING",
+    ), lambda a, _: ((a["patient_personnumer"], a["patient_name"]),
+                     (a["patient_personnumer"], a["doctor_personnumer"] or None)), errors)
+
+@_writes("person", "patient")
+def patient_update_many(rows, *, errors="raise"):
+    """Batch patient_update (blank fields are left unchanged), see _write_many."""
+    return _write_many(patient_update, rows, (
+        "UPDATE patient SET doctor_personnumer=COALESCE(%s, doctor_personnumer) WHERE personnumer=%s",
+        "UPDATE person SET full_name=COALESCE(%s, full_name) WHERE personnumer=%s",
+    ), lambda a, _: ((None if _is_blank(a["new_doctor_personnumer"]) else a["new_doctor_personnumer"],
+                      a["patient_personnumer"]),
+                     (None if _is_blank(a["new_patient_name"]) else a["new_patient_name"],
+                      a["patient_personnumer"])), errors)
+
+@_writes("person", "patient")
+def patient_delete_many(patient_personnumers) -> int:
+    """Delete all given patients in one statement, returns how many were deleted."""
+    return _delete_many("patient", "personnumer", patient_personnumers)
+
+# a patient's whole history in one round trip: the server nests it as JSON
+# (appointments -> observations -> diagnoses), each level ordered by date, undated entries last.
+# Every level is reached through a foreign key index, so the cost does not grow with the size of the tables.
+def _file_json(oid_col):
+    return f"""(SELECT json_build_object('oid', f.oid::bigint, 'size', b.size, 'stored_size', b.stored_size,
+                                         'codec', b.codec, 'text_kind', t.kind)
+                FROM (SELECT {oid_col} AS oid) f
+                LEFT JOIN lo_blob b ON b.lo_oid = f.oid
+                LEFT JOIN lo_text t ON t.lo_oid = f.oid
+                WHERE f.oid IS NOT NULL)"""
+
+_TIMELINE_SQL = f"""
+    SELECT json_build_object(
+        'personnumer', pa.personnumer, 'name', pe.full_name,
+        'doctor_personnumer', pa.doctor_personnumer, 'doctor_name', dp.full_name,
+        'appointments', COALESCE((
+            SELECT json_agg(json_build_object(
+                       'appoint_id', a.appoint_id, 'date', a.appoint_date, 'date_precision', a.appoint_date_precision,
+                       'start', a.appoint_start, 'end', a.appoint_end, 'location', a.appoint_location,
+                       'doctor_personnumer', a.doctor_personnumer, 'doctor_name', adp.full_name,
+                       'observations', COALESCE(obs.items, '[]'))
+                   ORDER BY a.appoint_date NULLS LAST, a.appoint_start NULLS LAST, a.appoint_id)
+            FROM appointment a
+            LEFT JOIN person adp ON adp.personnumer = a.doctor_personnumer
+            LEFT JOIN LATERAL (
+                SELECT json_agg(json_build_object(
+                           'obser_id', o.obser_id, 'date', o.obs_date, 'date_precision', o.obs_date_precision,
+                           'comment', o.obs_comment_text, 'file', {_file_json("o.obs_file_oid")},
+                           'diagnoses', COALESCE(dg.items, '[]'))
+                       ORDER BY o.obs_date NULLS LAST, o.obser_id) AS items
+                FROM observation o
+                LEFT JOIN LATERAL (
+                    SELECT json_agg(json_build_object(
+                               'diagn_id', g.diagn_id, 'date', g.diagn_date, 'date_precision', g.diagn_date_precision,
+                               'comment', g.diagn_comment_text, 'file', {_file_json("g.diagn_file_oid")})
+                           ORDER BY g.diagn_date NULLS LAST, g.diagn_id) AS items
+                    FROM diagnosis g
+                    WHERE g.obser_id = o.obser_id
+                ) dg ON true
+                WHERE o.appoint_id = a.appoint_id
+            ) obs ON true
+            WHERE a.patient_personnumer = pa.personnumer), '[]'))
+    FROM patient pa
+    JOIN person pe ON pe.personnumer = pa.personnumer
+    LEFT JOIN person dp ON dp.personnumer = pa.doctor_personnumer
+    WHERE pa.personnumer = %s
+"""
+
+def patient_timeline(personnumer: str) -> dict | None:
+    """The patient's appointments with their observations and those with their diagnoses, in one query.
+    Returns None for an unknown patient, otherwise a dict:
+        {personnumer, name, doctor_personnumer, doctor_name, appointments: [
+            {appoint_id, date, date_precision, start, end, location, doctor_personnumer, doctor_name, observations: [
+                {obser_id, date, date_precision, comment, file, diagnoses: [
+                    {diagn_id, date, date_precision, comment, file}]}]}]}
+    Dates and times are ISO strings (date is the first day of the known period, see date_precision),
+    file is None or {oid, size, stored_size, codec, text_kind}."""
+    with get_conn() as (conn, cur):
+        execute(cur, "patient_timeline", _TIMELINE_SQL, ((personnumer or "").strip(),))
+        row = cur.fetchone()
+        return row[0] if row else None
+
 
 #  DOCTORS 
+_DOCTOR_SELECT = """
+    SELECT DISTINCT
+           d.personnumer          AS doctor_personnumer,
+           dp.full_name           AS doctor_name,
+           d.dept_id,
+           p.personnumer          AS patient_personnumer,
+           pp.full_name           AS patient_name
+    FROM doctor d
+    JOIN person dp ON dp.personnumer = d.personnumer
+    LEFT JOIN patient p ON p.doctor_personnumer = d.personnumer
+    LEFT JOIN person pp ON pp.personnumer = p.personnumer
+"""
+_DOCTOR_FILTERS = (("dp.full_name", "ilike"), ("d.personnumer", "ilike"),
+                   ("pp.full_name", "ilike"), ("p.personnumer", "ilike"))
+# a doctor without patients has one row with a NULL patient, so coalesce it to keep the key non-null
+_DOCTOR_KEYS = ("doctor_personnumer", "COALESCE(patient_personnumer, '')")
+
 def doctor_view():
-    with get_conn() as (conn, cur):
-        cur.execute("""
-            SELECT DISTINCT
-                   d.personnumer          AS doctor_personnumer,
-                   dp.full_name           AS doctor_name,
-                   d.dept_id,
-                   p.personnumer          AS patient_personnumer,
-                   pp.full_name           AS patient_name
-            FROM doctor d
-            JOIN person dp ON dp.personnumer = d.personnumer
-            LEFT JOIN patient p ON p.doctor_personnumer = d.personnumer
-            LEFT JOIN person pp ON pp.personnumer = p.personnumer
-            ORDER BY d.personnumer;
-        """)
-        return cur.fetchall()
+    return doctor_search()
 
+@_cached("doctor", "person", "patient")
 def doctor_search(doctor_name="", doctor_personnumer="", patient_name="", patient_personnumer=""):
-    where, args = [], []
-    if doctor_name:
-        where.append("dp.full_name ILIKE %s");           args.append(f"%{doctor_name}%")
-    if doctor_personnumer:
-        where.append("d.personnumer ILIKE %s");          args.append(f"%{doctor_personnumer}%")
-    if patient_name:
-        where.append("pp.full_name ILIKE %s");           args.append(f"%{patient_name}%")
-    if patient_personnumer:
-        where.append("p.personnumer ILIKE %s");          args.append(f"%{patient_personnumer}%")
-    clause = " AND ".join(where) if where else "1=1"
-    with get_conn() as (conn, cur):
-        cur.execute(f"""
-            SELECT DISTINCT
-                   d.personnumer          AS doctor_personnumer,
-                   dp.full_name           AS doctor_name,
-                   d.dept_id,
-                   p.personnumer          AS patient_personnumer,
-                   pp.full_name           AS patient_name
-            FROM doctor d
-            JOIN person dp ON dp.personnumer = d.personnumer
-            LEFT JOIN patient p ON p.doctor_personnumer = d.personnumer
-            LEFT JOIN person pp ON pp.personnumer = p.personnumer
-            WHERE {clause}
-            ORDER BY d.personnumer;
-        """, tuple(args))
+    clause, args = _where(_DOCTOR_FILTERS, (doctor_name, doctor_personnumer, patient_name, patient_personnumer))
+    with get_conn() as (conn, cur):
+        execute(cur, "doctor_search", f"{_DOCTOR_SELECT} WHERE {clause} ORDER BY d.personnumer;", tuple(args))
         return cur.fetchall()
 
+@_cached("doctor", "person", "patient")
+def doctor_page(doctor_name="", doctor_personnumer="", patient_name="", patient_personnumer="",
+                *, page_size=PAGE_SIZE, after=None):
+    """One page of doctor_search. Returns (rows, next_cursor), next_cursor is None on the last page."""
+    clause, args = _where(_DOCTOR_FILTERS, (doctor_name, doctor_personnumer, patient_name, patient_personnumer))
+    return _page("doctor_page", _DOCTOR_SELECT, clause, args, _DOCTOR_KEYS, page_size, after)
+
+@_writes("person", "doctor", "patient")
 def doctor_insert(doctor_personnumer: str, doctor_name: str, dept_id: str | None):
     with get_conn() as (conn, cur):
         cur.execute("""
@@ -234,6 +821,7 @@ def doctor_insert(doctor_personnumer: str, doctor_name: str, dept_id: str | None
         """, (doctor_personnumer, (dept_id or None)))
         conn.commit()
 
+@_writes("person", "doctor", "patient")
 def doctor_update(doctor_personnumer: str,
                   new_dept_id: str | None = None,
                   new_doctor_name: str | None = None):
@@ -246,80 +834,205 @@ def doctor_update(doctor_personnumer: str,
                         (new_doctor_name, doctor_personnumer))
         conn.commit()
 
+@_writes("person", "doctor", "patient")
 def doctor_delete(doctor_personnumer: str):
     with get_conn() as (conn, cur):
         cur.execute("DELETE FROM doctor WHERE personnumer=%s", (doctor_personnumer,))
         conn.commit()
 
+@_writes("person", "doctor", "patient")
+def doctor_insert_many(rows, *, errors="raise"):
+    """Batch doctor_insert, see _write_many."""
+    return _write_many(doctor_insert, rows, (
+        "INSERT INTO person (personnumer, full_name) VALUES (%s, %s) ON CONFLICT (personnumer) DO NOTHING",
+        "INSERT INTO doctor (personnumer, dept_id) VALUES (%s, %s) ON CONFLICT (personnumer) DO NOTHING",
+    ), lambda a, _: ((a["doctor_personnumer"], a["doctor_name"]),
+                     (a["doctor_personnumer"], a["dept_id"] or None)), errors)
+
+@_writes("person", "doctor", "patient")
+def doctor_update_many(rows, *, errors="raise"):
+    """Batch doctor_update (blank fields are left unchanged), see _write_many."""
+    return _write_many(doctor_update, rows, (
+        "UPDATE doctor SET dept_id=COALESCE(%s, dept_id) WHERE personnumer=%s",
+        "UPDATE person SET full_name=COALESCE(%s, full_name) WHERE personnumer=%s",
+    ), lambda a, _: ((None if _is_blank(a["new_dept_id"]) else a["new_dept_id"], a["doctor_personnumer"]),
+                     (None if _is_blank(a["new_doctor_name"]) else a["new_doctor_name"],
+                      a["doctor_personnumer"])), errors)
+
+@_writes("person", "doctor", "patient")
+def doctor_delete_many(doctor_personnumers) -> int:
+    """Delete all given doctors in one statement, returns how many were deleted."""
+    return _delete_many("doctor", "personnumer", doctor_personnumers)
+
 #  APPOINTMENTS 
+_APPOINTMENT_SELECT = """
+    SELECT a.appoint_id, a.appoint_year, a.appoint_month, a.appoint_day, a.appoint_location,
+           p.personnumer AS patient_personnumer, pp.full_name AS patient_name,
+           d.personnumer AS doctor_personnumer, dp.full_name AS doctor_name,
+           a.appoint_start, a.appoint_end
+    FROM appointment a
+    LEFT JOIN patient p ON p.personnumer = a.patient_personnumer
+    LEFT JOIN person  pp ON pp.personnumer = p.personnumer
+    LEFT JOIN doctor  d  ON d.personnumer  = a.doctor_personnumer
+    LEFT JOIN person  dp ON dp.personnumer = d.personnumer
+"""
+_APPOINTMENT_ORDER = "a.appoint_year NULLS LAST, a.appoint_month NULLS LAST, a.appoint_day NULLS LAST, a.appoint_id"
+_APPOINTMENT_FILTERS = (("a.appoint_id", "ilike"), ("a.appoint_year", "eq"), ("a.appoint_month", "eq"),
+                        ("a.appoint_day", "eq"), ("pp.full_name", "ilike"), ("p.personnumer", "ilike"),
+                        ("dp.full_name", "ilike"), ("d.personnumer", "ilike"))
+# same order as _APPOINTMENT_ORDER, missing date parts sort last like NULLS LAST does
+_APPOINTMENT_KEYS = ("COALESCE(appoint_year, 2147483647)", "COALESCE(appoint_month, 2147483647)",
+                     "COALESCE(appoint_day, 2147483647)", "appoint_id")
+
 def appointment_view():
-    with get_conn() as (conn, cur):
-        cur.execute("""
-            SELECT a.appoint_id, a.appoint_year, a.appoint_month, a.appoint_day, a.appoint_location,
-                   p.personnumer AS patient_personnumer, pp.full_name AS patient_name,
-                   d.personnumer AS doctor_personnumer, dp.full_name AS doctor_name
-            FROM appointment a
-            LEFT JOIN patient p ON p.personnumer = a.patient_personnumer
-            LEFT JOIN person  pp ON pp.personnumer = p.personnumer
-            LEFT JOIN doctor  d  ON d.personnumer  = a.doctor_personnumer
-            LEFT JOIN person  dp ON dp.personnumer = d.personnumer
-            ORDER BY a.appoint_year NULLS LAST, a.appoint_month NULLS LAST, a.appoint_day NULLS LAST, a.appoint_id;
-        """)
-        return cur.fetchall()
+    return appointment_search()
 
 def appointment_search(appoint_id="", year="", month="", day="",
                        patient_name="", patient_personnumer="",
                        doctor_name="", doctor_personnumer=""):
+    clause, args = _where(_APPOINTMENT_FILTERS, (appoint_id, year, month, day, patient_name,
+                                                 patient_personnumer, doctor_name, doctor_personnumer))
+    with get_conn() as (conn, cur):
+        execute(cur, "appointment_search", f"{_APPOINTMENT_SELECT} WHERE {clause} ORDER BY {_APPOINTMENT_ORDER};", tuple(args))
+        return cur.fetchall()
+
+def appointment_page(appoint_id="", year="", month="", day="",
+                     patient_name="", patient_personnumer="",
+                     doctor_name="", doctor_personnumer="",
+                     *, page_size=PAGE_SIZE, after=None):
+    """One page of appointment_search. Returns (rows, next_cursor), next_cursor is None on the last page."""
+    clause, args = _where(_APPOINTMENT_FILTERS, (appoint_id, year, month, day, patient_name,
+                                                 patient_personnumer, doctor_name, doctor_personnumer))
+    return _page("appointment_page", _APPOINTMENT_SELECT, clause, args, _APPOINTMENT_KEYS, page_size, after)
+
+def appointment_between(date_from, date_to, *, doctor_personnumer=None, dept_id=None, exact_only=False):
+    """Appointments dated date_from..date_to (inclusive, date or 'YYYY-MM-DD'), same columns as appointment_search.
+    doctor_personnumer / dept_id narrow it to one doctor or the doctors of one department."""
     where, args = [], []
-    if appoint_id:
-        where.append("a.appoint_id ILIKE %s");     args.append(f"%{appoint_id}%")
-    if year:
-        where.append("a.appoint_year = %s");       args.append(_to_int(year))
-    if month:
-        where.append("a.appoint_month = %s");      args.append(_to_int(month))
-    if day:
-        where.append("a.appoint_day = %s");        args.append(_to_int(day))
-    if patient_name:
-        where.append("pp.full_name ILIKE %s");     args.append(f"%{patient_name}%")
-    if patient_personnumer:
-        where.append("p.personnumer ILIKE %s");    args.append(f"%{patient_personnumer}%")
-    if doctor_name:
-        where.append("dp.full_name ILIKE %s");     args.append(f"%{doctor_name}%")
-    if doctor_personnumer:
-        where.append("d.personnumer ILIKE %s");    args.append(f"%{doctor_personnumer}%")
-    clause = " AND ".join(where) if where else "1=1"
-    with get_conn() as (conn, cur):
-        cur.execute(f"""
-            SELECT a.appoint_id, a.appoint_year, a.appoint_month, a.appoint_day, a.appoint_location,
-                   p.personnumer AS patient_personnumer, pp.full_name AS patient_name,
-                   d.personnumer AS doctor_personnumer, dp.full_name AS doctor_name
+    if not _is_blank(doctor_personnumer):
+        where.append("a.doctor_personnumer = %s"); args.append(doctor_personnumer)
+    if not _is_blank(dept_id):
+        where.append("a.doctor_personnumer IN (SELECT personnumer FROM doctor WHERE dept_id = %s)"); args.append(dept_id)
+    return _between(_APPOINTMENT_SELECT, "a.appoint_date", "a.appoint_date_precision",
+                    "a.appoint_start NULLS LAST, a.appoint_id", date_from, date_to, exact_only, where, args)
+
+# a doctor's working day (Mon-Fri) counts as full with this many appointments
+APPOINTMENTS_PER_DAY = 8
+
+def appointment_free_slots(dept_id: str, date_from, date_to, *, per_day: int = APPOINTMENTS_PER_DAY):
+    """Working days in date_from..date_to on which a doctor of department dept_id still has room.
+    Returns (doctor_personnumer, doctor_name, date, booked, free) ordered by date and doctor."""
+    lo, hi = _date_arg(date_from, "date_from"), _date_arg(date_to, "date_to")
+    with get_conn() as (conn, cur):
+        # the per-day counts are index lookups on appointment_doctor_date
+        cur.execute("""
+            SELECT d.personnumer, p.full_name, day::date, b.booked, %s - b.booked
+            FROM doctor d
+            JOIN person p ON p.personnumer = d.personnumer
+            CROSS JOIN generate_series(%s::date, %s::date, interval '1 day') day
+            CROSS JOIN LATERAL (SELECT count(*) AS booked FROM appointment a
+                                WHERE a.doctor_personnumer = d.personnumer
+                                  AND a.appoint_date = day::date AND a.appoint_date_precision = 'day') b
+            WHERE d.dept_id = %s AND extract(isodow FROM day) < 6 AND b.booked < %s
+            ORDER BY day, d.personnumer
+        """, (per_day, lo, hi, dept_id, per_day))
+        return cur.fetchall()
+
+def appointment_iter(appoint_id="", year="", month="", day="",
+                     patient_name="", patient_personnumer="",
+                     doctor_name="", doctor_personnumer="",
+                     *, itersize=STREAM_ITERSIZE):
+    """Generator over the appointment_search rows, streamed from a server-side cursor."""
+    clause, args = _where(_APPOINTMENT_FILTERS, (appoint_id, year, month, day, patient_name,
+                                                 patient_personnumer, doctor_name, doctor_personnumer))
+    return _stream("appointment_iter", _APPOINTMENT_SELECT, clause, args, _APPOINTMENT_ORDER, itersize)
+
+# appointment times: "HH:MM" strings or datetime.time, blank means no time.
+# A doctor cannot have two appointments whose start..end overlap on the same day (exclusion constraint
+# appointment_no_double_booking), appointments without a full date or without both times are not checked.
+def _time_arg(v, name):
+    if _is_blank(v):
+        return None
+    if isinstance(v, time):
+        return v
+    try:
+        h, _, m = str(v).strip().partition(":")
+        return time(int(h), int(m or 0))
+    except ValueError:
+        raise ValueError(f"{name} must be a time (HH:MM).")
+
+def _booking_error(e):
+    # the booking constraints as the ValueError the UI shows, None for any other error
+    if isinstance(e, psycopg.errors.ExclusionViolation):
+        return ValueError(f"doctor is already booked at that time. {e.diag.message_detail or ''}")
+    if isinstance(e, psycopg.errors.CheckViolation) and e.diag.constraint_name == "appointment_time_order":
+        return ValueError("appointment end time must be after its start time.")
+    return None
+
+def _booking_execute(cur, query, args):
+    try:
+        cur.execute(query, args)
+    except psycopg.Error as e:
+        err = _booking_error(e)
+        if err is None:
+            raise
+        raise err from None
+
+def appointment_conflicts(doctor_personnumer: str | None, year, month, day, start_time, end_time,
+                          *, appoint_id: str | None = None):
+    """Appointments of the doctor overlapping the slot, as (appoint_id, start, end, patient_name) rows.
+    With appoint_id (checking an update) that appointment is left out and blank fields are taken from it.
+    Returns [] while the slot is incomplete, so the UI can call it as the user types."""
+    with get_conn() as (conn, cur):
+        doctor, y, m, d = doctor_personnumer, _part(year), _part(month), _part(day)
+        start, end = _time_arg(start_time, "start time"), _time_arg(end_time, "end time")
+        if not _is_blank(appoint_id):
+            cur.execute("""SELECT doctor_personnumer, appoint_year, appoint_month, appoint_day, appoint_start, appoint_end
+                           FROM appointment WHERE appoint_id=%s""", (appoint_id,))
+            row = cur.fetchone()
+            if row:
+                doctor = row[0] if _is_blank(doctor) else doctor
+                y, m, d = (y if y is not None else row[1]), (m if m is not None else row[2]), (d if d is not None else row[3])
+                start, end = start or row[4], end or row[5]
+        if _is_blank(doctor) or None in (y, m, d, start, end):
+            return []
+        validate_date_parts(y, m, d, label="appointment date")
+        if end <= start:
+            raise ValueError("appointment end time must be after its start time.")
+        day_ = date(y, m, d)
+        # && on appoint_slot is answered by the GiST index behind the exclusion constraint
+        cur.execute("""
+            SELECT a.appoint_id, a.appoint_start, a.appoint_end, pp.full_name
             FROM appointment a
-            LEFT JOIN patient p ON p.personnumer = a.patient_personnumer
-            LEFT JOIN person  pp ON pp.personnumer = p.personnumer
-            LEFT JOIN doctor  d  ON d.personnumer  = a.doctor_personnumer
-            LEFT JOIN person  dp ON dp.personnumer = d.personnumer
-            WHERE {clause}
-            ORDER BY a.appoint_year NULLS LAST, a.appoint_month NULLS LAST, a.appoint_day NULLS LAST, a.appoint_id;
-        """, tuple(args))
+            LEFT JOIN person pp ON pp.personnumer = a.patient_personnumer
+            WHERE a.doctor_personnumer = %s AND a.appoint_slot && tsrange(%s, %s)
+              AND a.appoint_id IS DISTINCT FROM %s
+            ORDER BY a.appoint_start
+        """, (doctor, datetime.combine(day_, start), datetime.combine(day_, end), appoint_id or None))
         return cur.fetchall()
 
 def appointment_insert(appoint_id: str, year: str, month: str, day: str,
-                       location: str, patient_personnumer: str | None, doctor_personnumer: str | None):
+                       location: str, patient_personnumer: str | None, doctor_personnumer: str | None,
+                       start_time: str | None = None, end_time: str | None = None):
     y, m, d = validate_date_parts(year, month, day, label="appointment date")
+    start, end = _time_arg(start_time, "start time"), _time_arg(end_time, "end time")
     with get_conn() as (conn, cur):
-        cur.execute("""
+        _booking_execute(cur, """
             INSERT INTO appointment (appoint_id, appoint_year, appoint_month, appoint_day,
-                                     appoint_location, patient_personnumer, doctor_personnumer)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
+                                     appoint_location, patient_personnumer, doctor_personnumer,
+                                     appoint_start, appoint_end)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
         """, (appoint_id, y, m, d, (location or None),
-              (patient_personnumer or None), (doctor_personnumer or None)))
+              (patient_personnumer or None), (doctor_personnumer or None), start, end))
         conn.commit()
 
 def appointment_update(appoint_id: str, year: str | None = None, month: str | None = None, day: str | None = None,
-                       location: str | None = None, patient_personnumer: str | None = None, doctor_personnumer: str | None = None):
+                       location: str | None = None, patient_personnumer: str | None = None, doctor_personnumer: str | None = None,
+                       start_time: str | None = None, end_time: str | None = None):
     y_in = None if _is_blank(year)  else _to_int(year) if isinstance(year, str)  else year
     m_in = None if _is_blank(month) else _to_int(month) if isinstance(month, str) else month
     d_in = None if _is_blank(day)   else _to_int(day) if isinstance(day, str)   else day
+    start_in, end_in = _time_arg(start_time, "start time"), _time_arg(end_time, "end time")
 
     with get_conn() as (conn, cur):
         # If any date piece is provided, fetch missing pieces and validate the merged 
@@ -342,11 +1055,13 @@ def appointment_update(appoint_id: str, year: str | None = None, month: str | No
         if not _is_blank(location):          sets.append("appoint_location=%s");    args.append(location)
         if not _is_blank(patient_personnumer): sets.append("patient_personnumer=%s"); args.append(patient_personnumer)
         if not _is_blank(doctor_personnumer):  sets.append("doctor_personnumer=%s");  args.append(doctor_personnumer)
+        if start_in is not None:             sets.append("appoint_start=%s");       args.append(start_in)
+        if end_in is not None:               sets.append("appoint_end=%s");         args.append(end_in)
 
         if not sets:
             return
         args.append(appoint_id)
-        cur.execute(f"UPDATE appointment SET {', '.join(sets)} WHERE appoint_id=%s", tuple(args))
+        _booking_execute(cur, f"UPDATE appointment SET {', '.join(sets)} WHERE appoint_id=%s", tuple(args))
         conn.commit()
 
 
@@ -355,267 +1070,483 @@ def appointment_delete(appoint_id: str):
         cur.execute("DELETE FROM appointment WHERE appoint_id=%s", (appoint_id,))
         conn.commit()
 
+def appointment_insert_many(rows, *, errors="raise"):
+    """Batch appointment_insert, see _write_many."""
+    def prepare(a, _):
+        y, m, d = validate_date_parts(a["year"], a["month"], a["day"], label="appointment date")
+        return ((a["appoint_id"], y, m, d, a["location"] or None,
+                 a["patient_personnumer"] or None, a["doctor_personnumer"] or None,
+                 _time_arg(a["start_time"], "start time"), _time_arg(a["end_time"], "end time")),)
+    return _write_many(appointment_insert, rows, ("""
+        INSERT INTO appointment (appoint_id, appoint_year, appoint_month, appoint_day,
+                                 appoint_location, patient_personnumer, doctor_personnumer,
+                                 appoint_start, appoint_end)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """,), prepare, errors, translate=_booking_error)
+
+def appointment_update_many(rows, *, errors="raise"):
+    """Batch appointment_update (blank fields are left unchanged), see _write_many."""
+    def prepare(a, stored):
+        y, m, d = _merged_date(a, stored, "appoint_id", "appointment")
+        blank = lambda v: None if _is_blank(v) else v
+        return ((y, m, d, blank(a["location"]), blank(a["patient_personnumer"]),
+                 blank(a["doctor_personnumer"]), _time_arg(a["start_time"], "start time"),
+                 _time_arg(a["end_time"], "end time"), a["appoint_id"]),)
+    return _write_many(appointment_update, rows, ("""
+        UPDATE appointment SET appoint_year=COALESCE(%s, appoint_year), appoint_month=COALESCE(%s, appoint_month),
+               appoint_day=COALESCE(%s, appoint_day), appoint_location=COALESCE(%s, appoint_location),
+               patient_personnumer=COALESCE(%s, patient_personnumer), doctor_personnumer=COALESCE(%s, doctor_personnumer),
+               appoint_start=COALESCE(%s, appoint_start), appoint_end=COALESCE(%s, appoint_end)
+        WHERE appoint_id=%s
+    """,), prepare, errors,
+        _stored_dates("appointment", "appoint_id", ("appoint_year", "appoint_month", "appoint_day"), "appoint_id"),
+        _booking_error)
+
+def appointment_delete_many(appoint_ids) -> int:
+    """Delete all given appointments in one statement, returns how many were deleted."""
+    return _delete_many("appointment", "appoint_id", appoint_ids)
+
 # OBSERVATIONS 
+_OBSERVATION_SELECT = """
+    SELECT o.obser_id, o.obs_year, o.obs_month, o.obs_day,
+           o.appoint_id,
+           p.personnumer AS patient_personnumer, pp.full_name AS patient_name,
+           d.personnumer AS doctor_personnumer, dp.full_name AS doctor_name,
+           o.obs_comment_text,
+           o.obs_file_oid
+    FROM observation o
+    LEFT JOIN appointment a ON a.appoint_id = o.appoint_id
+    LEFT JOIN patient p ON p.personnumer = a.patient_personnumer
+    LEFT JOIN person pp ON pp.personnumer = p.personnumer
+    LEFT JOIN doctor d ON d.personnumer = a.doctor_personnumer
+    LEFT JOIN person dp ON dp.personnumer = d.personnumer
+"""
+_OBSERVATION_FILTERS = (("o.obser_id", "ilike"), ("o.obs_year", "eq"), ("o.obs_month", "eq"),
+                        ("o.obs_day", "eq"), ("o.appoint_id", "ilike"), ("pp.full_name", "ilike"),
+                        ("p.personnumer", "ilike"), ("dp.full_name", "ilike"), ("d.personnumer", "ilike"))
+_OBSERVATION_ORDER = "o.obser_id"
+_OBSERVATION_KEYS = ("obser_id",)
+
+# the listings read the observation_read / diagnosis_read read models (see bootstrap_db), the same rows with
+# the joins already done. Set USE_READ_MODELS = False (or USE_READ_MODELS=0 in the environment) to use the live joins.
+_OBSERVATION_READ_SELECT = """
+    SELECT o.obser_id, o.obs_year, o.obs_month, o.obs_day, o.appoint_id,
+           o.patient_personnumer, o.patient_name, o.doctor_personnumer, o.doctor_name,
+           o.obs_comment_text, o.obs_file_oid
+    FROM observation_read o
+"""
+_OBSERVATION_READ_FILTERS = (("o.obser_id", "ilike"), ("o.obs_year", "eq"), ("o.obs_month", "eq"),
+                             ("o.obs_day", "eq"), ("o.appoint_id", "ilike"), ("o.patient_name", "ilike"),
+                             ("o.patient_personnumer", "ilike"), ("o.doctor_name", "ilike"),
+                             ("o.doctor_personnumer", "ilike"))
+
+def _observation_source():
+    if USE_READ_MODELS:
+        return _OBSERVATION_READ_SELECT, _OBSERVATION_READ_FILTERS
+    return _OBSERVATION_SELECT, _OBSERVATION_FILTERS
+
 def observation_view():
-    with get_conn() as (conn, cur):
-        cur.execute("""
-            SELECT o.obser_id, o.obs_year, o.obs_month, o.obs_day,
-                   o.appoint_id,
-                   p.personnumer AS patient_personnumer, pp.full_name AS patient_name,
-                   d.personnumer AS doctor_personnumer, dp.full_name AS doctor_name,
-                   o.obs_comment_text,
-                   o.obs_file_oid
-            FROM observation o
-            LEFT JOIN appointment a ON a.appoint_id = o.appoint_id
-            LEFT JOIN patient p ON p.personnumer = a.patient_personnumer
-            LEFT JOIN person pp ON pp.personnumer = p.personnumer
-            LEFT JOIN doctor d ON d.personnumer = a.doctor_personnumer
-            LEFT JOIN person dp ON dp.personnumer = d.personnumer
-            ORDER BY o.obser_id;
-        """)
-        return cur.fetchall()
+    return observation_search()
 
 def observation_search(obser_id="", year="", month="", day="", appoint_id="",
                        patient_name="", patient_personnumer="",
                        doctor_name="", doctor_personnumer=""):
-    where, args = [], []
-    if obser_id:
-        where.append("o.obser_id ILIKE %s");       args.append(f"%{obser_id}%")
-    if year:
-        where.append("o.obs_year = %s");          args.append(_to_int(year))
-    if month:
-        where.append("o.obs_month = %s");         args.append(_to_int(month))
-    if day:
-        where.append("o.obs_day = %s");           args.append(_to_int(day))
-    if appoint_id:
-        where.append("o.appoint_id ILIKE %s");    args.append(f"%{appoint_id}%")
-    if patient_name:
-        where.append("pp.full_name ILIKE %s");    args.append(f"%{patient_name}%")
-    if patient_personnumer:
-        where.append("p.personnumer ILIKE %s");   args.append(f"%{patient_personnumer}%")
-    if doctor_name:
-        where.append("dp.full_name ILIKE %s");    args.append(f"%{doctor_name}%")
-    if doctor_personnumer:
-        where.append("d.personnumer ILIKE %s");   args.append(f"%{doctor_personnumer}%")
-    clause = " AND ".join(where) if where else "1=1"
-    with get_conn() as (conn, cur):
-        cur.execute(f"""
-            SELECT o.obser_id, o.obs_year, o.obs_month, o.obs_day,
-                   o.appoint_id,
-                   p.personnumer AS patient_personnumer, pp.full_name AS patient_name,
-                   d.personnumer AS doctor_personnumer, dp.full_name AS doctor_name,
-                   o.obs_comment_text, o.obs_file_oid
-            FROM observation o
-            LEFT JOIN appointment a ON a.appoint_id = o.appoint_id
-            LEFT JOIN patient p ON p.personnumer = a.patient_personnumer
-            LEFT JOIN person pp ON pp.personnumer = p.personnumer
-            LEFT JOIN doctor d ON d.personnumer = a.doctor_personnumer
-            LEFT JOIN person dp ON dp.personnumer = d.personnumer
-            WHERE {clause}
-            ORDER BY o.obser_id;
-        """, tuple(args))
+    select, filters = _observation_source()
+    clause, args = _where(filters, (obser_id, year, month, day, appoint_id, patient_name,
+                                                 patient_personnumer, doctor_name, doctor_personnumer))
+    with get_conn() as (conn, cur):
+        execute(cur, "observation_search", f"{select} WHERE {clause} ORDER BY {_OBSERVATION_ORDER};", tuple(args))
         return cur.fetchall()
 
+def observation_page(obser_id="", year="", month="", day="", appoint_id="",
+                     patient_name="", patient_personnumer="",
+                     doctor_name="", doctor_personnumer="",
+                     *, page_size=PAGE_SIZE, after=None):
+    """One page of observation_search. Returns (rows, next_cursor), next_cursor is None on the last page."""
+    select, filters = _observation_source()
+    clause, args = _where(filters, (obser_id, year, month, day, appoint_id, patient_name,
+                                                 patient_personnumer, doctor_name, doctor_personnumer))
+    return _page("observation_page", select, clause, args, _OBSERVATION_KEYS, page_size, after)
+
+def observation_between(date_from, date_to, *, exact_only=False):
+    """Observations dated date_from..date_to (inclusive), same columns as observation_search."""
+    return _between(_OBSERVATION_SELECT, "o.obs_date", "o.obs_date_precision", "o.obser_id",
+                    date_from, date_to, exact_only)
+
+def observation_text_page(q: str, *, files: bool = True, page_size=PAGE_SIZE, after=None):
+    """Observations whose comment (or attached file) matches q, ranked.
+    Returns (rows, next_cursor), rows are (rank, snippet, ...observation_search columns)."""
+    return _text_page(_observation_source()[0], "observation", "obser_id", "obs_comment_tsv", "obs_comment_text",
+                      "obs_file_oid", q, files, page_size, after)
+
+def observation_text_search(q: str, *, files: bool = True, limit: int = 50):
+    """The best limit matches of observation_text_page."""
+    return observation_text_page(q, files=files, page_size=limit)[0]
+
+def observation_iter(obser_id="", year="", month="", day="", appoint_id="",
+                     patient_name="", patient_personnumer="",
+                     doctor_name="", doctor_personnumer="",
+                     *, itersize=STREAM_ITERSIZE):
+    """Generator over the observation_search rows, streamed from a server-side cursor."""
+    select, filters = _observation_source()
+    clause, args = _where(filters, (obser_id, year, month, day, appoint_id, patient_name,
+                                                 patient_personnumer, doctor_name, doctor_personnumer))
+    return _stream("observation_iter", select, clause, args, _OBSERVATION_ORDER, itersize)
+
+def _observation_insert(cur, obser_id: str, year: str, month: str, day: str,
+                        appoint_id: str | None,
+                        comment_text: str | None,
+                        file_oid: int | None):
+    y, m, d = validate_date_parts(year, month, day, label="observation date")
+    cur.execute("""
+        INSERT INTO observation (obser_id, obs_year, obs_month, obs_day, appoint_id,
+                                 obs_comment_text, obs_file_oid)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, (obser_id, y, m, d, (appoint_id or None), (comment_text or None), file_oid))
+
 def observation_insert(obser_id: str, year: str, month: str, day: str,
                        appoint_id: str | None,
                        comment_text: str | None,
                        file_oid: int | None):
-    y, m, d = validate_date_parts(year, month, day, label="observation date")
     with get_conn() as (conn, cur):
-        cur.execute("""
-            INSERT INTO observation (obser_id, obs_year, obs_month, obs_day, appoint_id,
-                                     obs_comment_text, obs_file_oid)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (obser_id, y, m, d, (appoint_id or None), (comment_text or None), file_oid))
+        _observation_insert(cur, obser_id, year, month, day, appoint_id, comment_text, file_oid)
         conn.commit()
 
-def observation_update(obser_id: str, year: str | None = None, month: str | None = None, day: str | None = None,
-                       appoint_id: str | None = None,
-                       comment_text: str | None = None,
-                       file_oid: int | None = None):
+def _observation_update(cur, obser_id: str, year: str | None = None, month: str | None = None, day: str | None = None,
+                        appoint_id: str | None = None,
+                        comment_text: str | None = None,
+                        file_oid: int | None = None):
     y_in = None if _is_blank(year)  else _to_int(year) if isinstance(year, str)  else year
     m_in = None if _is_blank(month) else _to_int(month) if isinstance(month, str) else month
     d_in = None if _is_blank(day)   else _to_int(day) if isinstance(day, str)   else day
 
-    with get_conn() as (conn, cur):
-        if y_in is not None or m_in is not None or d_in is not None:
-            cur.execute("""SELECT obs_year, obs_month, obs_day
-                           FROM observation WHERE obser_id=%s""", (obser_id,))
-            row = cur.fetchone()
-            if row is None:
-                raise ValueError("observation not found")
-            base_y, base_m, base_d = row
-            merged_y = y_in if y_in is not None else base_y
-            merged_m = m_in if m_in is not None else base_m
-            merged_d = d_in if d_in is not None else base_d
-            validate_date_parts(merged_y, merged_m, merged_d, label="observation date")
+    if y_in is not None or m_in is not None or d_in is not None:
+        cur.execute("""SELECT obs_year, obs_month, obs_day
+                       FROM observation WHERE obser_id=%s""", (obser_id,))
+        row = cur.fetchone()
+        if row is None:
+            raise ValueError("observation not found")
+        base_y, base_m, base_d = row
+        merged_y = y_in if y_in is not None else base_y
+        merged_m = m_in if m_in is not None else base_m
+        merged_d = d_in if d_in is not None else base_d
+        validate_date_parts(merged_y, merged_m, merged_d, label="observation date")
 
-        sets, args = [], []
-        if y_in is not None:               sets.append("obs_year=%s");          args.append(y_in)
-        if m_in is not None:               sets.append("obs_month=%s");         args.append(m_in)
-        if d_in is not None:               sets.append("obs_day=%s");           args.append(d_in)
-        if not _is_blank(appoint_id):      sets.append("appoint_id=%s");        args.append(appoint_id)
-        if comment_text is not None:       sets.append("obs_comment_text=%s");  args.append(comment_text)
-        if file_oid is not None:           sets.append("obs_file_oid=%s");      args.append(file_oid)
+    sets, args = [], []
+    if y_in is not None:               sets.append("obs_year=%s");          args.append(y_in)
+    if m_in is not None:               sets.append("obs_month=%s");         args.append(m_in)
+    if d_in is not None:               sets.append("obs_day=%s");           args.append(d_in)
+    if not _is_blank(appoint_id):      sets.append("appoint_id=%s");        args.append(appoint_id)
+    if comment_text is not None:       sets.append("obs_comment_text=%s");  args.append(comment_text)
+    if file_oid is not None:           sets.append("obs_file_oid=%s");      args.append(file_oid)
 
-        if not sets:
-            return
-        args.append(obser_id)
-        cur.execute(f"UPDATE observation SET {', '.join(sets)} WHERE obser_id=%s", tuple(args))
+    if not sets:
+        return
+    args.append(obser_id)
+    cur.execute(f"UPDATE observation SET {', '.join(sets)} WHERE obser_id=%s", tuple(args))
+
+def observation_update(obser_id: str, year: str | None = None, month: str | None = None, day: str | None = None,
+                       appoint_id: str | None = None,
+                       comment_text: str | None = None,
+                       file_oid: int | None = None):
+    with get_conn() as (conn, cur):
+        _observation_update(cur, obser_id, year, month, day, appoint_id, comment_text, file_oid)
         conn.commit()
 
+# the *_with_file variants stream the file into a Large Object and write the row in the same
+# transaction, so a failed save rolls back the object too instead of leaving it orphaned
+def observation_insert_with_file(obser_id: str, year: str, month: str, day: str,
+                                 appoint_id: str | None,
+                                 comment_text: str | None,
+                                 file_path: str | None,
+                                 *, chunk_size: int = LO_CHUNK_SIZE, progress=None):
+    validate_date_parts(year, month, day, label="observation date")   # fail before uploading
+    with get_conn() as (conn, cur):
+        file_oid = _lo_write_path(cur, file_path, chunk_size=chunk_size, progress=progress) if file_path else None
+        _observation_insert(cur, obser_id, year, month, day, appoint_id, comment_text, file_oid)
+        conn.commit()
+
+def observation_update_with_file(obser_id: str, year: str | None = None, month: str | None = None, day: str | None = None,
+                                 appoint_id: str | None = None,
+                                 comment_text: str | None = None,
+                                 file_path: str | None = None,
+                                 *, chunk_size: int = LO_CHUNK_SIZE, progress=None):
+    with get_conn() as (conn, cur):
+        _observation_update(cur, obser_id, year, month, day, appoint_id, comment_text, None)
+        if file_path:
+            file_oid = _lo_write_path(cur, file_path, chunk_size=chunk_size, progress=progress)
+            cur.execute("UPDATE observation SET obs_file_oid=%s WHERE obser_id=%s", (file_oid, obser_id))
+            if cur.rowcount == 0:
+                raise ValueError("observation not found")
+        conn.commit()
 
 def observation_delete(obser_id: str):
     with get_conn() as (conn, cur):
         cur.execute("DELETE FROM observation WHERE obser_id=%s", (obser_id,))
         conn.commit()
 
+def observation_insert_many(rows, *, errors="raise"):
+    """Batch observation_insert, see _write_many."""
+    def prepare(a, _):
+        y, m, d = validate_date_parts(a["year"], a["month"], a["day"], label="observation date")
+        return ((a["obser_id"], y, m, d, a["appoint_id"] or None, a["comment_text"] or None, a["file_oid"]),)
+    return _write_many(observation_insert, rows, ("""
+        INSERT INTO observation (obser_id, obs_year, obs_month, obs_day, appoint_id,
+                                 obs_comment_text, obs_file_oid)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """,), prepare, errors)
+
+def observation_update_many(rows, *, errors="raise"):
+    """Batch observation_update (blank fields are left unchanged), see _write_many."""
+    def prepare(a, stored):
+        y, m, d = _merged_date(a, stored, "obser_id", "observation")
+        return ((y, m, d, None if _is_blank(a["appoint_id"]) else a["appoint_id"],
+                 a["comment_text"], a["file_oid"], a["obser_id"]),)
+    return _write_many(observation_update, rows, ("""
+        UPDATE observation SET obs_year=COALESCE(%s, obs_year), obs_month=COALESCE(%s, obs_month),
+               obs_day=COALESCE(%s, obs_day), appoint_id=COALESCE(%s, appoint_id),
+               obs_comment_text=COALESCE(%s, obs_comment_text), obs_file_oid=COALESCE(%s, obs_file_oid)
+        WHERE obser_id=%s
+    """,), prepare, errors,
+        _stored_dates("observation", "obser_id", ("obs_year", "obs_month", "obs_day"), "obser_id"))
+
+def observation_delete_many(obser_ids) -> int:
+    """Delete all given observations in one statement, returns how many were deleted."""
+    return _delete_many("observation", "obser_id", obser_ids)
+
 # DIAGNOSES 
+_DIAGNOSIS_SELECT = """
+    SELECT dg.diagn_id, dg.diagn_year, dg.diagn_month, dg.diagn_day,
+           dg.obser_id, o.appoint_id,
+           p.personnumer AS patient_personnumer, pp.full_name AS patient_name,
+           d.personnumer AS doctor_personnumer, dp.full_name AS doctor_name,
+           dg.diagn_comment_text, dg.diagn_file_oid
+    FROM diagnosis dg
+    LEFT JOIN observation o ON o.obser_id = dg.obser_id
+    LEFT JOIN appointment a ON a.appoint_id = o.appoint_id
+    LEFT JOIN patient p ON p.personnumer = a.patient_personnumer
+    LEFT JOIN person pp ON pp.personnumer = p.personnumer
+    LEFT JOIN doctor d ON d.personnumer = a.doctor_personnumer
+    LEFT JOIN person dp ON dp.personnumer = d.personnumer
+"""
+_DIAGNOSIS_FILTERS = (("dg.diagn_id", "ilike"), ("dg.diagn_year", "eq"), ("dg.diagn_month", "eq"),
+                      ("dg.diagn_day", "eq"), ("dg.obser_id", "ilike"), ("o.appoint_id", "ilike"),
+                      ("pp.full_name", "ilike"), ("p.personnumer", "ilike"),
+                      ("dp.full_name", "ilike"), ("d.personnumer", "ilike"))
+_DIAGNOSIS_ORDER = "dg.diagn_id"
+_DIAGNOSIS_KEYS = ("diagn_id",)
+
+_DIAGNOSIS_READ_SELECT = """
+    SELECT dg.diagn_id, dg.diagn_year, dg.diagn_month, dg.diagn_day,
+           dg.obser_id, dg.appoint_id,
+           dg.patient_personnumer, dg.patient_name, dg.doctor_personnumer, dg.doctor_name,
+           dg.diagn_comment_text, dg.diagn_file_oid
+    FROM diagnosis_read dg
+"""
+_DIAGNOSIS_READ_FILTERS = (("dg.diagn_id", "ilike"), ("dg.diagn_year", "eq"), ("dg.diagn_month", "eq"),
+                           ("dg.diagn_day", "eq"), ("dg.obser_id", "ilike"), ("dg.appoint_id", "ilike"),
+                           ("dg.patient_name", "ilike"), ("dg.patient_personnumer", "ilike"),
+                           ("dg.doctor_name", "ilike"), ("dg.doctor_personnumer", "ilike"))
+
+def _diagnosis_source():
+    if USE_READ_MODELS:
+        return _DIAGNOSIS_READ_SELECT, _DIAGNOSIS_READ_FILTERS
+    return _DIAGNOSIS_SELECT, _DIAGNOSIS_FILTERS
+
 def diagnosis_view():
-    with get_conn() as (conn, cur):
-        cur.execute("""
-            SELECT dg.diagn_id, dg.diagn_year, dg.diagn_month, dg.diagn_day,
-                   dg.obser_id, o.appoint_id,
-                   p.personnumer AS patient_personnumer, pp.full_name AS patient_name,
-                   d.personnumer AS doctor_personnumer, dp.full_name AS doctor_name,
-                   dg.diagn_comment_text, dg.diagn_file_oid
-            FROM diagnosis dg
-            LEFT JOIN observation o ON o.obser_id = dg.obser_id
-            LEFT JOIN appointment a ON a.appoint_id = o.appoint_id
-            LEFT JOIN patient p ON p.personnumer = a.patient_personnumer
-            LEFT JOIN person pp ON pp.personnumer = p.personnumer
-            LEFT JOIN doctor d ON d.personnumer = a.doctor_personnumer
-            LEFT JOIN person dp ON dp.personnumer = d.personnumer
-            ORDER BY dg.diagn_id;
-        """)
-        return cur.fetchall()
+    return diagnosis_search()
 
 def diagnosis_search(diagn_id="", year="", month="", day="", obser_id="", appoint_id="",
                      patient_name="", patient_personnumer="",
                      doctor_name="", doctor_personnumer=""):
-    where, args = [], []
-    if diagn_id:
-        where.append("dg.diagn_id ILIKE %s");     args.append(f"%{diagn_id}%")
-    if year:
-        where.append("dg.diagn_year = %s");       args.append(_to_int(year))
-    if month:
-        where.append("dg.diagn_month = %s");      args.append(_to_int(month))
-    if day:
-        where.append("dg.diagn_day = %s");        args.append(_to_int(day))
-    if obser_id:
-        where.append("dg.obser_id ILIKE %s");     args.append(f"%{obser_id}%")
-    if appoint_id:
-        where.append("o.appoint_id ILIKE %s");    args.append(f"%{appoint_id}%")
-    if patient_name:
-        where.append("pp.full_name ILIKE %s");    args.append(f"%{patient_name}%")
-    if patient_personnumer:
-        where.append("p.personnumer ILIKE %s");   args.append(f"%{patient_personnumer}%")
-    if doctor_name:
-        where.append("dp.full_name ILIKE %s");    args.append(f"%{doctor_name}%")
-    if doctor_personnumer:
-        where.append("d.personnumer ILIKE %s");   args.append(f"%{doctor_personnumer}%")
-    clause = " AND ".join(where) if where else "1=1"
-    with get_conn() as (conn, cur):
-        cur.execute(f"""
-            SELECT dg.diagn_id, dg.diagn_year, dg.diagn_month, dg.diagn_day,
-                   dg.obser_id, o.appoint_id,
-                   p.personnumer AS patient_personnumer, pp.full_name AS patient_name,
-                   d.personnumer AS doctor_personnumer, dp.full_name AS doctor_name,
-                   dg.diagn_comment_text, dg.diagn_file_oid
-            FROM diagnosis dg
-            LEFT JOIN observation o ON o.obser_id = dg.obser_id
-            LEFT JOIN appointment a ON a.appoint_id = o.appoint_id
-            LEFT JOIN patient p ON p.personnumer = a.patient_personnumer
-            LEFT JOIN person pp ON pp.personnumer = p.personnumer
-            LEFT JOIN doctor d ON d.personnumer = a.doctor_personnumer
-            LEFT JOIN person dp ON dp.personnumer = d.personnumer
-            WHERE {clause}
-            ORDER BY dg.diagn_id;
-        """, tuple(args))
+    select, filters = _diagnosis_source()
+    clause, args = _where(filters, (diagn_id, year, month, day, obser_id, appoint_id,
+                                               patient_name, patient_personnumer, doctor_name, doctor_personnumer))
+    with get_conn() as (conn, cur):
+        execute(cur, "diagnosis_search", f"{select} WHERE {clause} ORDER BY {_DIAGNOSIS_ORDER};", tuple(args))
         return cur.fetchall()
 
+def diagnosis_page(diagn_id="", year="", month="", day="", obser_id="", appoint_id="",
+                   patient_name="", patient_personnumer="",
+                   doctor_name="", doctor_personnumer="",
+                   *, page_size=PAGE_SIZE, after=None):
+    """One page of diagnosis_search. Returns (rows, next_cursor), next_cursor is None on the last page."""
+    select, filters = _diagnosis_source()
+    clause, args = _where(filters, (diagn_id, year, month, day, obser_id, appoint_id,
+                                               patient_name, patient_personnumer, doctor_name, doctor_personnumer))
+    return _page("diagnosis_page", select, clause, args, _DIAGNOSIS_KEYS, page_size, after)
+
+def diagnosis_between(date_from, date_to, *, exact_only=False):
+    """Diagnoses dated date_from..date_to (inclusive), same columns as diagnosis_search."""
+    return _between(_DIAGNOSIS_SELECT, "dg.diagn_date", "dg.diagn_date_precision", "dg.diagn_id",
+                    date_from, date_to, exact_only)
+
+def diagnosis_text_page(q: str, *, files: bool = True, page_size=PAGE_SIZE, after=None):
+    """Diagnoses whose comment (or attached file) matches q, ranked.
+    Returns (rows, next_cursor), rows are (rank, snippet, ...diagnosis_search columns)."""
+    return _text_page(_diagnosis_source()[0], "diagnosis", "diagn_id", "diagn_comment_tsv", "diagn_comment_text",
+                      "diagn_file_oid", q, files, page_size, after)
+
+def diagnosis_text_search(q: str, *, files: bool = True, limit: int = 50):
+    """The best limit matches of diagnosis_text_page."""
+    return diagnosis_text_page(q, files=files, page_size=limit)[0]
+
+def diagnosis_iter(diagn_id="", year="", month="", day="", obser_id="", appoint_id="",
+                   patient_name="", patient_personnumer="",
+                   doctor_name="", doctor_personnumer="",
+                   *, itersize=STREAM_ITERSIZE):
+    """Generator over the diagnosis_search rows, streamed from a server-side cursor."""
+    select, filters = _diagnosis_source()
+    clause, args = _where(filters, (diagn_id, year, month, day, obser_id, appoint_id,
+                                               patient_name, patient_personnumer, doctor_name, doctor_personnumer))
+    return _stream("diagnosis_iter", select, clause, args, _DIAGNOSIS_ORDER, itersize)
+
+def _diagnosis_insert(cur, diagn_id: str, year: str, month: str, day: str,
+                      obser_id: str | None,
+                      comment_text: str | None,
+                      file_oid: int | None):
+    y, m, d = validate_date_parts(year, month, day, label="diagnosis date")
+    cur.execute("""
+        INSERT INTO diagnosis (diagn_id, diagn_year, diagn_month, diagn_day, obser_id,
+                               diagn_comment_text, diagn_file_oid)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, (diagn_id, y, m, d, (obser_id or None), (comment_text or None), file_oid))
+
 def diagnosis_insert(diagn_id: str, year: str, month: str, day: str,
                      obser_id: str | None,
                      comment_text: str | None,
                      file_oid: int | None):
-    y, m, d = validate_date_parts(year, month, day, label="diagnosis date")
     with get_conn() as (conn, cur):
-        cur.execute("""
-            INSERT INTO diagnosis (diagn_id, diagn_year, diagn_month, diagn_day, obser_id,
-                                   diagn_comment_text, diagn_file_oid)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (diagn_id, y, m, d, (obser_id or None), (comment_text or None), file_oid))
+        _diagnosis_insert(cur, diagn_id, year, month, day, obser_id, comment_text, file_oid)
         conn.commit()
 
-def diagnosis_update(diagn_id: str, year: str | None = None, month: str | None = None, day: str | None = None,
-                     obser_id: str | None = None,
-                     comment_text: str | None = None,
-                     file_oid: int | None = None):
+def _diagnosis_update(cur, diagn_id: str, year: str | None = None, month: str | None = None, day: str | None = None,
+                      obser_id: str | None = None,
+                      comment_text: str | None = None,
+                      file_oid: int | None = None):
     y_in = None if _is_blank(year)  else _to_int(year) if isinstance(year, str)  else year
     m_in = None if _is_blank(month) else _to_int(month) if isinstance(month, str) else month
     d_in = None if _is_blank(day)   else _to_int(day) if isinstance(day, str)   else day
 
-    with get_conn() as (conn, cur):
-        if y_in is not None or m_in is not None or d_in is not None:
-            cur.execute("""SELECT diagn_year, diagn_month, diagn_day
-                           FROM diagnosis WHERE diagn_id=%s""", (diagn_id,))
-            row = cur.fetchone()
-            if row is None:
-                raise ValueError("diagnosis not found")
-            base_y, base_m, base_d = row
-            merged_y = y_in if y_in is not None else base_y
-            merged_m = m_in if m_in is not None else base_m
-            merged_d = d_in if d_in is not None else base_d
-            validate_date_parts(merged_y, merged_m, merged_d, label="diagnosis date")
+    if y_in is not None or m_in is not None or d_in is not None:
+        cur.execute("""SELECT diagn_year, diagn_month, diagn_day
+                       FROM diagnosis WHERE diagn_id=%s""", (diagn_id,))
+        row = cur.fetchone()
+        if row is None:
+            raise ValueError("diagnosis not found")
+        base_y, base_m, base_d = row
+        merged_y = y_in if y_in is not None else base_y
+        merged_m = m_in if m_in is not None else base_m
+        merged_d = d_in if d_in is not None else base_d
+        validate_date_parts(merged_y, merged_m, merged_d, label="diagnosis date")
 
-        sets, args = [], []
-        if y_in is not None:               sets.append("diagn_year=%s");         args.append(y_in)
-        if m_in is not None:               sets.append("diagn_month=%s");        args.append(m_in)
-        if d_in is not None:               sets.append("diagn_day=%s");          args.append(d_in)
-        if not _is_blank(obser_id):        sets.append("obser_id=%s");           args.append(obser_id)
-        if comment_text is not None:       sets.append("diagn_comment_text=%s"); args.append(comment_text)
-        if file_oid is not None:           sets.append("diagn_file_oid=%s");     args.append(file_oid)
+    sets, args = [], []
+    if y_in is not None:               sets.append("diagn_year=%s");         args.append(y_in)
+    if m_in is not None:               sets.append("diagn_month=%s");        args.append(m_in)
+    if d_in is not None:               sets.append("diagn_day=%s");          args.append(d_in)
+    if not _is_blank(obser_id):        sets.append("obser_id=%s");           args.append(obser_id)
+    if comment_text is not None:       sets.append("diagn_comment_text=%s"); args.append(comment_text)
+    if file_oid is not None:           sets.append("diagn_file_oid=%s");     args.append(file_oid)
 
-        if not sets:
-            return
-        args.append(diagn_id)
-        cur.execute(f"UPDATE diagnosis SET {', '.join(sets)} WHERE diagn_id=%s", tuple(args))
+    if not sets:
+        return
+    args.append(diagn_id)
+    cur.execute(f"UPDATE diagnosis SET {', '.join(sets)} WHERE diagn_id=%s", tuple(args))
+
+def diagnosis_update(diagn_id: str, year: str | None = None, month: str | None = None, day: str | None = None,
+                     obser_id: str | None = None,
+                     comment_text: str | None = None,
+                     file_oid: int | None = None):
+    with get_conn() as (conn, cur):
+        _diagnosis_update(cur, diagn_id, year, month, day, obser_id, comment_text, file_oid)
+        conn.commit()
+
+def diagnosis_insert_with_file(diagn_id: str, year: str, month: str, day: str,
+                               obser_id: str | None,
+                               comment_text: str | None,
+                               file_path: str | None,
+                               *, chunk_size: int = LO_CHUNK_SIZE, progress=None):
+    """diagnosis_insert with the file saved in the same transaction, see observation_insert_with_file."""
+    validate_date_parts(year, month, day, label="diagnosis date")
+    with get_conn() as (conn, cur):
+        file_oid = _lo_write_path(cur, file_path, chunk_size=chunk_size, progress=progress) if file_path else None
+        _diagnosis_insert(cur, diagn_id, year, month, day, obser_id, comment_text, file_oid)
         conn.commit()
 
+def diagnosis_update_with_file(diagn_id: str, year: str | None = None, month: str | None = None, day: str | None = None,
+                               obser_id: str | None = None,
+                               comment_text: str | None = None,
+                               file_path: str | None = None,
+                               *, chunk_size: int = LO_CHUNK_SIZE, progress=None):
+    """diagnosis_update with the file saved in the same transaction, see observation_insert_with_file."""
+    with get_conn() as (conn, cur):
+        _diagnosis_update(cur, diagn_id, year, month, day, obser_id, comment_text, None)
+        if file_path:
+            file_oid = _lo_write_path(cur, file_path, chunk_size=chunk_size, progress=progress)
+            cur.execute("UPDATE diagnosis SET diagn_file_oid=%s WHERE diagn_id=%s", (file_oid, diagn_id))
+            if cur.rowcount == 0:
+                raise ValueError("diagnosis not found")
+        conn.commit()
 
 def diagnosis_delete(diagn_id: str):
     with get_conn() as (conn, cur):
         cur.execute("DELETE FROM diagnosis WHERE diagn_id=%s", (diagn_id,))
         conn.commit()
 
+def diagnosis_insert_many(rows, *, errors="raise"):
+    """Batch diagnosis_insert, see _write_many."""
+    def prepare(a, _):
+        y, m, d = validate_date_parts(a["year"], a["month"], a["day"], label="diagnosis date")
+        return ((a["diagn_id"], y, m, d, a["obser_id"] or None, a["comment_text"] or None, a["file_oid"]),)
+    return _write_many(diagnosis_insert, rows, ("""
+        INSERT INTO diagnosis (diagn_id, diagn_year, diagn_month, diagn_day, obser_id,
+                               diagn_comment_text, diagn_file_oid)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """,), prepare, errors)
+
+def diagnosis_update_many(rows, *, errors="raise"):
+    """Batch diagnosis_update (blank fields are left unchanged), see _write_many."""
+    def prepare(a, stored):
+        y, m, d = _merged_date(a, stored, "diagn_id", "diagnosis")
+        return ((y, m, d, None if _is_blank(a["obser_id"]) else a["obser_id"],
+                 a["comment_text"], a["file_oid"], a["diagn_id"]),)
+    return _write_many(diagnosis_update, rows, ("""
+        UPDATE diagnosis SET diagn_year=COALESCE(%s, diagn_year), diagn_month=COALESCE(%s, diagn_month),
+               diagn_day=COALESCE(%s, diagn_day), obser_id=COALESCE(%s, obser_id),
+               diagn_comment_text=COALESCE(%s, diagn_comment_text), diagn_file_oid=COALESCE(%s, diagn_file_oid)
+        WHERE diagn_id=%s
+    """,), prepare, errors,
+        _stored_dates("diagnosis", "diagn_id", ("diagn_year", "diagn_month", "diagn_day"), "diagn_id"))
+
+def diagnosis_delete_many(diagn_ids) -> int:
+    """Delete all given diagnoses in one statement, returns how many were deleted."""
+    return _delete_many("diagnosis", "diagn_id", diagn_ids)
+
 # CLINICS
+_CLINIC_SELECT = """
+    SELECT c.cli_id, c.cli_name, c.address
+    FROM clinic c
+"""
+_CLINIC_FILTERS = (("c.cli_id", "ilike"), ("c.cli_name", "ilike"), ("c.address", "ilike"))
+_CLINIC_KEYS = ("cli_id",)
+
 def clinic_view():
-    with get_conn() as (conn, cur):
-        cur.execute("""
-            SELECT c.cli_id, c.cli_name, c.address
-            FROM clinic c
-            ORDER BY c.cli_id;
-        """)
-        return cur.fetchall()
+    return clinic_search()
 
+@_cached("clinic")
 def clinic_search(cli_id="", cli_name="", address=""):
-    where, args = [], []
-    if cli_id:
-        where.append("c.cli_id ILIKE %s");   args.append(f"%{cli_id}%")
-    if cli_name:
-        where.append("c.cli_name ILIKE %s"); args.append(f"%{cli_name}%")
-    if address:
-        where.append("c.address ILIKE %s");  args.append(f"%{address}%")
-    clause = " AND ".join(where) if where else "1=1"
-    with get_conn() as (conn, cur):
-        cur.execute(f"""
-            SELECT c.cli_id, c.cli_name, c.address
-            FROM clinic c
-            WHERE {clause}
-            ORDER BY c.cli_id;
-        """, tuple(args))
+    clause, args = _where(_CLINIC_FILTERS, (cli_id, cli_name, address))
+    with get_conn() as (conn, cur):
+        execute(cur, "clinic_search", f"{_CLINIC_SELECT} WHERE {clause} ORDER BY c.cli_id;", tuple(args))
         return cur.fetchall()
 
+@_cached("clinic")
+def clinic_page(cli_id="", cli_name="", address="", *, page_size=PAGE_SIZE, after=None):
+    """One page of clinic_search. Returns (rows, next_cursor), next_cursor is None on the last page."""
+    clause, args = _where(_CLINIC_FILTERS, (cli_id, cli_name, address))
+    return _page("clinic_page", _CLINIC_SELECT, clause, args, _CLINIC_KEYS, page_size, after)
+
+@_writes("clinic", "department")
 def clinic_insert(cli_id: str, cli_name: str, address: str | None):
     with get_conn() as (conn, cur):
         cur.execute("""
@@ -624,6 +1555,7 @@ def clinic_insert(cli_id: str, cli_name: str, address: str | None):
         """, (cli_id, cli_name, (address or None)))
         conn.commit()
 
+@_writes("clinic", "department")
 def clinic_update(cli_id: str, cli_name: str | None = None, address: str | None = None):
     sets, args = [], []
     if not _is_blank(cli_name): sets.append("cli_name=%s"); args.append(cli_name)
@@ -635,43 +1567,58 @@ def clinic_update(cli_id: str, cli_name: str | None = None, address: str | None
         cur.execute(f"UPDATE clinic SET {', '.join(sets)} WHERE cli_id=%s", tuple(args))
         conn.commit()
 
+@_writes("clinic", "department")
 def clinic_delete(cli_id: str):
     with get_conn() as (conn, cur):
         cur.execute("DELETE FROM clinic WHERE cli_id=%s", (cli_id,))
         conn.commit()
 
+@_writes("clinic", "department")
+def clinic_insert_many(rows, *, errors="raise"):
+    """Batch clinic_insert, see _write_many."""
+    return _write_many(clinic_insert, rows, ("INSERT INTO clinic (cli_id, cli_name, address) VALUES (%s, %s, %s)",),
+                       lambda a, _: ((a["cli_id"], a["cli_name"], a["address"] or None),), errors)
+
+@_writes("clinic", "department")
+def clinic_update_many(rows, *, errors="raise"):
+    """Batch clinic_update (blank fields are left unchanged), see _write_many."""
+    return _write_many(clinic_update, rows, (
+        "UPDATE clinic SET cli_name=COALESCE(%s, cli_name), address=COALESCE(%s, address) WHERE cli_id=%s",
+    ), lambda a, _: ((None if _is_blank(a["cli_name"]) else a["cli_name"],
+                      None if _is_blank(a["address"]) else a["address"], a["cli_id"]),), errors)
+
+@_writes("clinic", "department")
+def clinic_delete_many(cli_ids) -> int:
+    """Delete all given clinics in one statement, returns how many were deleted."""
+    return _delete_many("clinic", "cli_id", cli_ids)
+
 # DEPARTMENTS 
+_DEPARTMENT_SELECT = """
+    SELECT d.dept_id, d.dept_name, d.cli_id, c.cli_name
+    FROM department d
+    LEFT JOIN clinic c ON c.cli_id = d.cli_id
+"""
+_DEPARTMENT_FILTERS = (("d.dept_id", "ilike"), ("d.dept_name", "ilike"),
+                       ("d.cli_id", "ilike"), ("c.cli_name", "ilike"))
+_DEPARTMENT_KEYS = ("dept_id",)
+
 def department_view():
-    with get_conn() as (conn, cur):
-        cur.execute("""
-            SELECT d.dept_id, d.dept_name, d.cli_id, c.cli_name
-            FROM department d
-            LEFT JOIN clinic c ON c.cli_id = d.cli_id
-            ORDER BY d.dept_id;
-        """)
-        return cur.fetchall()
+    return department_search()
 
+@_cached("department", "clinic")
 def department_search(dept_id="", dept_name="", cli_id="", clinic_name=""):
-    where, args = [], []
-    if dept_id:
-        where.append("d.dept_id ILIKE %s");   args.append(f"%{dept_id}%")
-    if dept_name:
-        where.append("d.dept_name ILIKE %s"); args.append(f"%{dept_name}%")
-    if cli_id:
-        where.append("d.cli_id ILIKE %s");    args.append(f"%{cli_id}%")
-    if clinic_name:
-        where.append("c.cli_name ILIKE %s");  args.append(f"%{clinic_name}%")
-    clause = " AND ".join(where) if where else "1=1"
-    with get_conn() as (conn, cur):
-        cur.execute(f"""
-            SELECT d.dept_id, d.dept_name, d.cli_id, c.cli_name
-            FROM department d
-            LEFT JOIN clinic c ON c.cli_id = d.cli_id
-            WHERE {clause}
-            ORDER BY d.dept_id;
-        """, tuple(args))
+    clause, args = _where(_DEPARTMENT_FILTERS, (dept_id, dept_name, cli_id, clinic_name))
+    with get_conn() as (conn, cur):
+        execute(cur, "department_search", f"{_DEPARTMENT_SELECT} WHERE {clause} ORDER BY d.dept_id;", tuple(args))
         return cur.fetchall()
 
+@_cached("department", "clinic")
+def department_page(dept_id="", dept_name="", cli_id="", clinic_name="", *, page_size=PAGE_SIZE, after=None):
+    """One page of department_search. Returns (rows, next_cursor), next_cursor is None on the last page."""
+    clause, args = _where(_DEPARTMENT_FILTERS, (dept_id, dept_name, cli_id, clinic_name))
+    return _page("department_page", _DEPARTMENT_SELECT, clause, args, _DEPARTMENT_KEYS, page_size, after)
+
+@_writes("department", "doctor")
 def department_insert(dept_id: str, dept_name: str, cli_id: str | None):
     with get_conn() as (conn, cur):
         cur.execute("""
@@ -680,6 +1627,7 @@ def department_insert(dept_id: str, dept_name: str, cli_id: str | None):
         """, (dept_id, dept_name, (cli_id or None)))
         conn.commit()
 
+@_writes("department", "doctor")
 def department_update(dept_id: str, dept_name: str | None = None, cli_id: str | None = None):
     sets, args = [], []
     if not _is_blank(dept_name): sets.append("dept_name=%s"); args.append(dept_name)
@@ -691,7 +1639,102 @@ def department_update(dept_id: str, dept_name: str | None = None, cli_id: str |
         cur.execute(f"UPDATE department SET {', '.join(sets)} WHERE dept_id=%s", tuple(args))
         conn.commit()
 
+@_writes("department", "doctor")
 def department_delete(dept_id: str):
     with get_conn() as (conn, cur):
         cur.execute("DELETE FROM department WHERE dept_id=%s", (dept_id,))
         conn.commit()
+
+@_writes("department", "doctor")
+def department_insert_many(rows, *, errors="raise"):
+    """Batch department_insert, see _write_many."""
+    return _write_many(department_insert, rows,
+                       ("INSERT INTO department (dept_id, dept_name, cli_id) VALUES (%s, %s, %s)",),
+                       lambda a, _: ((a["dept_id"], a["dept_name"], a["cli_id"] or None),), errors)
+
+@_writes("department", "doctor")
+def department_update_many(rows, *, errors="raise"):
+    """Batch department_update (blank fields are left unchanged), see _write_many."""
+    return _write_many(department_update, rows, (
+        "UPDATE department SET dept_name=COALESCE(%s, dept_name), cli_id=COALESCE(%s, cli_id) WHERE dept_id=%s",
+    ), lambda a, _: ((None if _is_blank(a["dept_name"]) else a["dept_name"],
+                      None if _is_blank(a["cli_id"]) else a["cli_id"], a["dept_id"]),), errors)
+
+@_writes("department", "doctor")
+def department_delete_many(dept_ids) -> int:
+    """Delete all given departments in one statement, returns how many were deleted."""
+    return _delete_many("department", "dept_id", dept_ids)
+
+# LIVE UPDATES
+# the tables send the keys of changed rows on commit (notify_change in bootstrap_db, live_updates.py listens).
+# For each *_page function: its source (select, filters), keyset order, output columns, the column that
+# identifies a group of rows (a doctor has one row per patient), and which columns hold the key of each
+# notifying table. live_rows() fetches just the rows a change touches, with the page's filters applied.
+_PATIENT_COLUMNS = ("patient_personnumer", "patient_name", "doctor_personnumer", "doctor_name")
+_DOCTOR_COLUMNS = ("doctor_personnumer", "doctor_name", "dept_id", "patient_personnumer", "patient_name")
+_APPOINTMENT_COLUMNS = ("appoint_id", "appoint_year", "appoint_month", "appoint_day", "appoint_location",
+                        "patient_personnumer", "patient_name", "doctor_personnumer", "doctor_name",
+                        "appoint_start", "appoint_end")
+_OBSERVATION_COLUMNS = ("obser_id", "obs_year", "obs_month", "obs_day", "appoint_id",
+                        "patient_personnumer", "patient_name", "doctor_personnumer", "doctor_name",
+                        "obs_comment_text", "obs_file_oid")
+_DIAGNOSIS_COLUMNS = ("diagn_id", "diagn_year", "diagn_month", "diagn_day", "obser_id", "appoint_id",
+                      "patient_personnumer", "patient_name", "doctor_personnumer", "doctor_name",
+                      "diagn_comment_text", "diagn_file_oid")
+_PEOPLE = ("patient_personnumer", "doctor_personnumer")
+
+_LIVE = {
+    "patient_page": (lambda: (_PATIENT_SELECT, _PATIENT_FILTERS), _PATIENT_KEYS, _PATIENT_COLUMNS,
+                     "patient_personnumer", {"patient": ("patient_personnumer",), "person": _PEOPLE}),
+    "doctor_page": (lambda: (_DOCTOR_SELECT, _DOCTOR_FILTERS), _DOCTOR_KEYS, _DOCTOR_COLUMNS,
+                    "doctor_personnumer", {"doctor": ("doctor_personnumer",), "patient": ("patient_personnumer",),
+                                           "person": _PEOPLE}),
+    "appointment_page": (lambda: (_APPOINTMENT_SELECT, _APPOINTMENT_FILTERS), _APPOINTMENT_KEYS, _APPOINTMENT_COLUMNS,
+                         "appoint_id", {"appointment": ("appoint_id",), "person": _PEOPLE}),
+    "observation_page": (_observation_source, _OBSERVATION_KEYS, _OBSERVATION_COLUMNS,
+                         "obser_id", {"observation": ("obser_id",), "appointment": ("appoint_id",), "person": _PEOPLE}),
+    "diagnosis_page": (_diagnosis_source, _DIAGNOSIS_KEYS, _DIAGNOSIS_COLUMNS,
+                       "diagn_id", {"diagnosis": ("diagn_id",), "observation": ("obser_id",),
+                                    "appointment": ("appoint_id",), "person": _PEOPLE}),
+    "clinic_page": (lambda: (_CLINIC_SELECT, _CLINIC_FILTERS), _CLINIC_KEYS, ("cli_id", "cli_name", "address"),
+                    "cli_id", {"clinic": ("cli_id",)}),
+    "department_page": (lambda: (_DEPARTMENT_SELECT, _DEPARTMENT_FILTERS), _DEPARTMENT_KEYS,
+                        ("dept_id", "dept_name", "cli_id", "cli_name"),
+                        "dept_id", {"department": ("dept_id",), "clinic": ("cli_id",)}),
+}
+
+def live_spec(page_fn):
+    """(group column index, {table: column indexes}) of the rows of a *_page function, None if it has no live updates."""
+    spec = _LIVE.get(getattr(page_fn, "__name__", None))
+    if spec is None:
+        return None
+    _, _, columns, group, deps = spec
+    return columns.index(group), {t: tuple(columns.index(c) for c in cols) for t, cols in deps.items()}
+
+def live_rows(page_fn, args, changes, groups=()):
+    """Rows of page_fn(*args) (same filters and order) of the given groups and of every group that has a row
+    whose key columns hold one of the changed keys, changes is {table: [keys]}."""
+    source, keys, _, group, deps = _LIVE[page_fn.__name__]
+    select, filters = source()
+    bound = inspect.signature(page_fn).bind(*args)
+    bound.apply_defaults()
+    values = [v for name, v in bound.arguments.items() if name not in ("page_size", "after")]
+    clause, where_args = _where(filters, values)
+
+    match, match_args = [f"{group} = ANY(%s)"], [list(groups)]
+    for table, table_keys in changes.items():
+        for col in deps.get(table, ()):
+            match.append(f"{col} = ANY(%s)")
+            match_args.append(list(table_keys))
+    base = f"SELECT q.* FROM ({select} WHERE {clause}) q"
+    order = ", ".join(keys)
+    with get_conn() as (conn, cur):
+        if tuple(keys) != (group,):
+            # several rows per group: find the touched groups first, then read them whole
+            execute(cur, f"{page_fn.__name__}_live_groups",
+                    f"SELECT DISTINCT q.{group} FROM ({select} WHERE {clause}) q WHERE {' OR '.join(match)}",
+                    tuple(where_args) + tuple(match_args))
+            match, match_args = [f"{group} = ANY(%s)"], [[r[0] for r in cur.fetchall()]]
+        execute(cur, f"{page_fn.__name__}_live", f"{base} WHERE {' OR '.join(match)} ORDER BY {order}",
+                tuple(where_args) + tuple(match_args))
+        return cur.fetchall()
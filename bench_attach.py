@@ -0,0 +1,102 @@
+"""
+Save latency benchmark for observations with an attached file.
+
+"before" is what the UI used to do: backend.lo_save_file in one transaction, then
+backend.observation_insert in a second one. "after" is backend.observation_insert_with_file,
+one connection and one commit. Each save is timed end to end for a few file sizes, then
+a few saves that fail on the insert are run to count the Large Objects left behind.
+All rows and objects created here are removed at the end.
+
+    python bench_attach.py
+    python bench_attach.py --sizes 4096 1048576 --repeat 50
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import backend
+from db import get_conn, set_dsn
+
+PREFIX = "BENCH-ATTACH-"
+
+def before(obser_id, path):
+    oid = backend.lo_save_file(path)
+    try:
+        backend.observation_insert(obser_id, "2024", "1", "1", None, "bench", oid)
+    except Exception:
+        return oid   # the object is already committed, nothing removes it
+    return None
+
+def after(obser_id, path):
+    try:
+        backend.observation_insert_with_file(obser_id, "2024", "1", "1", None, "bench", path)
+    except Exception:
+        pass
+    return None
+
+def lo_count():
+    with get_conn() as (conn, cur):
+        cur.execute("SELECT count(*) FROM pg_largeobject_metadata")
+        return cur.fetchone()[0]
+
+def random_file(size):
+    # fresh content every time, identical files would be deduplicated and never uploaded
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(os.urandom(size))
+    return f.name
+
+def run(label, fn, size, repeat):
+    times = []
+    for i in range(repeat):
+        path = random_file(size)
+        try:
+            t0 = time.perf_counter()
+            fn(f"{PREFIX}{label}-{size}-{i}", path)
+            times.append((time.perf_counter() - t0) * 1000)
+        finally:
+            os.unlink(path)
+    return statistics.median(times), statistics.quantiles(times, n=20)[-1] if len(times) > 1 else times[0]
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[4096, 1024 * 1024, 8 * 1024 * 1024])
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--failures", type=int, default=10)
+    args = ap.parse_args()
+
+    set_dsn("super")
+    orphans = []
+    print(f"{'file size':>10} {'before p50 ms':>14} {'p95':>8} {'after p50 ms':>13} {'p95':>8}")
+    try:
+        for size in args.sizes:
+            b50, b95 = run("before", before, size, args.repeat)
+            a50, a95 = run("after", after, size, args.repeat)
+            print(f"{size:>10} {b50:14.1f} {b95:8.1f} {a50:13.1f} {a95:8.1f}")
+
+        # every failed save below hits the primary key of a row created above
+        dup = f"{PREFIX}before-{args.sizes[0]}-0"
+        for label, fn in (("before", before), ("after", after)):
+            n = lo_count()
+            for _ in range(args.failures):
+                path = random_file(4096)
+                try:
+                    oid = fn(dup, path)
+                finally:
+                    os.unlink(path)
+                if oid is not None:
+                    orphans.append(oid)
+            print(f"{label}: {lo_count() - n} orphaned objects after {args.failures} failed saves")
+    finally:
+        with get_conn() as (conn, cur):
+            cur.execute("SELECT obser_id FROM observation WHERE obser_id LIKE %s", (PREFIX + "%",))
+            ids = [r[0] for r in cur.fetchall()]
+            for oid in orphans:
+                cur.execute("DELETE FROM lo_blob WHERE lo_oid=%s", (oid,))
+                cur.execute("SELECT lo_unlink(%s)", (oid,))
+            conn.commit()
+        backend.observation_delete_many(ids)   # the lo_cleanup trigger unlinks their files
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Storage and round-trip benchmark for attachment compression.
+
+Every sample file is saved with codec 'none' and with codec 'zlib' (backend.lo_save_file),
+read back with backend.lo_export_file, and compared with the original. Prints bytes stored
+(lo_blob.stored_size), save and read times, and which codec the automatic choice picks.
+All objects created here are removed at the end.
+
+    python bench_compression.py
+    python bench_compression.py --mb 32 --repeat 5
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import struct
+import tempfile
+import time
+
+import backend
+from db import get_conn, set_dsn
+
+WORDS = ("patient reports mild pain in the lower back since two weeks no fever blood pressure "
+         "normal follow up in one month prescribed ibuprofen 400 mg x-ray ordered").split()
+
+def note(n):
+    # free text clinical notes
+    rnd = random.Random(1)
+    out, size = [], 0
+    while size < n:
+        line = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(6, 18))) + ".\n"
+        out.append(line); size += len(line)
+    return "".join(out).encode()[:n]
+
+def log(n):
+    rnd = random.Random(2)
+    out, size, t = [], 0, 1_700_000_000
+    while size < n:
+        t += rnd.randint(0, 3)
+        line = f"{t} INFO device={rnd.randint(1, 40)} hr={rnd.randint(50, 120)} spo2={rnd.randint(90, 100)}\n"
+        out.append(line); size += len(line)
+    return "".join(out).encode()[:n]
+
+def dicom(n):
+    # 16-bit grayscale frame with a smooth gradient and noise, behind the DICM preamble
+    rnd = random.Random(3)
+    pixels = struct.pack(f"<{n // 2}H", *((i % 512) * 8 + rnd.randint(0, 3) for i in range(n // 2)))
+    return (b"\0" * 128 + b"DICM" + pixels)[:n]
+
+def jpeg(n):
+    # stands in for photos and scans: already compressed, looks random
+    return b"\xff\xd8\xff\xe0" + os.urandom(n - 4)
+
+SAMPLES = {"note.txt": note, "monitor.log": log, "frame.dcm": dicom, "photo.jpg": jpeg}
+
+def roundtrip(path, codec):
+    t0 = time.perf_counter()
+    oid = backend.lo_save_file(path, codec=codec)
+    t1 = time.perf_counter()
+    buf = io.BytesIO()
+    backend.lo_export_file(oid, buf)
+    t2 = time.perf_counter()
+    with get_conn() as (conn, cur):
+        cur.execute("SELECT stored_size FROM lo_blob WHERE lo_oid=%s", (oid,))
+        stored = cur.fetchone()[0]
+        # drop it again, the next run saves the same content and would otherwise be deduplicated
+        cur.execute("DELETE FROM lo_blob WHERE lo_oid=%s", (oid,))
+        cur.execute("SELECT lo_unlink(%s)", (oid,))
+        conn.commit()
+    with open(path, "rb") as f:
+        if buf.getvalue() != f.read():
+            raise SystemExit(f"{path}: {codec} round trip does not match")
+    return stored, (t1 - t0) * 1000, (t2 - t1) * 1000
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--mb", type=float, default=8, help="size of each sample file in MiB")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    set_dsn("super")
+    n = int(args.mb * 1024 * 1024)
+    print(f"{'sample':12} {'auto':>5} {'stored none':>12} {'stored zlib':>12} {'ratio':>6} "
+          f"{'save ms none/zlib':>18} {'read ms none/zlib':>18}")
+    for name, make in SAMPLES.items():
+        with tempfile.NamedTemporaryFile(suffix=name, delete=False) as f:
+            f.write(make(n))
+        try:
+            with open(f.name, "rb") as fh:
+                auto = backend._pick_codec(fh.read(64 * 1024))
+            res = {}
+            for codec in ("none", "zlib"):
+                runs = [roundtrip(f.name, codec) for _ in range(args.repeat)]
+                res[codec] = (runs[0][0], statistics.median(r[1] for r in runs), statistics.median(r[2] for r in runs))
+        finally:
+            os.unlink(f.name)
+        (sn, wn, rn), (sz, wz, rz) = res["none"], res["zlib"]
+        print(f"{name:12} {auto:>5} {sn:12} {sz:12} {sz / sn:6.2f} {wn:8.1f} / {wz:7.1f} {rn:8.1f} / {rz:7.1f}")
+
+if __name__ == "__main__":
+    main()
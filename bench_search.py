@@ -0,0 +1,133 @@
+"""
+Search latency benchmark for bootstrap_db.INDEX_SQL.
+
+Builds a synthetic copy of the clinic tables in a scratch schema (bench_search),
+times the same queries the backend *_search functions run, creates the indexes
+and times them again. The scratch schema is dropped at the end, the real tables
+are never touched.
+
+    python bench_search.py                      # 100k patients
+    python bench_search.py --patients 500000 --repeat 7
+"""
+import argparse
+import statistics
+import time
+
+import psycopg
+import backend
+from bootstrap_db import INDEX_SQL
+from db_config import ADMIN_DSN
+
+SCHEMA = "bench_search"
+
+TABLES = {
+    "person":      "personnumer",
+    "clinic":      "cli_id",
+    "department":  "dept_id",
+    "doctor":      "personnumer",
+    "patient":     "personnumer",
+    "appointment": "appoint_id",
+    "observation": "obser_id",
+    "diagnosis":   "diagn_id",
+}
+
+# n = number of patients, everything else is scaled from it (%% is a literal modulo)
+FILL_SQL = r"""
+INSERT INTO clinic SELECT 'C' || i, 'Clinic ' || md5(i::text), md5((i * 7)::text) || ' street'
+    FROM generate_series(1, 50) i;
+INSERT INTO department SELECT 'D' || i, 'Dept ' || md5(i::text), 'C' || (1 + i %% 50)
+    FROM generate_series(1, 500) i;
+INSERT INTO person SELECT 'DOC' || lpad(i::text, 7, '0'), 'Dr ' || md5(i::text)
+    FROM generate_series(1, %(doctors)s) i;
+INSERT INTO doctor SELECT 'DOC' || lpad(i::text, 7, '0'), 'D' || (1 + i %% 500)
+    FROM generate_series(1, %(doctors)s) i;
+INSERT INTO person SELECT 'PAT' || lpad(i::text, 9, '0'), md5(('p' || i)::text)
+    FROM generate_series(1, %(n)s) i;
+INSERT INTO patient SELECT 'PAT' || lpad(i::text, 9, '0'), 'DOC' || lpad((1 + i %% %(doctors)s)::text, 7, '0')
+    FROM generate_series(1, %(n)s) i;
+INSERT INTO appointment
+    SELECT 'A' || i, 2000 + i %% 25, 1 + i %% 12, 1 + i %% 28, 'room ' || i %% 40,
+           'PAT' || lpad((1 + i %% %(n)s)::text, 9, '0'), 'DOC' || lpad((1 + i %% %(doctors)s)::text, 7, '0')
+    FROM generate_series(1, %(appointments)s) i;
+INSERT INTO observation
+    SELECT 'O' || i, 2000 + i %% 25, 1 + i %% 12, 1 + i %% 28, 'obs ' || md5(i::text), NULL, 'A' || i
+    FROM generate_series(1, %(appointments)s) i;
+INSERT INTO diagnosis
+    SELECT 'G' || i, 2000 + i %% 25, 1 + i %% 12, 1 + i %% 28, 'diag ' || md5(i::text), NULL, 'O' || i
+    FROM generate_series(1, %(appointments)s) i;
+"""
+
+# (label, select, filters, filter values, order by) -- same shape as the backend search functions
+CASES = [
+    ("patient by name",       backend._PATIENT_SELECT, backend._PATIENT_FILTERS,
+     ("3f2a", "", "", ""), "pa.personnumer"),
+    ("patient by personnumer", backend._PATIENT_SELECT, backend._PATIENT_FILTERS,
+     ("", "000123", "", ""), "pa.personnumer"),
+    ("doctor by patient name", backend._DOCTOR_SELECT, backend._DOCTOR_FILTERS,
+     ("", "", "3f2a", ""), "d.personnumer"),
+    ("appointment by id",     backend._APPOINTMENT_SELECT, backend._APPOINTMENT_FILTERS,
+     ("A12345", "", "", "", "", "", "", ""), backend._APPOINTMENT_ORDER),
+    ("appointment by patient", backend._APPOINTMENT_SELECT, backend._APPOINTMENT_FILTERS,
+     ("", "", "", "", "", "000123", "", ""), backend._APPOINTMENT_ORDER),
+    ("observation by appoint_id", backend._OBSERVATION_SELECT, backend._OBSERVATION_FILTERS,
+     ("", "", "", "", "A12345", "", "", "", ""), "o.obser_id"),
+    ("diagnosis by patient name", backend._DIAGNOSIS_SELECT, backend._DIAGNOSIS_FILTERS,
+     ("", "", "", "", "", "", "3f2a", "", "", ""), "dg.diagn_id"),
+    ("department by clinic",  backend._DEPARTMENT_SELECT, backend._DEPARTMENT_FILTERS,
+     ("", "", "C17", ""), "d.dept_id"),
+]
+
+def build(cur, n):
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path = {SCHEMA}, public")
+    for table, pk in TABLES.items():
+        cur.execute(f"CREATE TABLE {table} (LIKE public.{table} INCLUDING DEFAULTS INCLUDING GENERATED)")
+        cur.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({pk})")
+    doctors = max(n // 100, 1)
+    for stmt in FILL_SQL.split(";"):
+        if stmt.strip():
+            cur.execute(stmt, {"n": n, "doctors": doctors, "appointments": n * 2})
+    cur.execute("ANALYZE")
+
+def run_cases(cur, repeat):
+    out = {}
+    for label, select, filters, values, order in CASES:
+        clause, args = backend._where(filters, values)
+        sql = f"{select} WHERE {clause} ORDER BY {order}"
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            cur.execute(sql, tuple(args))
+            cur.fetchall()
+            times.append((time.perf_counter() - t0) * 1000)
+        out[label] = statistics.median(times)
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--patients", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--dsn", default=ADMIN_DSN)
+    args = ap.parse_args()
+
+    with psycopg.connect(args.dsn, autocommit=True) as conn:
+        with conn.cursor() as cur:
+            try:
+                print(f"building {args.patients} patients / {args.patients * 2} appointments ...")
+                build(cur, args.patients)
+                before = run_cases(cur, args.repeat)
+                print("creating indexes ...")
+                cur.execute(INDEX_SQL)
+                cur.execute("ANALYZE")
+                after = run_cases(cur, args.repeat)
+            finally:
+                cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+
+    print(f"\n{'query':28} {'no index ms':>12} {'indexed ms':>12} {'speedup':>8}")
+    for label in before:
+        b, a = before[label], after[label]
+        print(f"{label:28} {b:12.1f} {a:12.1f} {b / a if a else float('inf'):7.1f}x")
+
+if __name__ == "__main__":
+    main()
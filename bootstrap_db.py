@@ -2,6 +2,8 @@ import os
 import psycopg
 import getpass
 import db
+from psycopg import sql
+from db_config import FTS_CONFIG
 from urllib.parse import quote as urlquote, urlparse
 
 def build_superuser_dsn():
@@ -16,7 +18,6 @@ def build_superuser_dsn():
     pw   = getpass.getpass(f"Password for {user}@{host}:{port}/postgres: ")
     return f"postgresql://{user}:{urlquote(pw)}@{host}:{port}/postgres"
 
-SUPERUSER_URL    = build_superuser_dsn()
 ADMIN_CLINIC_DSN = db.ADMIN_DSN
 # here we use this anonymous block to have conditional logic that SQL does not exhibit
 DDL_ROLES_DB = r"""
@@ -103,6 +104,88 @@ CREATE TABLE IF NOT EXISTS diagnosis(
     obser_id              TEXT REFERENCES observation(obser_id) ON DELETE SET NULL
 );
 
+-- the year/month/day parts as one indexable DATE: partial dates are stored as the first day of the
+-- known period, *_date_precision says how much of it is known ('year', 'month' or 'day', NULL without a year)
+ALTER TABLE appointment ADD COLUMN IF NOT EXISTS appoint_date DATE GENERATED ALWAYS AS
+    (make_date(appoint_year, COALESCE(appoint_month, 1), COALESCE(appoint_day, 1))) STORED;
+ALTER TABLE appointment ADD COLUMN IF NOT EXISTS appoint_date_precision TEXT GENERATED ALWAYS AS
+    (CASE WHEN appoint_year IS NULL THEN NULL WHEN appoint_month IS NULL THEN 'year'
+          WHEN appoint_day IS NULL THEN 'month' ELSE 'day' END) STORED;
+ALTER TABLE observation ADD COLUMN IF NOT EXISTS obs_date DATE GENERATED ALWAYS AS
+    (make_date(obs_year, COALESCE(obs_month, 1), COALESCE(obs_day, 1))) STORED;
+ALTER TABLE observation ADD COLUMN IF NOT EXISTS obs_date_precision TEXT GENERATED ALWAYS AS
+    (CASE WHEN obs_year IS NULL THEN NULL WHEN obs_month IS NULL THEN 'year'
+          WHEN obs_day IS NULL THEN 'month' ELSE 'day' END) STORED;
+ALTER TABLE diagnosis ADD COLUMN IF NOT EXISTS diagn_date DATE GENERATED ALWAYS AS
+    (make_date(diagn_year, COALESCE(diagn_month, 1), COALESCE(diagn_day, 1))) STORED;
+ALTER TABLE diagnosis ADD COLUMN IF NOT EXISTS diagn_date_precision TEXT GENERATED ALWAYS AS
+    (CASE WHEN diagn_year IS NULL THEN NULL WHEN diagn_month IS NULL THEN 'year'
+          WHEN diagn_day IS NULL THEN 'month' ELSE 'day' END) STORED;
+
+-- same rules and messages as backend.validate_date_parts, bulk_import.py checks a whole staging table with it
+CREATE OR REPLACE FUNCTION date_parts_error(ys TEXT, ms TEXT, ds TEXT, label TEXT) RETURNS TEXT AS $$
+DECLARE
+    y INT; m INT; d INT; dim INT;
+BEGIN
+    IF ys IS NOT NULL AND ys !~ '^\s*[+-]?\d{1,9}\s*$' THEN RETURN label || ': year must be an integer or empty.'; END IF;
+    IF ms IS NOT NULL AND ms !~ '^\s*[+-]?\d{1,9}\s*$' THEN RETURN label || ': month must be an integer or empty.'; END IF;
+    IF ds IS NOT NULL AND ds !~ '^\s*[+-]?\d{1,9}\s*$' THEN RETURN label || ': day must be an integer or empty.'; END IF;
+    y := ys::INT; m := ms::INT; d := ds::INT;
+    IF y IS NOT NULL AND NOT (y BETWEEN 1900 AND 3000) THEN RETURN label || ': year must be 1900..3000.'; END IF;
+    IF m IS NOT NULL AND NOT (m BETWEEN 1 AND 12) THEN RETURN label || ': month must be 1..12.'; END IF;
+    IF d IS NOT NULL AND NOT (d BETWEEN 1 AND 31) THEN RETURN label || ': day must be 1..31.'; END IF;
+    IF d IS NOT NULL AND m IS NOT NULL THEN
+        IF y IS NOT NULL THEN
+            dim := extract(day FROM make_date(y, m, 1) + interval '1 month - 1 day');
+            IF d > dim THEN
+                RETURN format('%s: %s-%s has %s days; got %s.', label, y, lpad(m::TEXT, 2, '0'), dim, d);
+            END IF;
+        ELSE
+            dim := CASE WHEN m = 2 THEN 29 WHEN m IN (4, 6, 9, 11) THEN 30 ELSE 31 END;
+            IF d > dim THEN
+                RETURN format('%s: month %s allows up to %s days; got %s.', label, m, dim, d);
+            END IF;
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- HH:MM (or HH) as backend._time_arg reads it, NULL when blank or not a valid time; used by bulk_import.py
+CREATE OR REPLACE FUNCTION import_time(ts TEXT) RETURNS TIME AS $$
+DECLARE
+    h INT; m INT;
+BEGIN
+    IF ts IS NULL OR ts !~ '^\s*\d{1,2}(:\d{1,2})?\s*$' THEN RETURN NULL; END IF;
+    h := split_part(btrim(ts), ':', 1)::INT;
+    m := COALESCE(NULLIF(split_part(btrim(ts), ':', 2), '')::INT, 0);
+    IF h > 23 OR m > 59 THEN RETURN NULL; END IF;
+    RETURN make_time(h, m, 0);
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- appointment times; a doctor cannot be booked twice for overlapping times on the same day.
+-- appoint_slot is only set for a full date with both times (generated columns cannot use appoint_date)
+ALTER TABLE appointment ADD COLUMN IF NOT EXISTS appoint_start TIME;
+ALTER TABLE appointment ADD COLUMN IF NOT EXISTS appoint_end TIME;
+ALTER TABLE appointment ADD COLUMN IF NOT EXISTS appoint_slot TSRANGE GENERATED ALWAYS AS
+    (CASE WHEN appoint_year IS NOT NULL AND appoint_month IS NOT NULL AND appoint_day IS NOT NULL
+               AND appoint_start IS NOT NULL AND appoint_end IS NOT NULL AND appoint_end > appoint_start
+          THEN tsrange(make_date(appoint_year, appoint_month, appoint_day) + appoint_start,
+                       make_date(appoint_year, appoint_month, appoint_day) + appoint_end) END) STORED;
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+DO $$
+BEGIN
+   IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'appointment_time_order') THEN
+      ALTER TABLE appointment ADD CONSTRAINT appointment_time_order
+         CHECK (appoint_start IS NULL OR appoint_end IS NULL OR appoint_end > appoint_start);
+   END IF;
+   IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'appointment_no_double_booking') THEN
+      ALTER TABLE appointment ADD CONSTRAINT appointment_no_double_booking
+         EXCLUDE USING gist (doctor_personnumer WITH =, appoint_slot WITH &&);
+   END IF;
+END$$;
+
 -- App login tables (name must be unique)
 CREATE TABLE IF NOT EXISTS admins(
     id        BIGSERIAL PRIMARY KEY,
@@ -116,13 +199,269 @@ CREATE TABLE IF NOT EXISTS users(
     password  TEXT NOT NULL
 );
 
+-- attached files are stored once per content: digest (SHA-256 of the file) -> large object,
+-- refcount is the number of observation/diagnosis rows pointing at it
+CREATE TABLE IF NOT EXISTS lo_blob(
+    lo_oid      OID PRIMARY KEY,
+    digest      BYTEA UNIQUE NOT NULL,
+    size        BIGINT NOT NULL,
+    refcount    INT NOT NULL DEFAULT 0,
+    created_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+-- how the object is stored: codec 'none' or 'zlib', size is the original file size, stored_size what is in pg_largeobject
+ALTER TABLE lo_blob ADD COLUMN IF NOT EXISTS codec TEXT NOT NULL DEFAULT 'none';
+ALTER TABLE lo_blob ADD COLUMN IF NOT EXISTS stored_size BIGINT;
+-- set when backend.lo_save_file hands the OID out before any row references it: such an object is not
+-- unlinked by the trigger when its refcount drops to 0, lo_gc.py removes it after the grace period
+ALTER TABLE lo_blob ADD COLUMN IF NOT EXISTS held_at TIMESTAMPTZ;
+
+-- replaces lo_manage: keeps lo_blob.refcount in step with the file column named in the trigger argument
+-- and unlinks an object only when its last reference goes away.
+-- objects saved before lo_blob existed have no row there and are unlinked right away, like lo_manage did
+CREATE OR REPLACE FUNCTION lo_blob_ref() RETURNS trigger AS $$
+DECLARE
+    old_oid OID;
+    new_oid OID;
+    refs    INT;
+    held    TIMESTAMPTZ;
+BEGIN
+    IF TG_OP <> 'INSERT' THEN old_oid := (to_jsonb(OLD) ->> TG_ARGV[0])::OID; END IF;
+    IF TG_OP <> 'DELETE' THEN new_oid := (to_jsonb(NEW) ->> TG_ARGV[0])::OID; END IF;
+    IF old_oid IS NOT DISTINCT FROM new_oid THEN
+        RETURN NULL;
+    END IF;
+    IF new_oid IS NOT NULL THEN
+        UPDATE lo_blob SET refcount = refcount + 1 WHERE lo_oid = new_oid;
+    END IF;
+    IF old_oid IS NOT NULL THEN
+        UPDATE lo_blob SET refcount = refcount - 1 WHERE lo_oid = old_oid RETURNING refcount, held_at INTO refs, held;
+        IF FOUND AND (refs > 0 OR held IS NOT NULL) THEN
+            RETURN NULL;
+        END IF;
+        DELETE FROM lo_blob WHERE lo_oid = old_oid;
+        DELETE FROM lo_text WHERE lo_oid = old_oid;
+        IF EXISTS (SELECT 1 FROM pg_largeobject_metadata WHERE oid = old_oid) THEN
+            PERFORM lo_unlink(old_oid);
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- large objects lo_gc.py found unreferenced, and since when (the grace period counts from first_seen)
+CREATE TABLE IF NOT EXISTS lo_gc_seen(
+    lo_oid      OID PRIMARY KEY,
+    first_seen  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- text extracted from attached files by lo_text.py (kind is the extractor, NULL when none could read the file),
+-- the search column tsv is added with the comment search columns below
+CREATE TABLE IF NOT EXISTS lo_text(
+    lo_oid        OID PRIMARY KEY,
+    kind          TEXT,
+    body          TEXT,
+    error         TEXT,
+    extracted_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+DROP TRIGGER IF EXISTS observation_lo_cleanup ON observation;
 CREATE TRIGGER observation_lo_cleanup
-BEFORE UPDATE OR DELETE ON observation
-FOR EACH ROW EXECUTE FUNCTION lo_manage(obs_file_oid);
+AFTER INSERT OR DELETE OR UPDATE OF obs_file_oid ON observation
+FOR EACH ROW EXECUTE FUNCTION lo_blob_ref('obs_file_oid');
 
+DROP TRIGGER IF EXISTS diagnosis_lo_cleanup ON diagnosis;
 CREATE TRIGGER diagnosis_lo_cleanup
-BEFORE UPDATE OR DELETE ON diagnosis
-FOR EACH ROW EXECUTE FUNCTION lo_manage(diagn_file_oid);
+AFTER INSERT OR DELETE OR UPDATE OF diagn_file_oid ON diagnosis
+FOR EACH ROW EXECUTE FUNCTION lo_blob_ref('diagn_file_oid');
+
+-- read models: observation/diagnosis rows with the appointment, patient and doctor (and their names) already
+-- joined in, so the listings read one table. Every write that can change a row refreshes it from the live
+-- join in the same transaction; read_models.py --check compares them with the live join.
+CREATE TABLE IF NOT EXISTS observation_read(
+    obser_id              TEXT PRIMARY KEY,
+    obs_year              INT,
+    obs_month             INT,
+    obs_day               INT,
+    appoint_id            TEXT,
+    patient_personnumer   TEXT,
+    patient_name          TEXT,
+    doctor_personnumer    TEXT,
+    doctor_name           TEXT,
+    obs_comment_text      TEXT,
+    obs_file_oid          OID
+);
+
+CREATE TABLE IF NOT EXISTS diagnosis_read(
+    diagn_id              TEXT PRIMARY KEY,
+    diagn_year            INT,
+    diagn_month           INT,
+    diagn_day             INT,
+    obser_id              TEXT,
+    appoint_id            TEXT,
+    patient_personnumer   TEXT,
+    patient_name          TEXT,
+    doctor_personnumer    TEXT,
+    doctor_name           TEXT,
+    diagn_comment_text    TEXT,
+    diagn_file_oid        OID
+);
+
+-- upsert instead of delete + insert, two transactions may refresh the same row at once
+CREATE OR REPLACE FUNCTION read_model_refresh_diagnoses(ids TEXT[]) RETURNS void AS $$
+BEGIN
+    INSERT INTO diagnosis_read
+    SELECT dg.diagn_id, dg.diagn_year, dg.diagn_month, dg.diagn_day, dg.obser_id, o.appoint_id,
+           p.personnumer, pp.full_name, d.personnumer, dp.full_name, dg.diagn_comment_text, dg.diagn_file_oid
+    FROM diagnosis dg
+    LEFT JOIN observation o ON o.obser_id = dg.obser_id
+    LEFT JOIN appointment a ON a.appoint_id = o.appoint_id
+    LEFT JOIN patient p ON p.personnumer = a.patient_personnumer
+    LEFT JOIN person pp ON pp.personnumer = p.personnumer
+    LEFT JOIN doctor d ON d.personnumer = a.doctor_personnumer
+    LEFT JOIN person dp ON dp.personnumer = d.personnumer
+    WHERE dg.diagn_id = ANY(ids)
+    ON CONFLICT (diagn_id) DO UPDATE SET
+        diagn_year = EXCLUDED.diagn_year, diagn_month = EXCLUDED.diagn_month, diagn_day = EXCLUDED.diagn_day,
+        obser_id = EXCLUDED.obser_id, appoint_id = EXCLUDED.appoint_id,
+        patient_personnumer = EXCLUDED.patient_personnumer, patient_name = EXCLUDED.patient_name,
+        doctor_personnumer = EXCLUDED.doctor_personnumer, doctor_name = EXCLUDED.doctor_name,
+        diagn_comment_text = EXCLUDED.diagn_comment_text, diagn_file_oid = EXCLUDED.diagn_file_oid;
+    DELETE FROM diagnosis_read r
+    WHERE r.diagn_id = ANY(ids) AND NOT EXISTS (SELECT 1 FROM diagnosis dg WHERE dg.diagn_id = r.diagn_id);
+END
+$$ LANGUAGE plpgsql;
+
+-- an observation's diagnoses show its appointment, patient and doctor, so they are refreshed with it
+CREATE OR REPLACE FUNCTION read_model_refresh_observations(ids TEXT[]) RETURNS void AS $$
+BEGIN
+    INSERT INTO observation_read
+    SELECT o.obser_id, o.obs_year, o.obs_month, o.obs_day, o.appoint_id,
+           p.personnumer, pp.full_name, d.personnumer, dp.full_name, o.obs_comment_text, o.obs_file_oid
+    FROM observation o
+    LEFT JOIN appointment a ON a.appoint_id = o.appoint_id
+    LEFT JOIN patient p ON p.personnumer = a.patient_personnumer
+    LEFT JOIN person pp ON pp.personnumer = p.personnumer
+    LEFT JOIN doctor d ON d.personnumer = a.doctor_personnumer
+    LEFT JOIN person dp ON dp.personnumer = d.personnumer
+    WHERE o.obser_id = ANY(ids)
+    ON CONFLICT (obser_id) DO UPDATE SET
+        obs_year = EXCLUDED.obs_year, obs_month = EXCLUDED.obs_month, obs_day = EXCLUDED.obs_day,
+        appoint_id = EXCLUDED.appoint_id,
+        patient_personnumer = EXCLUDED.patient_personnumer, patient_name = EXCLUDED.patient_name,
+        doctor_personnumer = EXCLUDED.doctor_personnumer, doctor_name = EXCLUDED.doctor_name,
+        obs_comment_text = EXCLUDED.obs_comment_text, obs_file_oid = EXCLUDED.obs_file_oid;
+    DELETE FROM observation_read r
+    WHERE r.obser_id = ANY(ids) AND NOT EXISTS (SELECT 1 FROM observation o WHERE o.obser_id = r.obser_id);
+    PERFORM read_model_refresh_diagnoses(ARRAY(SELECT diagn_id FROM diagnosis WHERE obser_id = ANY(ids)));
+END
+$$ LANGUAGE plpgsql;
+
+-- TG_TABLE_NAME says which rows to refresh. Deletes of patients/doctors reach the read models through
+-- ON DELETE SET NULL on appointment, a new person cannot be referenced yet
+CREATE OR REPLACE FUNCTION read_model_sync() RETURNS trigger AS $$
+DECLARE
+    keys TEXT[];
+BEGIN
+    IF TG_TABLE_NAME = 'observation' THEN
+        IF TG_OP = 'INSERT' THEN keys := ARRAY[NEW.obser_id];
+        ELSIF TG_OP = 'DELETE' THEN keys := ARRAY[OLD.obser_id];
+        ELSE keys := ARRAY[OLD.obser_id, NEW.obser_id]; END IF;
+        PERFORM read_model_refresh_observations(keys);
+    ELSIF TG_TABLE_NAME = 'diagnosis' THEN
+        IF TG_OP = 'INSERT' THEN keys := ARRAY[NEW.diagn_id];
+        ELSIF TG_OP = 'DELETE' THEN keys := ARRAY[OLD.diagn_id];
+        ELSE keys := ARRAY[OLD.diagn_id, NEW.diagn_id]; END IF;
+        PERFORM read_model_refresh_diagnoses(keys);
+    ELSIF TG_TABLE_NAME = 'appointment' THEN
+        PERFORM read_model_refresh_observations(
+            ARRAY(SELECT obser_id FROM observation WHERE appoint_id IN (OLD.appoint_id, NEW.appoint_id)));
+    ELSIF TG_TABLE_NAME = 'person' THEN
+        PERFORM read_model_refresh_observations(
+            ARRAY(SELECT obser_id FROM observation_read WHERE patient_personnumer = NEW.personnumer
+                  UNION SELECT obser_id FROM observation_read WHERE doctor_personnumer = NEW.personnumer));
+        PERFORM read_model_refresh_diagnoses(
+            ARRAY(SELECT diagn_id FROM diagnosis_read WHERE patient_personnumer = NEW.personnumer
+                  UNION SELECT diagn_id FROM diagnosis_read WHERE doctor_personnumer = NEW.personnumer));
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS observation_read_sync ON observation;
+CREATE TRIGGER observation_read_sync AFTER INSERT OR UPDATE OR DELETE ON observation
+FOR EACH ROW EXECUTE FUNCTION read_model_sync();
+
+DROP TRIGGER IF EXISTS diagnosis_read_sync ON diagnosis;
+CREATE TRIGGER diagnosis_read_sync AFTER INSERT OR UPDATE OR DELETE ON diagnosis
+FOR EACH ROW EXECUTE FUNCTION read_model_sync();
+
+DROP TRIGGER IF EXISTS appointment_read_sync ON appointment;
+CREATE TRIGGER appointment_read_sync AFTER UPDATE OF patient_personnumer, doctor_personnumer ON appointment
+FOR EACH ROW EXECUTE FUNCTION read_model_sync();
+
+DROP TRIGGER IF EXISTS person_read_sync ON person;
+CREATE TRIGGER person_read_sync AFTER UPDATE OF full_name ON person
+FOR EACH ROW EXECUTE FUNCTION read_model_sync();
+
+-- fill the read models of an existing database (rows written before they existed)
+SELECT read_model_refresh_observations(ARRAY(
+    SELECT o.obser_id FROM observation o WHERE NOT EXISTS (SELECT 1 FROM observation_read r WHERE r.obser_id = o.obser_id)));
+SELECT read_model_refresh_diagnoses(ARRAY(
+    SELECT dg.diagn_id FROM diagnosis dg WHERE NOT EXISTS (SELECT 1 FROM diagnosis_read r WHERE r.diagn_id = dg.diagn_id)));
+
+-- change notifications: when a transaction commits, every statement that changed one of these tables has sent
+-- {"table": ..., "keys": [primary keys]} on the clinic_change channel (live_updates.py listens to it).
+-- keys is null when there were too many to list, listeners then reload that table's pages.
+CREATE OR REPLACE FUNCTION notify_change() RETURNS trigger AS $$
+DECLARE
+    keys    TEXT[];
+    payload TEXT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        EXECUTE format('SELECT array_agg(DISTINCT %I::text) FROM new_rows', TG_ARGV[0]) INTO keys;
+    ELSIF TG_OP = 'DELETE' THEN
+        EXECUTE format('SELECT array_agg(DISTINCT %I::text) FROM old_rows', TG_ARGV[0]) INTO keys;
+    ELSE
+        EXECUTE format('SELECT array_agg(DISTINCT k) FROM (SELECT %1$I::text AS k FROM new_rows
+                        UNION ALL SELECT %1$I::text FROM old_rows) s', TG_ARGV[0]) INTO keys;
+    END IF;
+    IF keys IS NULL THEN
+        RETURN NULL;
+    END IF;
+    IF cardinality(keys) > 1000 THEN
+        PERFORM pg_notify('clinic_change', json_build_object('table', TG_TABLE_NAME, 'keys', NULL)::text);
+        RETURN NULL;
+    END IF;
+    -- 100 keys per message, a payload must stay under 8000 bytes
+    FOR i IN 0 .. (cardinality(keys) - 1) / 100 LOOP
+        payload := json_build_object('table', TG_TABLE_NAME, 'keys', keys[i * 100 + 1:(i + 1) * 100])::text;
+        IF octet_length(payload) > 7900 THEN
+            payload := json_build_object('table', TG_TABLE_NAME, 'keys', NULL)::text;
+        END IF;
+        PERFORM pg_notify('clinic_change', payload);
+    END LOOP;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- one statement level trigger per operation (a trigger with transition tables can only have one event)
+DO $$
+DECLARE
+    t TEXT[];
+BEGIN
+    FOREACH t SLICE 1 IN ARRAY ARRAY[['person', 'personnumer'], ['patient', 'personnumer'], ['doctor', 'personnumer'],
+                                     ['clinic', 'cli_id'], ['department', 'dept_id'], ['appointment', 'appoint_id'],
+                                     ['observation', 'obser_id'], ['diagnosis', 'diagn_id']] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %1$I ON %2$I', t[1] || '_notify_insert', t[1]);
+        EXECUTE format('DROP TRIGGER IF EXISTS %1$I ON %2$I', t[1] || '_notify_update', t[1]);
+        EXECUTE format('DROP TRIGGER IF EXISTS %1$I ON %2$I', t[1] || '_notify_delete', t[1]);
+        EXECUTE format('CREATE TRIGGER %1$I AFTER INSERT ON %2$I REFERENCING NEW TABLE AS new_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION notify_change(%3$L)', t[1] || '_notify_insert', t[1], t[2]);
+        EXECUTE format('CREATE TRIGGER %1$I AFTER UPDATE ON %2$I REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION notify_change(%3$L)', t[1] || '_notify_update', t[1], t[2]);
+        EXECUTE format('CREATE TRIGGER %1$I AFTER DELETE ON %2$I REFERENCING OLD TABLE AS old_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION notify_change(%3$L)', t[1] || '_notify_delete', t[1], t[2]);
+    END LOOP;
+END $$;
 
 -- Privileges for read-only "user" role (tables)
 REVOKE ALL ON SCHEMA public FROM "user";
@@ -146,6 +485,114 @@ GRANT INSERT ON TABLE users TO "user";
 """
 
 
+# secondary indexes, safe to re-run on an existing database
+# pg_trgm GIN indexes let the ILIKE '%term%' searches in backend.py use an index instead of a full scan
+INDEX_SQL = r"""
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS person_full_name_trgm       ON person      USING gin (full_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS person_personnumer_trgm     ON person      USING gin (personnumer gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS patient_personnumer_trgm    ON patient     USING gin (personnumer gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS patient_doctor_trgm         ON patient     USING gin (doctor_personnumer gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS doctor_personnumer_trgm     ON doctor      USING gin (personnumer gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS appointment_id_trgm         ON appointment USING gin (appoint_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS observation_id_trgm         ON observation USING gin (obser_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS observation_appoint_id_trgm ON observation USING gin (appoint_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS diagnosis_id_trgm           ON diagnosis   USING gin (diagn_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS diagnosis_obser_id_trgm     ON diagnosis   USING gin (obser_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS clinic_id_trgm              ON clinic      USING gin (cli_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS clinic_name_trgm            ON clinic      USING gin (cli_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS clinic_address_trgm         ON clinic      USING gin (address gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS department_id_trgm          ON department  USING gin (dept_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS department_name_trgm        ON department  USING gin (dept_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS department_cli_id_trgm      ON department  USING gin (cli_id gin_trgm_ops);
+
+-- foreign keys, used by the joins and by ON DELETE SET NULL on the parent tables
+CREATE INDEX IF NOT EXISTS patient_doctor_fk           ON patient     (doctor_personnumer);
+CREATE INDEX IF NOT EXISTS appointment_patient_fk      ON appointment (patient_personnumer);
+CREATE INDEX IF NOT EXISTS observation_appoint_fk      ON observation (appoint_id);
+CREATE INDEX IF NOT EXISTS diagnosis_obser_fk          ON diagnosis   (obser_id);
+CREATE INDEX IF NOT EXISTS department_cli_fk           ON department  (cli_id);
+CREATE INDEX IF NOT EXISTS doctor_dept_fk              ON doctor      (dept_id);
+
+-- attachment columns, lo_gc.py looks up every large object in them
+CREATE INDEX IF NOT EXISTS observation_file_oid        ON observation (obs_file_oid);
+CREATE INDEX IF NOT EXISTS diagnosis_file_oid          ON diagnosis   (diagn_file_oid);
+
+-- date range searches (backend.*_between)
+CREATE INDEX IF NOT EXISTS appointment_date            ON appointment (appoint_date);
+-- one doctor's calendar (backend.appointment_between / appointment_free_slots), also serves the doctor foreign key
+CREATE INDEX IF NOT EXISTS appointment_doctor_date     ON appointment (doctor_personnumer, appoint_date);
+DROP INDEX IF EXISTS appointment_doctor_fk;
+CREATE INDEX IF NOT EXISTS observation_date            ON observation (obs_date);
+CREATE INDEX IF NOT EXISTS diagnosis_date              ON diagnosis   (diagn_date);
+
+-- comment search (backend.*_text_page)
+CREATE INDEX IF NOT EXISTS observation_comment_fts     ON observation USING gin (obs_comment_tsv);
+CREATE INDEX IF NOT EXISTS diagnosis_comment_fts       ON diagnosis   USING gin (diagn_comment_tsv);
+CREATE INDEX IF NOT EXISTS lo_text_fts                 ON lo_text     USING gin (tsv);
+
+-- read models: the listing filters (ILIKE) and the trigger lookups by person
+CREATE INDEX IF NOT EXISTS observation_read_id_trgm          ON observation_read USING gin (obser_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS observation_read_appoint_trgm     ON observation_read USING gin (appoint_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS observation_read_patient_trgm     ON observation_read USING gin (patient_personnumer gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS observation_read_patient_name     ON observation_read USING gin (patient_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS observation_read_doctor_trgm      ON observation_read USING gin (doctor_personnumer gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS observation_read_doctor_name      ON observation_read USING gin (doctor_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS observation_read_patient          ON observation_read (patient_personnumer);
+CREATE INDEX IF NOT EXISTS observation_read_doctor           ON observation_read (doctor_personnumer);
+CREATE INDEX IF NOT EXISTS diagnosis_read_id_trgm            ON diagnosis_read   USING gin (diagn_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS diagnosis_read_obser_trgm         ON diagnosis_read   USING gin (obser_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS diagnosis_read_appoint_trgm       ON diagnosis_read   USING gin (appoint_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS diagnosis_read_patient_trgm       ON diagnosis_read   USING gin (patient_personnumer gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS diagnosis_read_patient_name       ON diagnosis_read   USING gin (patient_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS diagnosis_read_doctor_trgm        ON diagnosis_read   USING gin (doctor_personnumer gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS diagnosis_read_doctor_name        ON diagnosis_read   USING gin (doctor_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS diagnosis_read_patient            ON diagnosis_read   (patient_personnumer);
+CREATE INDEX IF NOT EXISTS diagnosis_read_doctor             ON diagnosis_read   (doctor_personnumer);
+
+-- keyset order of backend.appointment_page (missing date parts sort last)
+CREATE INDEX IF NOT EXISTS appointment_keyset ON appointment (
+    COALESCE(appoint_year, 2147483647), COALESCE(appoint_month, 2147483647),
+    COALESCE(appoint_day, 2147483647), appoint_id);
+"""
+
+# full-text search on the comments and on the text of attached files, in the text search configuration FTS_CONFIG (db_config.py).
+# The columns are rebuilt (with their GIN indexes) when FTS_CONFIG was changed since the last run.
+FTS_SQL = r"""
+DO $$
+DECLARE
+   t RECORD;
+BEGIN
+   FOR t IN SELECT * FROM (VALUES ('observation', 'obs_comment_tsv', 'obs_comment_text'),
+                                  ('diagnosis', 'diagn_comment_tsv', 'diagn_comment_text'),
+                                  ('lo_text', 'tsv', 'body')) v(tbl, col, src)
+   LOOP
+      IF EXISTS (SELECT 1 FROM pg_attribute a JOIN pg_attrdef ad ON ad.adrelid = a.attrelid AND ad.adnum = a.attnum
+                 WHERE a.attrelid = t.tbl::regclass AND a.attname = t.col
+                   AND position(({cfg})::regconfig::text IN pg_get_expr(ad.adbin, ad.adrelid)) = 0) THEN
+         EXECUTE format('ALTER TABLE %I DROP COLUMN %I', t.tbl, t.col);
+      END IF;
+      EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS %I TSVECTOR GENERATED ALWAYS AS '
+                     '(to_tsvector(%L::regconfig, COALESCE(%I, %L))) STORED', t.tbl, t.col, {cfg}, t.src, '');
+   END LOOP;
+END$$;
+"""
+
+# attachments written before backend.lo_save_file granted read access
+LO_GRANTS_SQL = r"""
+DO $$
+DECLARE
+   o OID;
+BEGIN
+   FOR o IN SELECT m.oid FROM pg_largeobject_metadata m
+            WHERE m.lomowner = (SELECT oid FROM pg_roles WHERE rolname = current_user)
+   LOOP
+      EXECUTE format('GRANT SELECT ON LARGE OBJECT %s TO "user"', o);
+   END LOOP;
+END$$;
+"""
+
 SEED_SQL = r"""
 INSERT INTO admins (name, password) VALUES ('admin', 'admin')
 ON CONFLICT (name) DO NOTHING;
@@ -155,8 +602,9 @@ ON CONFLICT (name) DO NOTHING;
 """
 
 def main():
+    superuser_url = build_superuser_dsn()
     # 1) Create roles & DB using superuser (connect to 'postgres')
-    with psycopg.connect(SUPERUSER_URL, autocommit=True) as conn:
+    with psycopg.connect(superuser_url, autocommit=True) as conn:
         with conn.cursor() as cur:
             cur.execute(DDL_ROLES_DB)
             cur.execute("SELECT 1 FROM pg_database WHERE datname='clinic_db';")
@@ -168,6 +616,9 @@ def main():
     with psycopg.connect(ADMIN_CLINIC_DSN, autocommit=True) as conn:
         with conn.cursor() as cur:
             cur.execute(SCHEMA_SQL)
+            cur.execute(sql.SQL(FTS_SQL).format(cfg=sql.Literal(FTS_CONFIG)))
+            cur.execute(INDEX_SQL)
+            cur.execute(LO_GRANTS_SQL)
             cur.execute(SEED_SQL)
 
     print("   clinic_db ready.")
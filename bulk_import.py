@@ -0,0 +1,257 @@
+"""
+Bulk import of patients, doctors, appointments, observations and diagnoses.
+
+The file is streamed into a temporary staging table with COPY, every check
+(required id, date parts, duplicates, foreign keys) runs as one set-based UPDATE
+over the staging table, and the accepted rows are merged into the real tables
+with INSERT ... SELECT. Everything happens in one transaction.
+
+Merge rules are the same as the single-row backend functions:
+patients/doctors that already exist are kept as they are (reported as
+"already exists (kept)"), appointments/observations/diagnoses reject ids
+that already exist. An id repeated in the file is only imported once.
+
+Rows that are not imported are written to a rejection report (CSV with
+line, reason) next to the input file, so read = inserted + rejected.
+
+    python bulk_import.py patients patients.csv
+    python bulk_import.py appointments appointments.jsonl --rejects bad.csv
+
+CSV files need a header row, JSON Lines files have one object per line.
+Column names are the argument names of the backend *_insert functions
+(appointments: start_time and end_time are optional columns, HH:MM).
+Appointments whose time overlaps another booking of the same doctor, in the
+database or on an earlier line of the file, are rejected.
+"""
+import argparse
+import csv
+import json
+import os
+
+from db import get_conn, set_dsn
+
+# an earlier line e of the same doctor overlapping s, which no still earlier accepted line overlaps
+_KEPT_OVERLAP = """FROM stage e WHERE e.reject IS NULL AND e.line_no < s.line_no
+                   AND e.doctor_personnumer = s.doctor_personnumer AND e.slot && s.slot
+                   AND NOT EXISTS (SELECT 1 FROM stage f WHERE f.reject IS NULL AND f.line_no < e.line_no
+                                   AND f.doctor_personnumer = e.doctor_personnumer AND f.slot && e.slot)"""
+
+# per entity: staging columns (the "optional" ones may be left out of a CSV header), the id column,
+# optional (year, month, day, label) to validate (with date_parts_error, created by bootstrap_db.py),
+# checks as (reason expression, condition) applied in order, and the merge statements.
+# A row is rejected by the first check whose condition is true. A check with a third element "repeat" runs
+# again until it rejects nothing more, a plain string is a statement run at that point (e.g. to add a column).
+ENTITIES = {
+    "patients": {
+        "columns": ("patient_personnumer", "patient_name", "doctor_personnumer"),
+        "key": "patient_personnumer",
+        "unique": "SELECT 1 FROM patient t WHERE t.personnumer = s.patient_personnumer",
+        "exists": "already exists (kept)",
+        "checks": [
+            ("'doctor ' || s.doctor_personnumer || ' not found'",
+             "s.doctor_personnumer IS NOT NULL AND NOT EXISTS (SELECT 1 FROM doctor d WHERE d.personnumer = s.doctor_personnumer)"),
+        ],
+        "merge": [
+            # the person may already exist in the other role
+            """INSERT INTO person (personnumer, full_name)
+               SELECT patient_personnumer, patient_name FROM stage WHERE reject IS NULL ORDER BY line_no
+               ON CONFLICT (personnumer) DO NOTHING""",
+            """INSERT INTO patient (personnumer, doctor_personnumer)
+               SELECT patient_personnumer, doctor_personnumer FROM stage WHERE reject IS NULL ORDER BY line_no
+               ON CONFLICT (personnumer) DO NOTHING""",
+        ],
+    },
+    "doctors": {
+        "columns": ("doctor_personnumer", "doctor_name", "dept_id"),
+        "key": "doctor_personnumer",
+        "unique": "SELECT 1 FROM doctor t WHERE t.personnumer = s.doctor_personnumer",
+        "exists": "already exists (kept)",
+        "checks": [
+            ("'department ' || s.dept_id || ' not found'",
+             "s.dept_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM department d WHERE d.dept_id = s.dept_id)"),
+        ],
+        "merge": [
+            # the person may already exist in the other role
+            """INSERT INTO person (personnumer, full_name)
+               SELECT doctor_personnumer, doctor_name FROM stage WHERE reject IS NULL ORDER BY line_no
+               ON CONFLICT (personnumer) DO NOTHING""",
+            """INSERT INTO doctor (personnumer, dept_id)
+               SELECT doctor_personnumer, dept_id FROM stage WHERE reject IS NULL ORDER BY line_no
+               ON CONFLICT (personnumer) DO NOTHING""",
+        ],
+    },
+    "appointments": {
+        "columns": ("appoint_id", "year", "month", "day", "location", "patient_personnumer", "doctor_personnumer",
+                    "start_time", "end_time"),
+        "optional": ("start_time", "end_time"),
+        "key": "appoint_id",
+        "dates": ("year", "month", "day", "appointment date"),
+        "unique": "SELECT 1 FROM appointment t WHERE t.appoint_id = s.appoint_id",
+        "checks": [
+            ("'appoint_id longer than 20 characters'", "length(s.appoint_id) > 20"),
+            ("'patient ' || s.patient_personnumer || ' not found'",
+             "s.patient_personnumer IS NOT NULL AND NOT EXISTS (SELECT 1 FROM patient p WHERE p.personnumer = s.patient_personnumer)"),
+            ("'doctor ' || s.doctor_personnumer || ' not found'",
+             "s.doctor_personnumer IS NOT NULL AND NOT EXISTS (SELECT 1 FROM doctor d WHERE d.personnumer = s.doctor_personnumer)"),
+            ("'start time must be a time (HH:MM).'", "s.start_time IS NOT NULL AND import_time(s.start_time) IS NULL"),
+            ("'end time must be a time (HH:MM).'", "s.end_time IS NOT NULL AND import_time(s.end_time) IS NULL"),
+            ("'appointment end time must be after its start time.'",
+             "import_time(s.end_time) <= import_time(s.start_time)"),
+            # the booked slot, like appointment.appoint_slot: only with a doctor, a full date and both times
+            """ALTER TABLE stage ADD COLUMN slot TSRANGE;
+               UPDATE stage SET slot = tsrange(make_date(year::INT, month::INT, day::INT) + import_time(start_time),
+                                               make_date(year::INT, month::INT, day::INT) + import_time(end_time))
+               WHERE reject IS NULL AND doctor_personnumer IS NOT NULL AND year IS NOT NULL AND month IS NOT NULL
+                 AND day IS NOT NULL AND start_time IS NOT NULL AND end_time IS NOT NULL""",
+            # answered by the GiST index behind appointment_no_double_booking
+            ("'doctor is already booked at that time (appointment ' || (SELECT min(a.appoint_id) FROM appointment a "
+             "WHERE a.doctor_personnumer = s.doctor_personnumer AND a.appoint_slot && s.slot) || ')'",
+             "s.slot IS NOT NULL AND EXISTS (SELECT 1 FROM appointment a "
+             "WHERE a.doctor_personnumer = s.doctor_personnumer AND a.appoint_slot && s.slot)"),
+            # within the file the earlier line wins; repeated until stable, a line only loses to an earlier
+            # line that is certain to be kept (no earlier accepted line overlaps it)
+            ("'doctor is already booked at that time (line ' || (SELECT min(e.line_no) " + _KEPT_OVERLAP + ") || ')'",
+             "s.slot IS NOT NULL AND EXISTS (SELECT 1 " + _KEPT_OVERLAP + ")", "repeat"),
+        ],
+        "merge": [
+            """INSERT INTO appointment (appoint_id, appoint_year, appoint_month, appoint_day,
+                                        appoint_location, patient_personnumer, doctor_personnumer,
+                                        appoint_start, appoint_end)
+               SELECT appoint_id, year::INT, month::INT, day::INT, location, patient_personnumer, doctor_personnumer,
+                      import_time(start_time), import_time(end_time)
+               FROM stage WHERE reject IS NULL ORDER BY line_no""",
+        ],
+    },
+    "observations": {
+        "columns": ("obser_id", "year", "month", "day", "appoint_id", "comment_text"),
+        "key": "obser_id",
+        "dates": ("year", "month", "day", "observation date"),
+        "unique": "SELECT 1 FROM observation t WHERE t.obser_id = s.obser_id",
+        "checks": [
+            ("'appointment ' || s.appoint_id || ' not found'",
+             "s.appoint_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM appointment a WHERE a.appoint_id = s.appoint_id)"),
+        ],
+        "merge": [
+            """INSERT INTO observation (obser_id, obs_year, obs_month, obs_day, appoint_id, obs_comment_text)
+               SELECT obser_id, year::INT, month::INT, day::INT, appoint_id, comment_text
+               FROM stage WHERE reject IS NULL ORDER BY line_no""",
+        ],
+    },
+    "diagnoses": {
+        "columns": ("diagn_id", "year", "month", "day", "obser_id", "comment_text"),
+        "key": "diagn_id",
+        "dates": ("year", "month", "day", "diagnosis date"),
+        "unique": "SELECT 1 FROM diagnosis t WHERE t.diagn_id = s.diagn_id",
+        "checks": [
+            ("'observation ' || s.obser_id || ' not found'",
+             "s.obser_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM observation o WHERE o.obser_id = s.obser_id)"),
+        ],
+        "merge": [
+            """INSERT INTO diagnosis (diagn_id, diagn_year, diagn_month, diagn_day, obser_id, diagn_comment_text)
+               SELECT diagn_id, year::INT, month::INT, day::INT, obser_id, comment_text
+               FROM stage WHERE reject IS NULL ORDER BY line_no""",
+        ],
+    },
+}
+
+def _read_rows(path, columns, optional=()):
+    """Yield (line_no, values..., reject) tuples from a CSV or JSON Lines file."""
+    if path.lower().endswith((".jsonl", ".ndjson", ".json")):
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    obj = json.loads(line)
+                    if not isinstance(obj, dict):
+                        raise ValueError("not an object")
+                except ValueError as e:
+                    yield (line_no,) + (None,) * len(columns) + (f"invalid JSON: {e}",)
+                    continue
+                yield (line_no,) + tuple(None if obj.get(c) is None else str(obj.get(c)) for c in columns) + (None,)
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            missing = [c for c in columns if c not in (reader.fieldnames or []) and c not in optional]
+            if missing:
+                raise ValueError(f"{os.path.basename(path)}: missing column(s) {', '.join(missing)}")
+            for row in reader:
+                yield (reader.line_num,) + tuple(row.get(c) for c in columns) + (None,)
+
+def import_file(entity: str, path: str, *, rejects_path: str | None = None) -> dict:
+    """Load one file into the given entity ('patients', 'doctors', ...). Returns counts and the report path."""
+    spec = ENTITIES.get(entity)
+    if spec is None:
+        raise ValueError(f"unknown entity {entity!r}, expected one of {', '.join(ENTITIES)}")
+    cols = spec["columns"]
+    key = spec["key"]
+    rejects_path = rejects_path or os.path.splitext(path)[0] + ".rejects.csv"
+
+    with get_conn() as (conn, cur):
+        cur.execute(f"""CREATE TEMP TABLE stage (line_no INT, {', '.join(f'{c} TEXT' for c in cols)}, reject TEXT)
+                        ON COMMIT DROP""")
+        with cur.copy(f"COPY stage (line_no, {', '.join(cols)}, reject) FROM STDIN") as copy:
+            for row in _read_rows(path, cols, spec.get("optional", ())):
+                copy.write_row(row)
+
+        # blanks are NULL, like _is_blank / "or None" in the backend
+        cur.execute(f"UPDATE stage SET {', '.join(f'{c} = NULLIF(btrim({c}), %s)' for c in cols)}",
+                    ("",) * len(cols))
+
+        checks = [(f"'missing {key}'", f"s.{key} IS NULL")]
+        if "dates" in spec:
+            y, m, d, label = spec["dates"]
+            err = f"date_parts_error(s.{y}, s.{m}, s.{d}, '{label}')"
+            checks.append((err, f"{err} IS NOT NULL"))
+        if "unique" in spec:
+            exists = spec.get("exists", "already exists")
+            checks.append((f"'{key} ' || s.{key} || ' {exists}'", f"EXISTS ({spec['unique']})"))
+            checks.append((f"'{key} ' || s.{key} || ' repeated in file (first at line ' || f.first || ')'",
+                           f"f.first < s.line_no"))
+        checks += spec["checks"]
+
+        for check in checks:
+            if isinstance(check, str):
+                cur.execute(check)
+                continue
+            reason, cond = check[:2]
+            from_first = ""
+            if "f.first" in cond:
+                from_first = f"FROM (SELECT {key}, min(line_no) AS first FROM stage GROUP BY {key}) f"
+                cond = f"f.{key} = s.{key} AND {cond}"
+            while True:
+                cur.execute(f"UPDATE stage s SET reject = {reason} {from_first} WHERE s.reject IS NULL AND {cond}")
+                if check[2:] != ("repeat",) or cur.rowcount == 0:
+                    break
+
+        inserted = 0
+        for stmt in spec["merge"]:
+            cur.execute(stmt)
+            inserted = cur.rowcount
+
+        cur.execute("SELECT count(*), count(reject) FROM stage")
+        total, rejected = cur.fetchone()
+        cur.execute("SELECT line_no, reject FROM stage WHERE reject IS NOT NULL ORDER BY line_no")
+        with open(rejects_path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["line", "reason"])
+            w.writerows(cur)
+        conn.commit()
+
+    return {"read": total, "inserted": inserted, "rejected": rejected, "rejects_path": rejects_path}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("entity", choices=sorted(ENTITIES))
+    ap.add_argument("path")
+    ap.add_argument("--rejects", help="where to write the rejection report (default: <file>.rejects.csv)")
+    args = ap.parse_args()
+
+    set_dsn("super")   # writes need the admin role
+    res = import_file(args.entity, args.path, rejects_path=args.rejects)
+    print(f"read {res['read']}, inserted {res['inserted']}, rejected {res['rejected']}")
+    if res["rejected"]:
+        print(f"rejection report: {res['rejects_path']}")
+
+if __name__ == "__main__":
+    main()
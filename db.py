@@ -1,16 +1,64 @@
-import psycopg
+import atexit
+import threading
+import time
+import weakref
 from contextlib import contextmanager
-from db_config import USER_DSN, ADMIN_DSN
+from functools import partial
+
+from psycopg_pool import ConnectionPool
+from db_config import (USER_DSN, ADMIN_DSN, POOL_MIN_SIZE, POOL_MAX_SIZE,
+                       POOL_MAX_IDLE, POOL_MAX_LIFETIME, POOL_TIMEOUT, PREPARED_MAX)
 
 _CURRENT_DSN = USER_DSN  # when set_dsn is not called we use normal user by default
 
+# one pool per DSN, created lazily the first time that role asks for a connection
+_POOLS: dict[str, ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+# (pool name, open time) of each pooled connection, so we can report connection age
+_BORN = weakref.WeakKeyDictionary()
+# statement name -> calls, errors, time and number of distinct query texts, see execute()
+_STMTS: dict[str, dict] = {}
+_STMTS_LOCK = threading.Lock()
+
 def set_dsn(role: str):
     """Switch the connection DSN by role string: 'super' => admin DSN, else user DSN."""
     global _CURRENT_DSN
     _CURRENT_DSN = ADMIN_DSN if role == "super" else USER_DSN
 
+def current_dsn() -> str:
+    """DSN of the role chosen with set_dsn, for connections that cannot come from the pool (e.g. LISTEN)."""
+    return _CURRENT_DSN
+
+def _configure(conn, name):
+    _BORN[conn] = (name, time.monotonic())
+    conn.prepared_max = PREPARED_MAX   # prepared statements kept per connection, least recently used dropped
+
+def _get_pool(dsn: str) -> ConnectionPool:
+    pool = _POOLS.get(dsn)
+    if pool is not None:
+        return pool
+    with _POOLS_LOCK:
+        pool = _POOLS.get(dsn)
+        if pool is None:
+            name = "super" if dsn == ADMIN_DSN else "normal"
+            pool = ConnectionPool(
+                dsn,
+                kwargs={"autocommit": False},
+                min_size=POOL_MIN_SIZE,
+                max_size=max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+                max_idle=POOL_MAX_IDLE,
+                max_lifetime=POOL_MAX_LIFETIME,
+                timeout=POOL_TIMEOUT,
+                configure=partial(_configure, name=name),
+                check=ConnectionPool.check_connection,  # cheap health check on every checkout
+                name=name,
+                open=True,
+            )
+            _POOLS[dsn] = pool
+        return pool
+
 @contextmanager
-# here we use contextmanager so it ensures that the connection is always close and it rollsback if this is exception
+# here we use contextmanager so it ensures that the connection is always returned and it rollsback if this is exception
 def get_conn():
     """
     Usage:
@@ -19,7 +67,73 @@ def get_conn():
             rows = cur.fetchall()
             conn.commit()
     """
-    with psycopg.connect(_CURRENT_DSN, autocommit=False) as conn:
+    with _get_pool(_CURRENT_DSN).connection() as conn:
         with conn.cursor() as cur:
             yield conn, cur
-   
+
+@contextmanager
+def get_stream(name: str, itersize: int = 2000):
+    """Like get_conn, but cur is a named (server-side) cursor that fetches itersize rows per round trip.
+    The connection stays checked out until the with block ends."""
+    with _get_pool(_CURRENT_DSN).connection() as conn:
+        with conn.cursor(name=name) as cur:
+            cur.itersize = itersize
+            yield conn, cur
+
+def execute(cur, name: str, query, args=None):
+    """cur.execute(query, args) as a prepared statement: the first call on a pooled connection prepares
+    the query text, later calls only send the parameters. Counted and timed under name, see statement_stats()."""
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        cur.execute(query, args, prepare=True)
+        ok = True
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        with _STMTS_LOCK:
+            s = _STMTS.get(name)
+            if s is None:
+                s = _STMTS[name] = {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "texts": set()}
+            s["calls"] += 1
+            s["errors"] += not ok
+            s["total_ms"] += ms
+            s["max_ms"] = max(s["max_ms"], ms)
+            # sql.SQL / sql.Composed are not hashable, their text is
+            s["texts"].add(hash(query if isinstance(query, (str, bytes)) else query.as_string(cur)))
+    return cur
+
+def statement_stats(reset: bool = False) -> dict:
+    """Per statement name: calls, errors, total/average/max milliseconds (including reading the rows)
+    and variants, the number of distinct query texts (each is prepared once per connection)."""
+    with _STMTS_LOCK:
+        out = {name: {"calls": s["calls"], "errors": s["errors"], "total_ms": round(s["total_ms"], 2),
+                      "avg_ms": round(s["total_ms"] / s["calls"], 3), "max_ms": round(s["max_ms"], 2),
+                      "variants": len(s["texts"])}
+               for name, s in sorted(_STMTS.items())}
+        if reset:
+            _STMTS.clear()
+    return out
+
+def pool_stats() -> dict:
+    """Counters for every open pool, keyed by pool name ('super' / 'normal')."""
+    now = time.monotonic()
+    out = {}
+    for pool in list(_POOLS.values()):
+        stats = pool.get_stats()
+        ages = [now - born for name, born in list(_BORN.values()) if name == pool.name]
+        stats["checkouts"] = stats.get("requests_num", 0)
+        stats["waits"] = stats.get("requests_queued", 0)      # checkouts that had to wait for a free connection
+        stats["wait_ms"] = stats.get("requests_wait_ms", 0)
+        stats["connection_age_avg_s"] = round(sum(ages) / len(ages), 1) if ages else 0.0
+        stats["connection_age_max_s"] = round(max(ages), 1) if ages else 0.0
+        out[pool.name] = stats
+    return out
+
+def close_pools():
+    """Close every pool (called at interpreter exit)."""
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
+
+atexit.register(close_pools)
@@ -0,0 +1,72 @@
+"""
+Change notifications from the database, so open pages follow what other windows and workstations save.
+
+Statement triggers (notify_change in bootstrap_db.py) send {"table": ..., "keys": [...]} on the
+clinic_change channel when a transaction commits. Listener keeps one connection outside the pool
+that LISTENs on it and calls on_change(table, keys) on its own thread for every message. keys is
+None when too many rows changed to list them, and (None, None) means "anything may have changed":
+the connection was lost and notifications sent meanwhile are gone. Every message also drops the
+cached listings of that table (backend.cache_invalidate), so the cache sees other clients' writes.
+
+    listener = live_updates.Listener(lambda table, keys: ...)
+    listener.start()
+"""
+import json
+import sys
+import threading
+
+import psycopg
+
+import backend
+from db import current_dsn
+
+CHANNEL = "clinic_change"
+RETRY_MAX_S = 30
+
+class Listener:
+    def __init__(self, on_change):
+        self.on_change = on_change
+        self.connected = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="live_updates", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        delay, lost = 1, False
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(current_dsn(), autocommit=True) as conn:
+                    conn.execute(f"LISTEN {CHANNEL}")
+                    self.connected, delay = True, 1
+                    if lost:
+                        self._deliver(None, None)
+                    while not self._stop.is_set():
+                        for n in conn.notifies(timeout=1.0):
+                            try:
+                                msg = json.loads(n.payload)
+                            except ValueError:
+                                continue
+                            self._deliver(msg.get("table"), msg.get("keys"))
+            except psycopg.Error as e:
+                if not lost:
+                    print(f"live_updates: {type(e).__name__}: {e}", file=sys.stderr)
+                lost = True
+            self.connected = False
+            self._stop.wait(delay)
+            delay = min(delay * 2, RETRY_MAX_S)
+
+    def _deliver(self, table, keys):
+        if table:
+            backend.cache_invalidate(table)
+        else:
+            backend.cache_invalidate()
+        try:
+            self.on_change(table, keys)
+        except Exception as e:   # a broken callback must not stop the listener
+            print(f"live_updates: {type(e).__name__}: {e}", file=sys.stderr)
@@ -0,0 +1,134 @@
+"""
+Local disk cache of downloaded attachments (Large Objects).
+
+Files are kept under LO_CACHE_DIR, named by their content digest (lo_blob.digest). Every fetch
+asks the server which digest the OID has right now (one small query, no file data). A replaced
+or re-used OID maps to a different digest, so a stale file is never served. Files are written
+to a temporary name and renamed into place, and the least recently used ones are removed once
+the cache is over LO_CACHE_MAX_BYTES.
+
+    path = lo_cache.fetch(oid)
+"""
+import glob
+import hashlib
+import os
+import stat
+import tempfile
+import threading
+import time
+
+import backend
+from db import get_conn
+from db_config import LO_CACHE_DIR, LO_CACHE_MAX_BYTES
+
+_STATS_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0, "uncached": 0, "bytes_downloaded": 0, "evicted": 0}
+
+class _HashingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.h = hashlib.sha256()
+
+    def write(self, b):
+        self.h.update(b)
+        return self.f.write(b)
+
+def _count(name, n=1):
+    with _STATS_LOCK:
+        _STATS[name] += n
+
+def _lookup(oid):
+    with get_conn() as (conn, cur):
+        cur.execute("SELECT digest, size FROM lo_blob WHERE lo_oid=%s", (oid,))
+        return cur.fetchone()
+
+def fetch(oid: int, *, suffix_for=None, progress=None) -> str:
+    """Local path of the file in Large Object oid, downloaded only if it is not cached yet.
+    suffix_for(first bytes) -> extension is used to name a new file, so the OS can open it.
+    The returned file is read-only and shared, copy it before changing it."""
+    row = _lookup(oid)
+    if row is None:
+        # saved before lo_blob existed, there is no digest to check a cached copy against
+        head = backend.lo_read_bytes(oid, length=256)
+        path = os.path.join(tempfile.gettempdir(), f"clinic_{oid}{suffix_for(head) if suffix_for else ''}")
+        _count("bytes_downloaded", backend.lo_export_file(oid, path, progress=progress))
+        _count("uncached")
+        return path
+
+    digest, size = bytes(row[0]), row[1]
+    key = digest.hex()
+    os.makedirs(LO_CACHE_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(LO_CACHE_DIR, key + "*")):
+        if os.path.getsize(path) == size:
+            os.utime(path)   # the modification time is the LRU clock
+            _count("hits")
+            return path
+
+    # download to a hidden temp name, only complete and verified files get the real name
+    fd, tmp = tempfile.mkstemp(dir=LO_CACHE_DIR, prefix=".part-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            w = _HashingWriter(f)
+            n = backend.lo_export_file(oid, w, progress=progress)
+            f.flush()
+            os.fsync(f.fileno())
+        if w.h.digest() != digest:
+            raise ValueError(f"file {oid} changed while it was downloaded, try again")
+        with open(tmp, "rb") as f:
+            path = os.path.join(LO_CACHE_DIR, key + (suffix_for(f.read(256)) if suffix_for else ""))
+        os.chmod(tmp, stat.S_IREAD)   # opened in external viewers, do not let them edit the cached copy
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    _count("misses")
+    _count("bytes_downloaded", n)
+    _evict(keep=path)
+    return path
+
+def _remove(path) -> bool:
+    try:
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        os.unlink(path)
+        return True
+    except OSError:   # e.g. still open in a viewer on Windows, try again next time
+        return False
+
+def _evict(keep=None):
+    entries, total = [], 0
+    for e in os.scandir(LO_CACHE_DIR):
+        if not e.is_file():
+            continue
+        st = e.stat()
+        if e.name.startswith(".part-"):
+            if st.st_mtime < time.time() - 24 * 3600:   # left behind by a crash
+                _remove(e.path)
+            continue
+        entries.append((st.st_mtime, st.st_size, e.path))
+        total += st.st_size
+    for _, size, path in sorted(entries):
+        if total <= LO_CACHE_MAX_BYTES:
+            break
+        if path != keep and _remove(path):
+            total -= size
+            _count("evicted")
+
+def stats() -> dict:
+    """Hit/miss counters of this process plus the current size of the cache directory."""
+    with _STATS_LOCK:
+        out = dict(_STATS)
+    files = [e for e in os.scandir(LO_CACHE_DIR) if e.is_file() and not e.name.startswith(".")] \
+        if os.path.isdir(LO_CACHE_DIR) else []
+    out["files"] = len(files)
+    out["bytes"] = sum(e.stat().st_size for e in files)
+    return out
+
+def clear():
+    """Remove every cached file."""
+    if os.path.isdir(LO_CACHE_DIR):
+        for e in os.scandir(LO_CACHE_DIR):
+            if e.is_file():
+                _remove(e.path)
@@ -0,0 +1,123 @@
+"""
+Garbage collector for attachments (Large Objects) that no row references any more.
+
+A large object is garbage when neither observation.obs_file_oid nor diagnosis.diagn_file_oid
+points at it, e.g. a file saved with lo_save_file whose row was never written, or one left by a
+failed save from before the *_with_file functions. Each run first records unreferenced objects in
+lo_gc_seen, then unlinks those that have been unreferenced for longer than the grace period
+(and, for lo_blob entries, were created and last handed out by lo_save_file before it), in batches
+of one transaction each.
+An object that gets referenced again within the grace period is kept.
+
+    python lo_gc.py                     # 24 h grace period
+    python lo_gc.py --grace-hours 1 --batch 200
+    python lo_gc.py --dry-run           # report only (still records first-seen times)
+    python lo_gc.py --every 3600        # keep running, one pass per hour
+"""
+import argparse
+import time
+
+from db import get_conn, set_dsn
+
+# unreferenced objects of the current user (lo_unlink needs ownership)
+_UNREFERENCED = """
+    m.lomowner = (SELECT oid FROM pg_roles WHERE rolname = current_user)
+    AND NOT EXISTS (SELECT 1 FROM observation o WHERE o.obs_file_oid = m.oid)
+    AND NOT EXISTS (SELECT 1 FROM diagnosis d WHERE d.diagn_file_oid = m.oid)
+"""
+
+def mark() -> int:
+    """Record newly unreferenced objects, forget the ones that are referenced again or gone. Returns the total."""
+    with get_conn() as (conn, cur):
+        cur.execute(f"""
+            DELETE FROM lo_gc_seen s
+            WHERE NOT EXISTS (SELECT 1 FROM pg_largeobject_metadata m WHERE m.oid = s.lo_oid AND {_UNREFERENCED})
+        """)
+        cur.execute(f"""
+            INSERT INTO lo_gc_seen (lo_oid)
+            SELECT m.oid FROM pg_largeobject_metadata m WHERE {_UNREFERENCED}
+            ON CONFLICT (lo_oid) DO NOTHING
+        """)
+        cur.execute("SELECT count(*) FROM lo_gc_seen")
+        n = cur.fetchone()[0]
+        conn.commit()
+        return n
+
+def _stored_bytes(cur, oid) -> int:
+    cur.execute("SELECT lo_open(%s, %s)", (oid, 0x40000))
+    fd = cur.fetchone()[0]
+    cur.execute("SELECT lo_lseek64(%s, 0, 2)", (fd,))
+    size = cur.fetchone()[0]
+    cur.execute("SELECT lo_close(%s)", (fd,))
+    return size
+
+def sweep(grace_hours: float, batch: int, dry_run: bool = False) -> tuple[int, int]:
+    """Unlink objects unreferenced for longer than grace_hours. Returns (objects, bytes) reclaimed."""
+    last, count, reclaimed = 0, 0, 0
+    while True:
+        with get_conn() as (conn, cur):
+            cur.execute("""
+                SELECT s.lo_oid FROM lo_gc_seen s
+                LEFT JOIN lo_blob b ON b.lo_oid = s.lo_oid
+                WHERE s.lo_oid > %s
+                  AND s.first_seen < now() - %s * interval '1 hour'
+                  AND (b.lo_oid IS NULL OR greatest(b.created_at, b.held_at) < now() - %s * interval '1 hour')
+                ORDER BY s.lo_oid
+                LIMIT %s
+            """, (last, grace_hours, grace_hours, batch))
+            oids = [r[0] for r in cur.fetchall()]
+            if not oids:
+                return count, reclaimed
+            last = oids[-1]
+
+            # check again inside this transaction, something may have started using them since mark()
+            cur.execute(f"""
+                SELECT m.oid FROM pg_largeobject_metadata m
+                WHERE m.oid = ANY(%s) AND NOT EXISTS (SELECT 1 FROM lo_blob b WHERE b.lo_oid = m.oid)
+                  AND {_UNREFERENCED}
+            """, (oids,))
+            unregistered = [r[0] for r in cur.fetchall()]
+            # refcount and hold are checked under the row lock, a save that is reusing the object right now holds it
+            cur.execute("""
+                DELETE FROM lo_blob b
+                WHERE b.lo_oid = ANY(%s) AND b.refcount <= 0
+                  AND greatest(b.created_at, b.held_at) < now() - %s * interval '1 hour'
+                  AND NOT EXISTS (SELECT 1 FROM observation o WHERE o.obs_file_oid = b.lo_oid)
+                  AND NOT EXISTS (SELECT 1 FROM diagnosis d WHERE d.diagn_file_oid = b.lo_oid)
+                RETURNING b.lo_oid, COALESCE(b.stored_size, b.size)
+            """, (oids, grace_hours))
+            registered = cur.fetchall()
+
+            garbage = unregistered + [oid for oid, _ in registered]
+            reclaimed += sum(size for _, size in registered) + sum(_stored_bytes(cur, oid) for oid in unregistered)
+            count += len(garbage)
+            if not dry_run:
+                cur.execute("SELECT lo_unlink(o) FROM unnest(%s::oid[]) o", (garbage,))
+                cur.execute("DELETE FROM lo_gc_seen WHERE lo_oid = ANY(%s)", (garbage,))
+                cur.execute("DELETE FROM lo_text WHERE lo_oid = ANY(%s)", (garbage,))
+                conn.commit()
+            else:
+                conn.rollback()
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--grace-hours", type=float, default=24)
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--every", type=float, metavar="SECONDS", help="run again every SECONDS instead of once")
+    args = ap.parse_args()
+
+    set_dsn("super")   # the objects belong to the admin role
+    while True:
+        seen = mark()
+        n, size = sweep(args.grace_hours, args.batch, args.dry_run)
+        verb = "would unlink" if args.dry_run else "unlinked"
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {verb} {n} objects, "
+              f"{size} bytes ({size / 1024 / 1024:.1f} MiB) reclaimed; "
+              f"{seen - (0 if args.dry_run else n)} unreferenced objects tracked")
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Text of attached files (Large Objects), so the comment search also finds words inside them.
+
+Files that an observation or diagnosis references and that have no lo_text row yet are read from the
+database, parsed by text_extract.py in a pool of worker processes and stored in lo_text, whose tsvector
+column has a GIN index. backend.observation_text_page / diagnosis_text_page search comments and files
+in one query. Files no extractor can read (or bigger than LO_TEXT_MAX_BYTES) get a row without text
+so they are not tried again, --reindex extracts everything again (e.g. after adding an extractor).
+The app calls index_soon() after saving a file; to catch up on existing files or run it as a service:
+
+    python lo_text.py
+    python lo_text.py --every 60
+    python lo_text.py --reindex
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import backend
+import text_extract
+from db import get_conn, set_dsn
+from db_config import LO_TEXT_MAX_BYTES, LO_TEXT_MAX_CHARS, LO_TEXT_WORKERS
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_RUN_LOCK = threading.Lock()   # one index_pending at a time per process
+_BG_LOCK = threading.Lock()
+_BG = {"thread": None, "again": False}
+
+def _workers() -> int:
+    return LO_TEXT_WORKERS or os.cpu_count() or 1
+
+def _pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            # spawn: the workers only import text_extract, not a copy of this (threaded) process
+            _POOL = ProcessPoolExecutor(max_workers=_workers(), mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+def _reset_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
+
+def pending(limit: int) -> list:
+    """(oid, size) of referenced files that have not been extracted, size is None for files saved before lo_blob."""
+    with get_conn() as (conn, cur):
+        cur.execute("""
+            SELECT f.oid, b.size
+            FROM (SELECT obs_file_oid AS oid FROM observation WHERE obs_file_oid IS NOT NULL
+                  UNION
+                  SELECT diagn_file_oid FROM diagnosis WHERE diagn_file_oid IS NOT NULL) f
+            LEFT JOIN lo_blob b ON b.lo_oid = f.oid
+            WHERE NOT EXISTS (SELECT 1 FROM lo_text t WHERE t.lo_oid = f.oid)
+            ORDER BY f.oid
+            LIMIT %s
+        """, (limit,))
+        return cur.fetchall()
+
+def _download(oid, size):
+    if size is not None and size > LO_TEXT_MAX_BYTES:
+        return None
+    buf = io.BytesIO()
+    backend.lo_export_file(oid, buf, length=LO_TEXT_MAX_BYTES + 1)
+    data = buf.getvalue()
+    return data if len(data) <= LO_TEXT_MAX_BYTES else None
+
+def _store(oid, kind, text, error=None):
+    with get_conn() as (conn, cur):
+        cur.execute("""
+            INSERT INTO lo_text (lo_oid, kind, body, error) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (lo_oid) DO UPDATE
+               SET kind = EXCLUDED.kind, body = EXCLUDED.body, error = EXCLUDED.error, extracted_at = now()
+        """, (oid, kind, text or None, error))
+        conn.commit()
+
+def _forget_removed():
+    # rows of objects that were unlinked outside the lo_blob_ref trigger (the OID could be reused)
+    with get_conn() as (conn, cur):
+        cur.execute("""DELETE FROM lo_text t
+                       WHERE NOT EXISTS (SELECT 1 FROM pg_largeobject_metadata m WHERE m.oid = t.lo_oid)""")
+        conn.commit()
+
+def index_pending(*, batch: int = 100) -> dict:
+    """Extract the text of every file that has none yet. Returns counts of files with text,
+    without text (format not readable), skipped as too large, and failed."""
+    counts = {"indexed": 0, "no_text": 0, "too_large": 0, "failed": 0}
+    extract = partial(text_extract.extract, max_chars=LO_TEXT_MAX_CHARS)
+    with _RUN_LOCK:
+        _forget_removed()
+        while True:
+            todo = pending(batch)
+            if not todo:
+                return counts
+            in_flight, retry = {}, []
+
+            def collect(done):
+                for fut in done:
+                    oid, data = in_flight.pop(fut)
+                    try:
+                        kind, text = fut.result()
+                    except BrokenProcessPool:
+                        retry.append((oid, data))   # a worker died, maybe on another file
+                        continue
+                    except Exception as e:
+                        _store(oid, None, None, f"{type(e).__name__}: {e}")
+                        counts["failed"] += 1
+                        continue
+                    _store(oid, kind, text)
+                    counts["indexed" if text else "no_text"] += 1
+
+            def submit(oid, data):
+                try:
+                    in_flight[_pool().submit(extract, data)] = (oid, data)
+                except BrokenProcessPool:
+                    retry.append((oid, data))
+
+            # download in this process while the workers parse, at most two files per worker in memory
+            for oid, size in todo:
+                try:
+                    data = _download(oid, size)
+                except Exception as e:
+                    _store(oid, None, None, f"{type(e).__name__}: {e}")
+                    counts["failed"] += 1
+                    continue
+                if data is None:
+                    _store(oid, None, None, "too large")
+                    counts["too_large"] += 1
+                    continue
+                submit(oid, data)
+                while len(in_flight) >= 2 * _workers():
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            while in_flight:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+
+            # after a crash (e.g. out of memory) try those files one at a time, a file that crashes
+            # a worker on its own is recorded as failed
+            crashed, retry[:] = list(retry), []
+            for oid, data in crashed:
+                _reset_pool()
+                submit(oid, data)
+                while in_flight:
+                    collect(wait(in_flight).done)
+                if retry:
+                    retry.clear()
+                    _store(oid, None, None, "extractor crashed")
+                    counts["failed"] += 1
+
+def index_soon():
+    """Run index_pending() on a background thread, the app calls this after saving a file.
+    Calls while it is running make it look for new files once more when it is done."""
+    with _BG_LOCK:
+        _BG["again"] = True
+        if _BG["thread"] is None:
+            _BG["thread"] = threading.Thread(target=_background, name="lo_text", daemon=True)
+            _BG["thread"].start()
+
+def _background():
+    while True:
+        with _BG_LOCK:
+            if not _BG["again"]:
+                _BG["thread"] = None
+                return
+            _BG["again"] = False
+        try:
+            index_pending()
+        except Exception as e:   # not fatal, the next save or a lo_text.py run catches up
+            print(f"lo_text: {type(e).__name__}: {e}", file=sys.stderr)
+
+def reindex():
+    """Forget all extracted text, the next index_pending() extracts every file again."""
+    with get_conn() as (conn, cur):
+        cur.execute("DELETE FROM lo_text")
+        conn.commit()
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--reindex", action="store_true", help="extract every file again")
+    ap.add_argument("--batch", type=int, default=100)
+    ap.add_argument("--every", type=float, metavar="SECONDS", help="look for new files every SECONDS instead of once")
+    args = ap.parse_args()
+
+    set_dsn("super")
+    if args.reindex:
+        reindex()
+    while True:
+        t0 = time.perf_counter()
+        c = index_pending(batch=args.batch)
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {c['indexed']} files indexed, {c['no_text']} without text, "
+              f"{c['too_large']} too large, {c['failed']} failed ({time.perf_counter() - t0:.1f} s)")
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+if __name__ == "__main__":
+    main()
@@ -76,29 +76,31 @@ def open_register():
     tk.Button(top, text="Register", command=do_register, font=("Arial", 12), width=10).grid(row=3, column=0, columnspan=2, padx=5, pady=10)
 
 # --- login window ---
-root = tk.Tk()
-root.title("Login")
-root.geometry("320x250")
-root.attributes("-topmost", True); root.after(150, lambda: root.attributes("-topmost", False))
+# guarded so worker processes that re-import this module (lo_text.py) do not open a window
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.title("Login")
+    root.geometry("320x250")
+    root.attributes("-topmost", True); root.after(150, lambda: root.attributes("-topmost", False))
 
-# Set theme
-sv_ttk.set_theme("dark")
+    # Set theme
+    sv_ttk.set_theme("dark")
 
-# Create login form
-tk.Label(root, text="Username:", font=("Arial", 12)).grid(row=0, column=0, padx=5, pady=5)
-entry_username = tk.Entry(root, font=("Arial", 12), width=25)
-entry_username.grid(row=0, column=1, padx=5, pady=5)
+    # Create login form
+    tk.Label(root, text="Username:", font=("Arial", 12)).grid(row=0, column=0, padx=5, pady=5)
+    entry_username = tk.Entry(root, font=("Arial", 12), width=25)
+    entry_username.grid(row=0, column=1, padx=5, pady=5)
 
-tk.Label(root, text="Password:", font=("Arial", 12)).grid(row=1, column=0, padx=5, pady=5)
-entry_password = tk.Entry(root, show="*", font=("Arial", 12), width=25)
-entry_password.grid(row=1, column=1, padx=5, pady=5)
+    tk.Label(root, text="Password:", font=("Arial", 12)).grid(row=1, column=0, padx=5, pady=5)
+    entry_password = tk.Entry(root, show="*", font=("Arial", 12), width=25)
+    entry_password.grid(row=1, column=1, padx=5, pady=5)
 
 
-# Create login and register buttons
-btns = tk.Frame(root)
-btns.grid(row=2, column=0, columnspan=2, padx=5, pady=10)
+    # Create login and register buttons
+    btns = tk.Frame(root)
+    btns.grid(row=2, column=0, columnspan=2, padx=5, pady=10)
 
-tk.Button(btns, text="Login", command=do_login, font=("Arial", 12), width=10, bg="#4CAF50", fg="#ffffff").pack(side=tk.LEFT, padx=5)
-tk.Button(btns, text="Register", command=open_register, font=("Arial", 12), width=10, bg="#03A9F4", fg="#ffffff").pack(side=tk.LEFT, padx=5)
+    tk.Button(btns, text="Login", command=do_login, font=("Arial", 12), width=10, bg="#4CAF50", fg="#ffffff").pack(side=tk.LEFT, padx=5)
+    tk.Button(btns, text="Register", command=open_register, font=("Arial", 12), width=10, bg="#03A9F4", fg="#ffffff").pack(side=tk.LEFT, padx=5)
 
-root.mainloop()
+    root.mainloop()
@@ -1,6 +1,279 @@
+import os
+import queue
+import shutil
+import subprocess
+import sys
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from functools import partial
 from tkinter import messagebox, filedialog,ttk
 import backend
+import live_updates
+import lo_cache
+import lo_text
+from db_config import LIVE_UPDATES
+
+# file type from the first bytes of an attachment, so the OS knows which program opens it
+_MAGIC = [(b"%PDF", ".pdf"), (b"\x89PNG", ".png"), (b"\xff\xd8\xff", ".jpg"), (b"GIF8", ".gif"),
+          (b"PK\x03\x04", ".zip"), (b"MSH|", ".hl7")]
+
+def _guess_ext(head: bytes) -> str:
+    for magic, ext in _MAGIC:
+        if head.startswith(magic):
+            return ext
+    if head[128:132] == b"DICM":
+        return ".dcm"
+    if head[4:8] == b"ftyp":
+        return ".mp4"
+    return ".bin" if b"\0" in head else ".txt"
+
+def _open_with_default_app(path: str):
+    if sys.platform.startswith("win"):
+        os.startfile(path)
+    elif sys.platform == "darwin":
+        subprocess.Popen(["open", path])
+    else:
+        subprocess.Popen(["xdg-open", path])
+
+# Tk is not thread safe: backend calls run on worker threads and their results are queued,
+# the Tk main loop drains the queue with after() and runs the callbacks.
+class Dispatcher:
+    POLL_MS = 30
+
+    def __init__(self, root, workers: int = 4):
+        self.root = root
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        self.results = queue.Queue()
+        self.latest = {}       # page key -> generation of its newest request
+        self.pending = {}      # page key -> future of its newest superseding request
+        self.busy = {}         # page key -> requests in flight
+        self.indicators = {}   # page key -> callback(busy: bool)
+        self.closed = False
+        self.root.after(self.POLL_MS, self._drain)
+
+    def submit(self, key, fn, *args, on_done=None, on_error=None, supersede=True):
+        """Run fn(*args) on a worker. on_done(result) / on_error(exc) run later on the Tk thread.
+        With supersede, a newer request for the same key drops this one (cancelled if not started yet)."""
+        gen = self.latest.get(key, 0)
+        if supersede:
+            gen += 1
+            self.latest[key] = gen
+            old = self.pending.pop(key, None)
+            if old is not None and old.cancel():
+                self._set_busy(key, -1)
+        self._set_busy(key, +1)
+        fut = self.pool.submit(fn, *args)
+        if supersede:
+            self.pending[key] = fut
+        fut.add_done_callback(lambda f: self.results.put((key, gen, supersede, f, on_done, on_error)))
+        return fut
+
+    def forget(self, key):
+        """Drop everything still running for key (e.g. its window was closed)."""
+        self.latest[key] = self.latest.get(key, 0) + 1
+        fut = self.pending.pop(key, None)
+        if fut is not None:
+            fut.cancel()
+        self.busy.pop(key, None)
+        self.indicators.pop(key, None)
+
+    def shutdown(self):
+        self.closed = True
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def _set_busy(self, key, delta):
+        before = self.busy.get(key, 0)
+        after = max(before + delta, 0)
+        self.busy[key] = after
+        cb = self.indicators.get(key)
+        if cb and (before == 0) != (after == 0):
+            cb(after > 0)
+
+    def _drain(self):
+        while True:
+            try:
+                key, gen, supersede, fut, on_done, on_error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if fut.cancelled():
+                continue
+            if key not in self.busy:
+                continue   # page was closed
+            self._set_busy(key, -1)
+            if supersede:
+                if self.pending.get(key) is fut:
+                    del self.pending[key]
+                if gen != self.latest.get(key):
+                    continue   # a newer request replaced this one
+            exc = fut.exception()
+            try:
+                if exc is not None:
+                    if on_error:
+                        on_error(exc)
+                    else:
+                        messagebox.showerror("DB error", str(exc))
+                elif on_done:
+                    on_done(fut.result())
+            except tk.TclError:
+                pass   # the widget went away while the request was running
+        if not self.closed:
+            self.root.after(self.POLL_MS, self._drain)
+
+# results table that renders only the rows on screen: all fetched rows live in a plain list (the row store),
+# the Treeview holds just enough items to fill its height and they are relabelled when the user scrolls.
+# When the view gets close to the end of the store, fetch_more() is called to load the next page.
+class ResultGrid(tk.Frame):
+    def __init__(self, master, **kwargs):
+        super().__init__(master, **kwargs)
+        self.rows = []
+        self.top = 0              # store index of the first row on screen
+        self.selected = None      # store index of the selected row
+        self.fetch_more = None
+        self.loading = False
+        self.empty_text = ""
+        self.live = None          # (page_fn, args, headers) of the rows shown, for live updates
+        self.group_index = None   # column that identifies rows, set once rows were patched
+
+        self.tree = ttk.Treeview(self, show="headings", selectmode="browse")
+        self.vsb = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.xsb = ttk.Scrollbar(self, orient="horizontal", command=self.tree.xview)
+        self.tree.configure(xscrollcommand=self.xsb.set)
+        self.vsb.pack(side="right", fill="y")
+        self.xsb.pack(side="bottom", fill="x")
+        self.tree.pack(side="left", fill="both", expand=True)
+
+        self.tree.bind("<Configure>", lambda e: self._render())
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1, "units", 3))
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-1, "units", 3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(1, "units", 3))
+        self.tree.bind("<Prior>", lambda e: self.scroll(-1, "pages"))
+        self.tree.bind("<Next>", lambda e: self.scroll(1, "pages"))
+        self.tree.bind("<Home>", lambda e: self._move_to(0))
+        self.tree.bind("<End>", lambda e: self._move_to(len(self.rows)))
+
+    def set_columns(self, headers):
+        self.tree["columns"] = list(headers)
+        for h in headers:
+            self.tree.heading(h, text=h)
+            self.tree.column(h, width=max(80, 9 * len(h)), stretch=False)
+
+    def set_rows(self, rows, fetch_more=None, empty_text="No results"):
+        """Replace the row store. fetch_more() is called when the user scrolls near the end."""
+        self.rows = list(rows)
+        self.top = 0
+        self.selected = None
+        self.fetch_more = fetch_more
+        self.loading = False
+        self.empty_text = empty_text
+        self.group_index = None
+        self._fit_columns(self.rows[:50])
+        self._render()
+
+    def append_rows(self, rows, fetch_more=None):
+        if self.group_index is not None:
+            # rows patched in at the end may come again with their page
+            shown = {r[self.group_index] for r in self.rows}
+            rows = [r for r in rows if r[self.group_index] not in shown]
+        self.rows.extend(rows)
+        self.fetch_more = fetch_more
+        self.loading = False
+        self._render()
+
+    def patch_rows(self, group_index, groups, rows):
+        """Replace the rows of the given groups (value of column group_index) by rows, as read again from the
+        database: changed rows are updated where they are, vanished ones removed, new ones added at the end."""
+        fresh = {}
+        for r in rows:
+            fresh.setdefault(r[group_index], []).append(r)
+        groups = set(groups) | set(fresh)
+        selected = self.selected_row()
+        out = []
+        for r in self.rows:
+            g = r[group_index]
+            if g not in groups:
+                out.append(r)
+            elif g in fresh:
+                out.extend(fresh.pop(g))
+        for g_rows in fresh.values():
+            out.extend(g_rows)
+        self.rows = out
+        self.group_index = group_index
+        self.selected = next((i for i, r in enumerate(out) if r is selected), None)
+        if selected is not None and self.selected is None:
+            # the selected row was replaced, keep the selection on its new version
+            self.selected = next((i for i, r in enumerate(out) if r[group_index] == selected[group_index]), None)
+        self.top = max(0, min(self.top, len(out) - self._visible()))
+        self._render()
+
+    def selected_row(self):
+        if self.selected is None or self.selected >= len(self.rows):
+            return None
+        return self.rows[self.selected]
+
+    def scroll(self, n, what="units", step=1):
+        page = self._visible()
+        self._move_to(self.top + n * (page if what == "pages" else step))
+        return "break"
+
+    def _visible(self):
+        row_h = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        return max(1, self.tree.winfo_height() // row_h - 1)   # minus the heading row
+
+    def _fit_columns(self, sample):
+        cols = self.tree["columns"]
+        for i, h in enumerate(cols):
+            longest = max([len(h)] + [len("" if r[i] is None else str(r[i])) for r in sample if i < len(r)])
+            self.tree.column(h, width=min(360, max(80, 8 * longest + 16)))
+
+    def _move_to(self, top):
+        self.top = max(0, min(top, len(self.rows) - self._visible()))
+        self._render()
+
+    def _on_scrollbar(self, action, *args):
+        if action == "moveto":
+            self._move_to(int(float(args[0]) * len(self.rows)))
+        elif action == "scroll":
+            self.scroll(int(args[0]), args[1])
+
+    def _on_select(self, _event):
+        sel = self.tree.selection()
+        if sel and sel[0].isdigit():
+            self.selected = self.top + int(sel[0])
+
+    def _render(self):
+        n = self._visible()
+        window = self.rows[self.top:self.top + n]
+        items = self.tree.get_children()
+        if not self.rows:
+            self.tree.delete(*items)
+            if self.empty_text and self.tree["columns"]:
+                self.tree.insert("", "end", iid="empty", values=(self.empty_text,))
+            self.vsb.set(0, 1)
+            return
+        if "empty" in items:
+            self.tree.delete("empty")
+            items = self.tree.get_children()
+        # reuse the existing items, only add or drop the difference
+        for i, row in enumerate(window):
+            values = ["" if x is None else x for x in row]
+            if i < len(items):
+                self.tree.item(items[i], values=values)
+            else:
+                self.tree.insert("", "end", iid=str(i), values=values)
+        if len(items) > len(window):
+            self.tree.delete(*items[len(window):])
+        if self.selected is not None and self.top <= self.selected < self.top + len(window):
+            self.tree.selection_set(str(self.selected - self.top))
+        else:
+            self.tree.selection_remove(*self.tree.selection())
+        total = len(self.rows)
+        self.vsb.set(self.top / total, min(1.0, (self.top + len(window)) / total))
+        # prefetch the next page before the user reaches the end of what is loaded
+        if self.fetch_more and not self.loading and self.top + 2 * n >= total:
+            self.loading = True
+            self.fetch_more()
 
 # add scroll bar so the contents will not be pushed outside the screen
 class HScrollFrame(tk.Frame):
@@ -43,6 +316,8 @@ import sv_ttk
 #         self.root.mainloop()
 
 class MainInterface:
+    LIVE_POLL_MS = 300   # changes are collected for this long and applied together
+
     def __init__(self, role: str):
         self.role = role  # "super" or "normal"
         self.root = tk.Tk()
@@ -64,6 +339,7 @@ class MainInterface:
             {"text": "Diagnoses", "command": self.open_diagnoses},
             {"text": "Clinics", "command": self.open_clinics},
             {"text": "Departments", "command": self.open_departments},
+            {"text": "Timeline", "command": self.open_timeline},
         ]
 
         row_val = 0
@@ -76,7 +352,19 @@ class MainInterface:
                 col_val = 0
                 row_val += 1
 
+        self.dispatcher = Dispatcher(self.root)
+        # changes saved by anyone arrive on the listener thread, the Tk loop applies them to the open pages
+        self.live_grids = []
+        self.changes = queue.Queue()
+        self.listener = None
+        if LIVE_UPDATES:
+            self.listener = live_updates.Listener(lambda table, keys: self.changes.put((table, keys)))
+            self.listener.start()
+            self.root.after(self.LIVE_POLL_MS, self._apply_changes)
         self.root.mainloop()
+        if self.listener:
+            self.listener.stop()
+        self.dispatcher.shutdown()
 
 
     # utilities 
@@ -88,52 +376,193 @@ class MainInterface:
         win.geometry(f"{width}x{height}")
 
         # --- Scrollable header (top) ---
-        top_wrap = HScrollFrame(win, height=130)   # adjust height if you want more room
+        top_wrap = HScrollFrame(win, height=160)   # adjust height if you want more room
         top_wrap.pack(fill="x", padx=8, pady=6)
         top = top_wrap.inner  # use this as the parent for your grid() controls
 
+        # --- Busy indicator (bottom), shown while a request for this page is running ---
+        status = tk.Frame(win)
+        status.pack(side="bottom", fill="x", padx=8, pady=(0, 6))
+        busy_lbl = tk.Label(status, text="", fg="gray")
+        busy_lbl.pack(side="left")
+        bar = ttk.Progressbar(status, mode="indeterminate", length=120)
+
+        def show_busy(on):
+            if on:
+                busy_lbl.config(text="Working...")
+                bar.pack(side="left", padx=6)
+                bar.start(12)
+            else:
+                bar.stop()
+                bar.pack_forget()
+                busy_lbl.config(text="")
+
+        key = str(win)
+        self.dispatcher.indicators[key] = show_busy
+        # closing the page drops its pending requests
+        win.bind("<Destroy>", lambda e: self.dispatcher.forget(key) if e.widget is win else None)
+
         # --- Results area with BOTH scrollbars ---
         mid = tk.Frame(win)
         mid.pack(fill="both", expand=True, padx=8, pady=6)
 
-        lb = tk.Listbox(mid, font=("Consolas", 10))
-        ysb = tk.Scrollbar(mid, orient="vertical", command=lb.yview)
-        xsb = tk.Scrollbar(mid, orient="horizontal", command=lb.xview)
-
-        # wire the listbox to the scrollbars
-        lb.configure(yscrollcommand=ysb.set, xscrollcommand=xsb.set)
-
-        # layout: vertical bar on right, horizontal bar on bottom, listbox takes the rest
-        ysb.pack(side="right", fill="y")
-        xsb.pack(side="bottom", fill="x")
-        lb.pack(side="left", fill="both", expand=True)
-
-        return win, top, lb
-
-
-
-    def _fill_with_headers(self, lb, headers, rows):
-        lb.delete(0, tk.END)
-        header_line = " | ".join(headers)
-        lb.insert(tk.END, header_line)
-        lb.insert(tk.END, "-" * len(header_line))
-        if not rows:
-            lb.insert(tk.END, "No results")
+        table = ResultGrid(mid)
+        table.pack(fill="both", expand=True)
+
+        return win, top, table
+
+
+
+    def _fill_with_headers(self, table, headers, rows, fetch_more=None):
+        table.set_columns(headers)
+        table.set_rows(rows, fetch_more)
+
+    def _page_key(self, widget):
+        return str(widget.winfo_toplevel())
+
+    def _load(self, table, headers, page_fn, *args):
+        """Show the first page of backend page_fn(*args) and fetch the next pages as the user scrolls.
+        Runs on a worker, a newer load on the same page wins."""
+        key = self._page_key(table)
+        live = (page_fn, args, headers)
+
+        def fetch(after, first):
+            self.dispatcher.submit(key, partial(page_fn, *args, after=after),
+                                   on_done=lambda res: show(res, first))
+
+        def show(res, first):
+            rows, cursor = res
+            more = (lambda: fetch(cursor, False)) if cursor else None
+            if first:
+                self._fill_with_headers(table, headers, rows, more)
+                table.live = live
+                if table not in self.live_grids:
+                    self.live_grids.append(table)
+            elif table.live is live:
+                table.append_rows(rows, more)
+        fetch(None, True)
+
+    def _add(self, fn, table, refresh_fn, headers):
+        # perform insert/delete/update on a worker (fn must not touch Tk). The change notification patches the
+        # rows on screen; without live updates, or when nothing is shown yet, re-query and reprint the data
+        def done(_):
+            if table.live is None or self.listener is None or not self.listener.connected:
+                self._load(table, headers, refresh_fn)
+        self.dispatcher.submit(self._page_key(table), fn, supersede=False, on_done=done)
+
+    def _apply_changes(self):
+        changes = {}   # table -> set of keys, None: reload
+        while True:
+            try:
+                t, keys = self.changes.get_nowait()
+            except queue.Empty:
+                break
+            if t is None:
+                changes = None   # notifications were lost, reload everything
+            elif changes is not None:
+                if keys is None or changes.get(t, set()) is None:
+                    changes[t] = None
+                else:
+                    changes.setdefault(t, set()).update(keys)
+        if changes != {}:
+            self.live_grids = [g for g in self.live_grids if g.winfo_exists()]
+            for grid in self.live_grids:
+                self._apply_to_grid(grid, changes)
+        self.root.after(self.LIVE_POLL_MS, self._apply_changes)
+
+    def _apply_to_grid(self, grid, changes):
+        page_fn, args, headers = grid.live
+        spec = backend.live_spec(page_fn)
+        if spec is None:
+            return   # e.g. text search results, their rank depends on the whole result
+        group_index, deps = spec
+        if changes is None or any(changes.get(t, ()) is None for t in deps):
+            self._load(grid, headers, page_fn, *args)
             return
-        for r in rows:
-            lb.insert(tk.END, " | ".join("" if x is None else str(x) for x in r))
-
-    def _add(self, fn, lb, refresh_fn, headers):
+        touched = {t: sorted(changes[t]) for t in deps if t in changes}
+        if not touched:
+            return
+        # groups on screen that hold a changed key (they may no longer match, the server cannot tell)
+        groups = {r[group_index] for r in grid.rows
+                  for t, keys in touched.items() for i in deps[t] if r[i] in changes[t]}
+        live = grid.live
+
+        def patch(rows):
+            if grid.live is live:   # not if the page was searched again meanwhile
+                grid.patch_rows(group_index, groups, rows)
+        self.dispatcher.submit(self._page_key(grid), backend.live_rows, page_fn, args, touched, sorted(groups),
+                               supersede=False, on_done=patch)
+
+    def _export_csv(self, table, headers, iter_fn, *args):
+        """Stream every row matching the filters (backend *_iter) into a CSV file on a worker."""
+        win = table.winfo_toplevel()
+        path = filedialog.asksaveasfilename(parent=win, title="Export CSV", defaultextension=".csv",
+                                            filetypes=[("CSV", "*.csv"), ("All", "*.*")])
+        if not path:
+            return
+        self.dispatcher.submit(self._page_key(table), lambda: backend.export_csv(path, headers, iter_fn(*args)),
+                               supersede=False,
+                               on_done=lambda n: messagebox.showinfo("Export", f"{n} rows written to {path}", parent=win))
+
+    # attached files: take the OID from the entry, or from the selected row (file_oid is the last column)
+    def _selected_oid(self, table, oid_var):
+        text = oid_var.get().strip()
+        if not text:
+            row = table.selected_row()
+            if row and row[-1] is not None:
+                text = str(row[-1])
         try:
-            fn() # perform insert/delete/update
-            # 
-            self._fill_with_headers(lb, headers, refresh_fn()) #re-query and reprint the data
-        except Exception as e:
-            messagebox.showerror("DB error", str(e))
+            return int(text)
+        except ValueError:
+            return None
+
+    def _export_file(self, win, table, oid_var, open_after: bool):
+        oid = self._selected_oid(table, oid_var)
+        if oid is None:
+            messagebox.showerror("File", "Enter a file_oid or select a row that has one.", parent=win)
+            return
+        dest = None
+        if not open_after:
+            dest = filedialog.asksaveasfilename(parent=win, title="Export file", initialfile=f"file_{oid}")
+            if not dest:
+                return
+
+        def work():  # runs on a worker so a big download does not freeze the window
+            path = lo_cache.fetch(oid, suffix_for=_guess_ext)   # no download if it was opened before
+            if dest:
+                shutil.copyfile(path, dest)
+                return dest
+            return path
+
+        def done(path):
+            if open_after:
+                _open_with_default_app(path)
+            else:
+                messagebox.showinfo("Export", f"Saved to {path}", parent=win)
+        self.dispatcher.submit(self._page_key(table), work, supersede=False, on_done=done)
+
+    def _file_row(self, win, top, table):
+        file_oid = tk.StringVar()
+        tk.Label(top, text="file_oid").grid(row=5, column=0, padx=4)
+        tk.Entry(top, textvariable=file_oid, width=12).grid(row=5, column=1, padx=4)
+        tk.Button(top, text="Open file", command=lambda: self._export_file(win, table, file_oid, True)).grid(row=5, column=2, padx=6)
+        tk.Button(top, text="Export file...", command=lambda: self._export_file(win, table, file_oid, False)).grid(row=5, column=3, padx=6)
+
+    # full-text search in the comments and attached files (backend.*_text_page), best matches first
+    def _text_search_row(self, top, table, headers, page_fn):
+        q = tk.StringVar(); files = tk.BooleanVar(value=True)
+        text_headers = ["rank", "snippet"] + headers
+        run = lambda *_: self._load(table, text_headers, partial(page_fn, files=files.get()), q.get())
+        tk.Label(top, text="Search comments").grid(row=5, column=5, padx=4)
+        e = tk.Entry(top, textvariable=q, width=30)
+        e.grid(row=5, column=6, columnspan=3, padx=4, sticky="we")
+        e.bind("<Return>", run)
+        tk.Checkbutton(top, text="and files", variable=files).grid(row=5, column=9, padx=4)
+        tk.Button(top, text="Find text", command=run).grid(row=5, column=10, padx=6)
 
     # Patients
     def open_patients(self):
-        win, top, lb = self._make_page("Patients")
+        win, top, table = self._make_page("Patients")
 
         p_name = tk.StringVar(); p_num = tk.StringVar()
         d_name = tk.StringVar(); d_num = tk.StringVar()
@@ -154,14 +583,19 @@ class MainInterface:
 
         tk.Button(
             top, text="Search",
-            command=lambda: self._fill_with_headers(
-                lb, headers, backend.patient_search(p_name.get(), p_num.get(), d_name.get(), d_num.get())
+            command=lambda: self._load(
+                table, headers, backend.patient_page, p_name.get(), p_num.get(), d_name.get(), d_num.get()
             )
         ).grid(row=0, column=8, padx=6)
         tk.Button(
             top, text="View All",
-            command=lambda: self._fill_with_headers(lb, headers, backend.patient_view())
+            command=lambda: self._load(table, headers, backend.patient_page)
         ).grid(row=0, column=9, padx=6)
+        # history of the selected patient (or the personnumer typed above)
+        tk.Button(
+            top, text="Timeline",
+            command=lambda: self.open_timeline((table.selected_row() or [p_num.get()])[0])
+        ).grid(row=0, column=10, padx=6)
 
         if self.role == "super":
             # Add 
@@ -176,8 +610,8 @@ class MainInterface:
             tk.Button(
                 top, text="Add",
                 command=lambda: self._add(
-                    lambda: backend.patient_insert(new_pn.get(), new_name.get(), new_doc.get()),
-                    lb, backend.patient_view, headers
+                    partial(backend.patient_insert, new_pn.get(), new_name.get(), new_doc.get()),
+                    table, backend.patient_page, headers
                 )
             ).grid(row=2, column=6, padx=6)
 
@@ -187,7 +621,7 @@ class MainInterface:
             tk.Entry(top, textvariable=del_pid, width=18).grid(row=3, column=1, padx=4)
             tk.Button(
                 top, text="Delete",
-                command=lambda: self._add(lambda: backend.patient_delete(del_pid.get()), lb, backend.patient_view, headers)
+                command=lambda: self._add(partial(backend.patient_delete, del_pid.get()), table, backend.patient_page, headers)
             ).grid(row=3, column=2, padx=6)
 
             # Update 
@@ -201,16 +635,16 @@ class MainInterface:
             tk.Button(
                 top, text="Update",
                 command=lambda: self._add(
-                    lambda: backend.patient_update(up_pid.get(), up_docpn.get(), up_pname.get()),
-                    lb, backend.patient_view, headers
+                    partial(backend.patient_update, up_pid.get(), up_docpn.get(), up_pname.get()),
+                    table, backend.patient_page, headers
                 )
             ).grid(row=4, column=6, padx=6)
 
-        self._fill_with_headers(lb, headers, [])
+        self._fill_with_headers(table, headers, [])
 
     # Doctors 
     def open_doctors(self):
-        win, top, lb = self._make_page("Doctors")
+        win, top, table = self._make_page("Doctors")
 
         d_name = tk.StringVar(); d_num = tk.StringVar()
         p_name = tk.StringVar(); p_num = tk.StringVar()
@@ -231,14 +665,14 @@ class MainInterface:
 
         tk.Button(
             top, text="Search",
-            command=lambda: self._fill_with_headers(
-                lb, headers,
-                backend.doctor_search(d_name.get(), d_num.get(), p_name.get(), p_num.get())
+            command=lambda: self._load(
+                table, headers,
+                backend.doctor_page, d_name.get(), d_num.get(), p_name.get(), p_num.get()
                 )
         ).grid(row=0, column=8, padx=6)
         tk.Button(
             top, text="View All",
-            command=lambda: self._fill_with_headers(lb, headers, backend.doctor_view())
+            command=lambda: self._load(table, headers, backend.doctor_page)
         ).grid(row=0, column=9, padx=6)
 
         if self.role == "super":
@@ -254,8 +688,8 @@ class MainInterface:
             tk.Button(
                 top, text="Add",
                 command=lambda: self._add(
-                    lambda: backend.doctor_insert(nd_num.get(), nd_name.get(), ndept.get()),
-                    lb, backend.doctor_view, headers
+                    partial(backend.doctor_insert, nd_num.get(), nd_name.get(), ndept.get()),
+                    table, backend.doctor_page, headers
                 )
             ).grid(row=2, column=6, padx=6)
 
@@ -265,7 +699,7 @@ class MainInterface:
             tk.Entry(top, textvariable=del_did, width=18).grid(row=3, column=1, padx=4)
             tk.Button(
                 top, text="Delete",
-                command=lambda: self._add(lambda: backend.doctor_delete(del_did.get()), lb, backend.doctor_view, headers)
+                command=lambda: self._add(partial(backend.doctor_delete, del_did.get()), table, backend.doctor_page, headers)
             ).grid(row=3, column=2, padx=6)
 
             # Update
@@ -279,16 +713,16 @@ class MainInterface:
             tk.Button(
                 top, text="Update",
                 command=lambda: self._add(
-                    lambda: backend.doctor_update(up_did.get(), up_dept.get(), up_dname.get()),
-                    lb, backend.doctor_view, headers
+                    partial(backend.doctor_update, up_did.get(), up_dept.get(), up_dname.get()),
+                    table, backend.doctor_page, headers
                 )
             ).grid(row=4, column=6, padx=6)
 
-        self._fill_with_headers(lb, headers, [])
+        self._fill_with_headers(table, headers, [])
 
     # Appointments 
     def open_appointments(self):
-        win, top, lb = self._make_page("Appointments")
+        win, top, table = self._make_page("Appointments")
 
         ap_id = tk.StringVar(); y = tk.StringVar(); m = tk.StringVar(); d = tk.StringVar()
         p_name = tk.StringVar(); p_num = tk.StringVar()
@@ -313,27 +747,64 @@ class MainInterface:
 
         headers = [
             "appoint_id","year","month","day","location",
-            "patient_personnumer","patient_name","doctor_personnumer","doctor_name"
+            "patient_personnumer","patient_name","doctor_personnumer","doctor_name","start","end"
         ]
 
         tk.Button(
             top, text="Search",
-            command=lambda: self._fill_with_headers(
-                lb, headers,
-                backend.appointment_search(ap_id.get(), y.get(), m.get(), d.get(),
-                                           p_name.get(), p_num.get(), doc_name.get(), doc_num.get())
+            command=lambda: self._load(
+                table, headers,
+                backend.appointment_page, ap_id.get(), y.get(), m.get(), d.get(),
+                p_name.get(), p_num.get(), doc_name.get(), doc_num.get()
             )
         ).grid(row=0, column=16, padx=6)
         tk.Button(
             top, text="View All",
-            command=lambda: self._fill_with_headers(lb, headers, backend.appointment_view())
+            command=lambda: self._load(table, headers, backend.appointment_page)
         ).grid(row=0, column=17, padx=6)
+        tk.Button(
+            top, text="Export CSV",
+            command=lambda: self._export_csv(
+                table, headers, backend.appointment_iter, ap_id.get(), y.get(), m.get(), d.get(),
+                p_name.get(), p_num.get(), doc_name.get(), doc_num.get()
+            )
+        ).grid(row=0, column=18, padx=6)
+        tk.Button(top, text="Calendar", command=self.open_calendar).grid(row=0, column=19, padx=6)
 
         if self.role == "super":
+            # ask the server for overlapping appointments while the user types (debounced),
+            # the Add/Update row shows the result next to its button
+            def watch_conflicts(row, aid, yv, mv, dv, docv, startv, endv, updating):
+                lbl = tk.Label(top, text="", fg="red")
+                lbl.grid(row=row, column=19, padx=4, sticky="w")
+                timer = {"id": None}
+                key = f"{self._page_key(table)}:conflict{row}"
+                win.bind("<Destroy>", lambda e: self.dispatcher.forget(key) if e.widget is win else None, add="+")
+
+                def check():
+                    timer["id"] = None
+                    args = (docv.get(), yv.get(), mv.get(), dv.get(), startv.get(), endv.get())
+                    self.dispatcher.submit(
+                        key,
+                        partial(backend.appointment_conflicts, *args, appoint_id=aid.get() if updating else None),
+                        on_done=show, on_error=lambda exc: lbl.config(text=str(exc)))
+
+                def show(rows):
+                    lbl.config(text="Conflicts with " + ", ".join(
+                        f"{r[0]} {r[1]:%H:%M}-{r[2]:%H:%M}" for r in rows) if rows else "")
+
+                def changed(*_):
+                    if timer["id"] is not None:
+                        top.after_cancel(timer["id"])
+                    timer["id"] = top.after(300, check)
+
+                for v in (aid, yv, mv, dv, docv, startv, endv):
+                    v.trace_add("write", changed)
+
             # Add
-            sep = tk.Frame(top, height=2, bd=1, relief="sunken"); sep.grid(row=1, column=0, columnspan=18, sticky="we", pady=6)
+            sep = tk.Frame(top, height=2, bd=1, relief="sunken"); sep.grid(row=1, column=0, columnspan=20, sticky="we", pady=6)
             na_id = tk.StringVar(); ny = tk.StringVar(); nm = tk.StringVar(); nd = tk.StringVar()
-            nloc = tk.StringVar(); np = tk.StringVar(); ndoc = tk.StringVar()
+            nloc = tk.StringVar(); np = tk.StringVar(); ndoc = tk.StringVar(); nstart = tk.StringVar(); nend = tk.StringVar()
             tk.Label(top, text="Add: id").grid(row=2, column=0, padx=4)
             tk.Entry(top, textvariable=na_id, width=12).grid(row=2, column=1, padx=4)
             tk.Label(top, text="year").grid(row=2, column=2, padx=4)
@@ -348,13 +819,19 @@ class MainInterface:
             tk.Entry(top, textvariable=np, width=16).grid(row=2, column=11, padx=4)
             tk.Label(top, text="doctor personnumer").grid(row=2, column=12, padx=4)
             tk.Entry(top, textvariable=ndoc, width=16).grid(row=2, column=13, padx=4)
+            tk.Label(top, text="start HH:MM").grid(row=2, column=14, padx=4)
+            tk.Entry(top, textvariable=nstart, width=6).grid(row=2, column=15, padx=4)
+            tk.Label(top, text="end").grid(row=2, column=16, padx=4)
+            tk.Entry(top, textvariable=nend, width=6).grid(row=2, column=17, padx=4)
             tk.Button(
                 top, text="Add",
                 command=lambda: self._add(
-                    lambda: backend.appointment_insert(na_id.get(), ny.get(), nm.get(), nd.get(), nloc.get(), np.get(), ndoc.get()),
-                    lb, backend.appointment_view, headers
+                    partial(backend.appointment_insert, na_id.get(), ny.get(), nm.get(), nd.get(), nloc.get(), np.get(), ndoc.get(),
+                            nstart.get(), nend.get()),
+                    table, backend.appointment_page, headers
                 )
-            ).grid(row=2, column=14, padx=6)
+            ).grid(row=2, column=18, padx=6)
+            watch_conflicts(2, na_id, ny, nm, nd, ndoc, nstart, nend, updating=False)
 
             # Delete
             del_aid = tk.StringVar()
@@ -362,12 +839,12 @@ class MainInterface:
             tk.Entry(top, textvariable=del_aid, width=12).grid(row=3, column=1, padx=4)
             tk.Button(
                 top, text="Delete",
-                command=lambda: self._add(lambda: backend.appointment_delete(del_aid.get()), lb, backend.appointment_view, headers)
+                command=lambda: self._add(partial(backend.appointment_delete, del_aid.get()), table, backend.appointment_page, headers)
             ).grid(row=3, column=2, padx=6)
 
             # Update
             up_aid = tk.StringVar(); uy = tk.StringVar(); um = tk.StringVar(); ud = tk.StringVar()
-            uloc = tk.StringVar(); upn = tk.StringVar(); udn = tk.StringVar()
+            uloc = tk.StringVar(); upn = tk.StringVar(); udn = tk.StringVar(); ustart = tk.StringVar(); uend = tk.StringVar()
             tk.Label(top, text="Update appoint_id").grid(row=4, column=0, padx=4)
             tk.Entry(top, textvariable=up_aid, width=12).grid(row=4, column=1, padx=4)
             tk.Label(top, text="year").grid(row=4, column=2, padx=4)
@@ -382,20 +859,197 @@ class MainInterface:
             tk.Entry(top, textvariable=upn, width=16).grid(row=4, column=11, padx=4)
             tk.Label(top, text="doctor personnumer").grid(row=4, column=12, padx=4)
             tk.Entry(top, textvariable=udn, width=16).grid(row=4, column=13, padx=4)
+            tk.Label(top, text="start HH:MM").grid(row=4, column=14, padx=4)
+            tk.Entry(top, textvariable=ustart, width=6).grid(row=4, column=15, padx=4)
+            tk.Label(top, text="end").grid(row=4, column=16, padx=4)
+            tk.Entry(top, textvariable=uend, width=6).grid(row=4, column=17, padx=4)
             tk.Button(
                 top, text="Update",
                 command=lambda: self._add(
-                    lambda: backend.appointment_update(up_aid.get(), uy.get(), um.get(), ud.get(),
-                                                       uloc.get(), upn.get(), udn.get()),
-                    lb, backend.appointment_view, headers
+                    partial(backend.appointment_update, up_aid.get(), uy.get(), um.get(), ud.get(),
+                            uloc.get(), upn.get(), udn.get(), ustart.get(), uend.get()),
+                    table, backend.appointment_page, headers
                 )
-            ).grid(row=4, column=14, padx=6)
+            ).grid(row=4, column=18, padx=6)
+            watch_conflicts(4, up_aid, uy, um, ud, udn, ustart, uend, updating=True)
 
-        self._fill_with_headers(lb, headers, [])
+        self._fill_with_headers(table, headers, [])
+
+    # Appointment calendar: one day or one week, only the dates on screen are loaded
+    def open_calendar(self):
+        win = tk.Toplevel(self.root)
+        win.title("Appointment calendar")
+        win.geometry("1100x560")
+        key = str(win)
+        win.bind("<Destroy>", lambda e: self.dispatcher.forget(key) if e.widget is win else None)
+
+        bar = tk.Frame(win)
+        bar.pack(fill="x", padx=8, pady=6)
+        body = tk.Frame(win)
+        body.pack(fill="both", expand=True, padx=8, pady=6)
+
+        mode = tk.StringVar(value="week")
+        doc_num = tk.StringVar(); dept = tk.StringVar()
+        shown = {"day": date.today()}
+
+        def window():
+            d0 = shown["day"]
+            if mode.get() == "week":
+                d0 -= timedelta(days=d0.weekday())
+                return d0, d0 + timedelta(days=6)
+            return d0, d0
+
+        def move(days):
+            step = 7 if mode.get() == "week" else 1
+            shown["day"] = date.today() if days == 0 else shown["day"] + timedelta(days=days * step)
+            load()
+
+        def load():
+            d0, d1 = window()
+            title.config(text=f"{d0:%Y-%m-%d}" if d0 == d1 else f"{d0:%Y-%m-%d} .. {d1:%Y-%m-%d}")
+            doctor, department = doc_num.get().strip(), dept.get().strip()
+
+            def work():
+                rows = backend.appointment_between(d0, d1, doctor_personnumer=doctor, dept_id=department,
+                                                   exact_only=True)
+                free = backend.appointment_free_slots(department, d0, d1) if department else None
+                return rows, free
+            self.dispatcher.submit(key, work, on_done=lambda res: show(d0, d1, *res))
+
+        def show(d0, d1, rows, free):
+            for w in body.winfo_children():
+                w.destroy()
+            by_day, free_by_day = {}, {}
+            for r in rows:
+                by_day.setdefault(date(r[1], r[2], r[3]), []).append(r)
+            for r in free or []:
+                free_by_day[r[2]] = free_by_day.get(r[2], 0) + r[4]
+            days = [d0 + timedelta(days=i) for i in range((d1 - d0).days + 1)]
+            for col, day in enumerate(days):
+                head = f"{day:%a %Y-%m-%d}"
+                if free is not None and day.isoweekday() < 6:
+                    head += f"\n{free_by_day.get(day, 0)} free"
+                tk.Label(body, text=head, font=("", 10, "bold")).grid(row=0, column=col, sticky="we")
+                lb = tk.Listbox(body, activestyle="none")
+                lb.grid(row=1, column=col, sticky="nsew", padx=2)
+                for r in by_day.get(day, []):
+                    when = f"{r[9]:%H:%M}-{r[10]:%H:%M}" if r[9] and r[10] else f"{r[9]:%H:%M}" if r[9] else ""
+                    lb.insert("end", "  ".join(str(v) for v in (when, r[0], r[6] or r[5], r[8] or r[7], r[4]) if v))
+                body.columnconfigure(col, weight=1, uniform="day")
+            body.rowconfigure(1, weight=1)
+
+        tk.Button(bar, text="<", command=lambda: move(-1)).pack(side="left")
+        tk.Button(bar, text="Today", command=lambda: move(0)).pack(side="left", padx=4)
+        tk.Button(bar, text=">", command=lambda: move(1)).pack(side="left")
+        title = tk.Label(bar, font=("", 11, "bold"))
+        title.pack(side="left", padx=12)
+        tk.Radiobutton(bar, text="Day", variable=mode, value="day", command=load).pack(side="left")
+        tk.Radiobutton(bar, text="Week", variable=mode, value="week", command=load).pack(side="left")
+        tk.Label(bar, text="Doctor personnumer").pack(side="left", padx=(12, 4))
+        tk.Entry(bar, textvariable=doc_num, width=14).pack(side="left")
+        tk.Label(bar, text="Department (free slots)").pack(side="left", padx=(12, 4))
+        tk.Entry(bar, textvariable=dept, width=10).pack(side="left")
+        tk.Button(bar, text="Show", command=load).pack(side="left", padx=6)
+        load()
+
+    # Patient timeline: one backend.patient_timeline call, the tree is filled a few appointments per tick
+    # so a long history does not freeze the window
+    TIMELINE_CHUNK = 25
+
+    def open_timeline(self, personnumer=""):
+        win = tk.Toplevel(self.root)
+        win.title("Patient timeline")
+        win.geometry("1000x640")
+        key = str(win)
+        win.bind("<Destroy>", lambda e: self.dispatcher.forget(key) if e.widget is win else None)
+
+        bar = tk.Frame(win)
+        bar.pack(fill="x", padx=8, pady=6)
+        pnum = tk.StringVar(value=personnumer)
+        tk.Label(bar, text="Patient personnumer").pack(side="left")
+        e = tk.Entry(bar, textvariable=pnum, width=18)
+        e.pack(side="left", padx=4)
+        head = tk.Label(bar, font=("", 11, "bold"))
+
+        body = tk.Frame(win)
+        body.pack(fill="both", expand=True, padx=8, pady=6)
+        tree = ttk.Treeview(body, columns=("date", "details", "file"))
+        tree.heading("#0", text="id"); tree.column("#0", width=200)
+        tree.heading("date", text="date"); tree.column("date", width=150, stretch=False)
+        tree.heading("details", text="details"); tree.column("details", width=450)
+        tree.heading("file", text="file"); tree.column("file", width=160, stretch=False)
+        sb = ttk.Scrollbar(body, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=sb.set)
+        tree.pack(side="left", fill="both", expand=True)
+        sb.pack(side="right", fill="y")
+        render = {"gen": 0}
+        files = {}   # tree item -> oid
+
+        def when(item):
+            d, p = item["date"], item["date_precision"]
+            if d is None:
+                return "no date"
+            return d[:4] if p == "year" else d[:7] if p == "month" else d
+
+        def file_text(f):
+            if not f:
+                return ""
+            return f"{f['oid']} ({(f['size'] or 0) / 1024:.0f} KiB{', ' + f['text_kind'] if f['text_kind'] else ''})"
+
+        def add(parent, iid, item, details, kind):
+            node = tree.insert(parent, "end", text=f"{kind} {iid}", open=True,
+                               values=(when(item), details, file_text(item.get("file"))))
+            if item.get("file"):
+                files[node] = item["file"]["oid"]
+            return node
+
+        def show(t):
+            tree.delete(*tree.get_children())
+            files.clear()
+            if t is None:
+                head.config(text="No such patient")
+                return
+            head.config(text=f"{t['name']} ({t['personnumer']}), doctor {t['doctor_name'] or '-'}  "
+                             f"{len(t['appointments'])} appointments")
+            render["gen"] += 1
+            gen, todo = render["gen"], list(t["appointments"])
+
+            def step():
+                if gen != render["gen"] or not tree.winfo_exists():
+                    return   # a newer load started
+                for a in todo[:self.TIMELINE_CHUNK]:
+                    times = f"{a['start'][:5]}-{a['end'][:5]} " if a["start"] and a["end"] else ""
+                    an = add("", a["appoint_id"], a, f"{times}{a['location'] or ''}  {a['doctor_name'] or ''}".strip(),
+                             "Appointment")
+                    for o in a["observations"]:
+                        on = add(an, o["obser_id"], o, o["comment"] or "", "Observation")
+                        for g in o["diagnoses"]:
+                            add(on, g["diagn_id"], g, g["comment"] or "", "Diagnosis")
+                del todo[:self.TIMELINE_CHUNK]
+                if todo:
+                    win.after(1, step)
+            step()
+
+        def load(*_):
+            self.dispatcher.submit(key, backend.patient_timeline, pnum.get(), on_done=show)
+
+        def open_file(_):
+            oid = files.get(tree.focus())
+            if oid is not None:
+                self.dispatcher.submit(key, partial(lo_cache.fetch, oid, suffix_for=_guess_ext),
+                                       supersede=False, on_done=_open_with_default_app)
+
+        e.bind("<Return>", load)
+        tk.Button(bar, text="Load", command=load).pack(side="left", padx=6)
+        head.pack(side="left", padx=12)
+        tk.Label(bar, text="double-click a file row to open it", fg="gray").pack(side="right")
+        tree.bind("<Double-1>", open_file)
+        if personnumer:
+            load()
 
     # Observations
     def open_observations(self):
-        win, top, lb = self._make_page("Observations")
+        win, top, table = self._make_page("Observations")
 
         obs_id = tk.StringVar(); y = tk.StringVar(); m = tk.StringVar(); d = tk.StringVar(); ap_id = tk.StringVar()
         p_name = tk.StringVar(); p_num = tk.StringVar()
@@ -431,16 +1085,23 @@ class MainInterface:
 
         tk.Button(
             top, text="Search",
-            command=lambda: self._fill_with_headers(
-                lb, headers,
-                backend.observation_search(obs_id.get(), y.get(), m.get(), d.get(), ap_id.get(),
-                                           p_name.get(), p_num.get(), doc_name.get(), doc_num.get())
+            command=lambda: self._load(
+                table, headers,
+                backend.observation_page, obs_id.get(), y.get(), m.get(), d.get(), ap_id.get(),
+                p_name.get(), p_num.get(), doc_name.get(), doc_num.get()
             )
         ).grid(row=0, column=18, padx=6)
         tk.Button(
             top, text="View All",
-            command=lambda: self._fill_with_headers(lb, headers, backend.observation_view())
+            command=lambda: self._load(table, headers, backend.observation_page)
         ).grid(row=0, column=19, padx=6)
+        tk.Button(
+            top, text="Export CSV",
+            command=lambda: self._export_csv(
+                table, headers, backend.observation_iter, obs_id.get(), y.get(), m.get(), d.get(), ap_id.get(),
+                p_name.get(), p_num.get(), doc_name.get(), doc_num.get()
+            )
+        ).grid(row=0, column=20, padx=6)
 
         if self.role == "super":
             sep = tk.Frame(top, height=2, bd=1, relief="sunken"); sep.grid(row=1, column=0, columnspan=20, sticky="we", pady=6)
@@ -471,17 +1132,19 @@ class MainInterface:
             tk.Label(top, textvariable=file_path, fg="gray").grid(row=2, column=14, columnspan=4, sticky="w")
 
             def do_add_obs():
+                # read the form here on the Tk thread, the returned function runs on a worker
                 comment_txt = (comment_text.get().strip() or None)
-                file_oid = None
                 fp = file_path.get().strip()
-                if fp:
-                    file_oid = backend.lo_save_file(fp)   # create LO and get OID
-                backend.observation_insert(no_id.get(), ny.get(), nm.get(), nd.get(),
-                                        (napid.get() or None),
-                                        comment_txt, file_oid)
+                args = (no_id.get(), ny.get(), nm.get(), nd.get(), (napid.get() or None))
+                def work():
+                    # file and row are saved in one transaction
+                    backend.observation_insert_with_file(*args, comment_txt, fp or None)
+                    if fp:
+                        lo_text.index_soon()   # make the file searchable in the background
+                return work
             tk.Button(
                 top, text="Add",
-                command=lambda: self._add(do_add_obs, lb, backend.observation_view, headers)
+                command=lambda: self._add(do_add_obs(), table, backend.observation_page, headers)
             ).grid(row=2, column=18, padx=6)
 
             # Delete
@@ -490,7 +1153,7 @@ class MainInterface:
             tk.Entry(top, textvariable=del_oid, width=12).grid(row=3, column=1, padx=4)
             tk.Button(
                 top, text="Delete",
-                command=lambda: self._add(lambda: backend.observation_delete(del_oid.get()), lb, backend.observation_view, headers)
+                command=lambda: self._add(partial(backend.observation_delete, del_oid.get()), table, backend.observation_page, headers)
             ).grid(row=3, column=2, padx=6)
 
             # Update
@@ -520,24 +1183,28 @@ class MainInterface:
 
             def do_update_obs():
                 new_comment_txt = (u_comment_text.get().strip() if u_comment_text.get().strip() != "" else None)
-                new_file_oid = None
                 fp = u_file_path.get().strip()
-                if fp:
-                    new_file_oid = backend.lo_save_file(fp)
-                backend.observation_update(uo_id.get(), uy.get(), um.get(), ud.get(),
-                                        (uapid.get() or None),
-                                        new_comment_txt, new_file_oid)
+                args = (uo_id.get(), uy.get(), um.get(), ud.get(), (uapid.get() or None))
+                def work():
+                    backend.observation_update_with_file(*args, new_comment_txt, fp or None)
+                    if fp:
+                        lo_text.index_soon()   # make the file searchable in the background
+                return work
 
             tk.Button(
                 top, text="Update",
-                command=lambda: self._add(do_update_obs, lb, backend.observation_view, headers)
+                command=lambda: self._add(do_update_obs(), table, backend.observation_page, headers)
             ).grid(row=4, column=18, padx=6)
 
-        self._fill_with_headers(lb, headers, [])
+        # Open / export the attached file (any role)
+        self._file_row(win, top, table)
+        self._text_search_row(top, table, headers, backend.observation_text_page)
+
+        self._fill_with_headers(table, headers, [])
 
     # Diagnoses
     def open_diagnoses(self):
-        win, top, lb = self._make_page("Diagnoses")
+        win, top, table = self._make_page("Diagnoses")
 
         dg_id = tk.StringVar(); y = tk.StringVar(); m = tk.StringVar(); d = tk.StringVar()
         obs_id = tk.StringVar(); ap_id = tk.StringVar()
@@ -575,18 +1242,25 @@ class MainInterface:
 
         tk.Button(
             top, text="Search",
-            command=lambda: self._fill_with_headers(
-                lb, headers,
-                backend.diagnosis_search(dg_id.get(), y.get(), m.get(), d.get(),
-                                         obs_id.get(), ap_id.get(),
-                                         p_name.get(), p_num.get(),
-                                         doc_name.get(), doc_num.get())
+            command=lambda: self._load(
+                table, headers,
+                backend.diagnosis_page, dg_id.get(), y.get(), m.get(), d.get(),
+                obs_id.get(), ap_id.get(),
+                p_name.get(), p_num.get(),
+                doc_name.get(), doc_num.get()
             )
         ).grid(row=0, column=20, padx=6)
         tk.Button(
             top, text="View All",
-            command=lambda: self._fill_with_headers(lb, headers, backend.diagnosis_view())
+            command=lambda: self._load(table, headers, backend.diagnosis_page)
         ).grid(row=0, column=21, padx=6)
+        tk.Button(
+            top, text="Export CSV",
+            command=lambda: self._export_csv(
+                table, headers, backend.diagnosis_iter, dg_id.get(), y.get(), m.get(), d.get(),
+                obs_id.get(), ap_id.get(), p_name.get(), p_num.get(), doc_name.get(), doc_num.get()
+            )
+        ).grid(row=0, column=22, padx=6)
 
         if self.role == "super":
             sep = tk.Frame(top, height=2, bd=1, relief="sunken"); sep.grid(row=1, column=0, columnspan=22, sticky="we", pady=6)
@@ -618,16 +1292,16 @@ class MainInterface:
 
             def do_add_diagn():
                 comment_txt = (comment_text.get().strip() or None)
-                file_oid = None
                 fp = file_path.get().strip()
-                if fp:
-                    file_oid = backend.lo_save_file(fp)
-                backend.diagnosis_insert(ndg_id.get(), ny.get(), nm.get(), nd.get(),
-                                        (nobs_id.get() or None),
-                                        comment_txt, file_oid)
+                args = (ndg_id.get(), ny.get(), nm.get(), nd.get(), (nobs_id.get() or None))
+                def work():
+                    backend.diagnosis_insert_with_file(*args, comment_txt, fp or None)
+                    if fp:
+                        lo_text.index_soon()   # make the file searchable in the background
+                return work
             tk.Button(
                 top, text="Add",
-                command=lambda: self._add(do_add_diagn, lb, backend.diagnosis_view, headers)
+                command=lambda: self._add(do_add_diagn(), table, backend.diagnosis_page, headers)
             ).grid(row=2, column=20, padx=6)
 
             # Delete
@@ -636,7 +1310,7 @@ class MainInterface:
             tk.Entry(top, textvariable=del_dgid, width=12).grid(row=3, column=1, padx=4)
             tk.Button(
                 top, text="Delete",
-                command=lambda: self._add(lambda: backend.diagnosis_delete(del_dgid.get()), lb, backend.diagnosis_view, headers)
+                command=lambda: self._add(partial(backend.diagnosis_delete, del_dgid.get()), table, backend.diagnosis_page, headers)
             ).grid(row=3, column=2, padx=6)
 
             # Update
@@ -666,24 +1340,28 @@ class MainInterface:
 
             def do_update_diagn():
                 new_comment_txt = (u_comment_text.get().strip() if u_comment_text.get().strip() != "" else None)
-                new_file_oid = None
                 fp = u_file_path.get().strip()
-                if fp:
-                    new_file_oid = backend.lo_save_file(fp)
-                backend.diagnosis_update(udg_id.get(), uy.get(), um.get(), ud.get(),
-                                        (uobs_id.get() or None),
-                                        new_comment_txt, new_file_oid)
+                args = (udg_id.get(), uy.get(), um.get(), ud.get(), (uobs_id.get() or None))
+                def work():
+                    backend.diagnosis_update_with_file(*args, new_comment_txt, fp or None)
+                    if fp:
+                        lo_text.index_soon()   # make the file searchable in the background
+                return work
 
             tk.Button(
                 top, text="Update",
-                command=lambda: self._add(do_update_diagn, lb, backend.diagnosis_view, headers)
+                command=lambda: self._add(do_update_diagn(), table, backend.diagnosis_page, headers)
             ).grid(row=4, column=20, padx=6)
 
-        self._fill_with_headers(lb, headers, [])
+        # Open / export the attached file (any role)
+        self._file_row(win, top, table)
+        self._text_search_row(top, table, headers, backend.diagnosis_text_page)
+
+        self._fill_with_headers(table, headers, [])
 
     # Clinics
     def open_clinics(self):
-        win, top, lb = self._make_page("Clinics")
+        win, top, table = self._make_page("Clinics")
 
         cid = tk.StringVar(); name = tk.StringVar(); addr = tk.StringVar()
 
@@ -698,11 +1376,11 @@ class MainInterface:
 
         tk.Button(
             top, text="Search",
-            command=lambda: self._fill_with_headers(lb, headers, backend.clinic_search(cid.get(), name.get(), addr.get()))
+            command=lambda: self._load(table, headers, backend.clinic_page, cid.get(), name.get(), addr.get())
         ).grid(row=0, column=6, padx=6)
         tk.Button(
             top, text="View All",
-            command=lambda: self._fill_with_headers(lb, headers, backend.clinic_view())
+            command=lambda: self._load(table, headers, backend.clinic_page)
         ).grid(row=0, column=7, padx=6)
 
         if self.role == "super":
@@ -717,8 +1395,8 @@ class MainInterface:
             tk.Entry(top, textvariable=naddr, width=24).grid(row=2, column=5, padx=4)
             tk.Button(
                 top, text="Add",
-                command=lambda: self._add(lambda: backend.clinic_insert(nid.get(), nname.get(), naddr.get()),
-                                          lb, backend.clinic_view, headers)
+                command=lambda: self._add(partial(backend.clinic_insert, nid.get(), nname.get(), naddr.get()),
+                                          table, backend.clinic_page, headers)
             ).grid(row=2, column=6, padx=6)
 
             # Delete
@@ -727,7 +1405,7 @@ class MainInterface:
             tk.Entry(top, textvariable=del_cid, width=16).grid(row=3, column=1, padx=4)
             tk.Button(
                 top, text="Delete",
-                command=lambda: self._add(lambda: backend.clinic_delete(del_cid.get()), lb, backend.clinic_view, headers)
+                command=lambda: self._add(partial(backend.clinic_delete, del_cid.get()), table, backend.clinic_page, headers)
             ).grid(row=3, column=2, padx=6)
 
             # Update
@@ -740,15 +1418,15 @@ class MainInterface:
             tk.Entry(top, textvariable=up_caddr, width=24).grid(row=4, column=5, padx=4)
             tk.Button(
                 top, text="Update",
-                command=lambda: self._add(lambda: backend.clinic_update(up_cid.get(), up_cname.get(), up_caddr.get()),
-                                          lb, backend.clinic_view, headers)
+                command=lambda: self._add(partial(backend.clinic_update, up_cid.get(), up_cname.get(), up_caddr.get()),
+                                          table, backend.clinic_page, headers)
             ).grid(row=4, column=6, padx=6)
 
-        self._fill_with_headers(lb, headers, [])
+        self._fill_with_headers(table, headers, [])
 
     # Departments 
     def open_departments(self):
-        win, top, lb = self._make_page("Departments")
+        win, top, table = self._make_page("Departments")
 
         did = tk.StringVar(); dname = tk.StringVar(); cid = tk.StringVar(); cname = tk.StringVar()
 
@@ -765,11 +1443,11 @@ class MainInterface:
 
         tk.Button(
             top, text="Search",
-            command=lambda: self._fill_with_headers(lb, headers, backend.department_search(did.get(), dname.get(), cid.get(), cname.get()))
+            command=lambda: self._load(table, headers, backend.department_page, did.get(), dname.get(), cid.get(), cname.get())
         ).grid(row=0, column=8, padx=6)
         tk.Button(
             top, text="View All",
-            command=lambda: self._fill_with_headers(lb, headers, backend.department_view())
+            command=lambda: self._load(table, headers, backend.department_page)
         ).grid(row=0, column=9, padx=6)
 
         if self.role == "super":
@@ -784,8 +1462,8 @@ class MainInterface:
             tk.Entry(top, textvariable=ncid, width=16).grid(row=2, column=5, padx=4)
             tk.Button(
                 top, text="Add",
-                command=lambda: self._add(lambda: backend.department_insert(ndid.get(), ndname.get(), ncid.get()),
-                                          lb, backend.department_view, headers)
+                command=lambda: self._add(partial(backend.department_insert, ndid.get(), ndname.get(), ncid.get()),
+                                          table, backend.department_page, headers)
             ).grid(row=2, column=6, padx=6)
 
             # Delete 
@@ -794,7 +1472,7 @@ class MainInterface:
             tk.Entry(top, textvariable=del_dpid, width=16).grid(row=3, column=1, padx=4)
             tk.Button(
                 top, text="Delete",
-                command=lambda: self._add(lambda: backend.department_delete(del_dpid.get()), lb, backend.department_view, headers)
+                command=lambda: self._add(partial(backend.department_delete, del_dpid.get()), table, backend.department_page, headers)
             ).grid(row=3, column=2, padx=6)
 
             # Update 
@@ -807,8 +1485,8 @@ class MainInterface:
             tk.Entry(top, textvariable=up_cid, width=16).grid(row=4, column=5, padx=4)
             tk.Button(
                 top, text="Update",
-                command=lambda: self._add(lambda: backend.department_update(up_dpid.get(), up_dname.get(), up_cid.get()),
-                                          lb, backend.department_view, headers)
+                command=lambda: self._add(partial(backend.department_update, up_dpid.get(), up_dname.get(), up_cid.get()),
+                                          table, backend.department_page, headers)
             ).grid(row=4, column=6, padx=6)
 
-        self._fill_with_headers(lb, headers, [])
+        self._fill_with_headers(table, headers, [])
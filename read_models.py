@@ -0,0 +1,77 @@
+"""
+Consistency check for the observation_read / diagnosis_read read models.
+
+Triggers refresh the read rows in the same transaction as every write to observation, diagnosis,
+appointment or person (see bootstrap_db.py), so they should always equal the live join in
+backend._OBSERVATION_SELECT / _DIAGNOSIS_SELECT. Two concurrent transactions can still leave a row
+stale (each refresh only sees its own snapshot), --check finds such rows and --repair refreshes them.
+
+    python read_models.py --check
+    python read_models.py --repair
+    python read_models.py --rebuild     # refresh every row
+    python read_models.py --repair --every 3600
+"""
+import argparse
+import time
+
+import backend
+from db import get_conn, set_dsn
+
+# (read table, key, live select, refresh function)
+_MODELS = (("observation_read", "obser_id", backend._OBSERVATION_SELECT, "read_model_refresh_observations"),
+           ("diagnosis_read", "diagn_id", backend._DIAGNOSIS_SELECT, "read_model_refresh_diagnoses"))
+
+def _differing(cur, table, key, live) -> list:
+    # rows missing on either side or with any column different
+    cur.execute(f"""
+        WITH live AS ({live}), rm AS (SELECT * FROM {table})
+        SELECT {key} FROM (SELECT * FROM live EXCEPT ALL SELECT * FROM rm) a
+        UNION
+        SELECT {key} FROM (SELECT * FROM rm EXCEPT ALL SELECT * FROM live) b
+        ORDER BY 1
+    """)
+    return [r[0] for r in cur.fetchall()]
+
+def check(repair: bool = False) -> dict:
+    """Ids whose read row differs from the live join, per read table. With repair they are refreshed."""
+    out = {}
+    with get_conn() as (conn, cur):
+        for table, key, live, refresh in _MODELS:
+            out[table] = ids = _differing(cur, table, key, live)
+            if repair and ids:
+                cur.execute(f"SELECT {refresh}(%s)", (ids,))
+        conn.commit()
+    return out
+
+def rebuild():
+    """Refresh every read row from the live tables (and drop rows of deleted ones)."""
+    with get_conn() as (conn, cur):
+        cur.execute("SELECT read_model_refresh_observations(ARRAY(SELECT obser_id FROM observation_read "
+                    "UNION SELECT obser_id FROM observation))")
+        cur.execute("SELECT read_model_refresh_diagnoses(ARRAY(SELECT diagn_id FROM diagnosis_read "
+                    "UNION SELECT diagn_id FROM diagnosis))")
+        conn.commit()
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--check", action="store_true", help="report differences only (the default)")
+    ap.add_argument("--repair", action="store_true", help="refresh the rows that differ")
+    ap.add_argument("--rebuild", action="store_true", help="refresh every row")
+    ap.add_argument("--every", type=float, metavar="SECONDS", help="run again every SECONDS instead of once")
+    args = ap.parse_args()
+
+    set_dsn("super")
+    while True:
+        if args.rebuild:
+            rebuild()
+        diff = check(repair=args.repair)
+        for table, ids in diff.items():
+            shown = ", ".join(ids[:10]) + (" ..." if len(ids) > 10 else "")
+            verb = "repaired" if args.repair else "stale"
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {table}: {len(ids)} {verb}" + (f" ({shown})" if ids else ""))
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Plain text out of attached files, standard library only (used by lo_text.py in worker processes).
+
+extract(data) looks at the first bytes to pick a format and returns (kind, text), kind is None when
+no extractor fits (images, video, unknown binaries). Supported: plain text (UTF-8/UTF-16/Latin-1),
+HL7 v2 messages, PDF (text of uncompressed and Flate compressed content streams), HTML, XML (e.g. CDA),
+RTF, Office Open XML (docx/xlsx/pptx) and OpenDocument files. Compressed parts (PDF streams, zip
+members) are read up to a limit derived from max_chars, so a small file cannot expand without bound.
+This module must not import the database layer, it is loaded by every worker process.
+"""
+import io
+import re
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+
+_WS = re.compile(r"[ \t\f\v\r]*\n\s*|[ \t\f\v\r]+")
+
+def _tidy(text: str, max_chars: int) -> str:
+    # collapse whitespace (keeping line breaks), PostgreSQL text cannot hold NUL
+    text = _WS.sub(lambda m: "\n" if "\n" in m.group() else " ", text.replace("\0", " "))
+    return text.strip()[:max_chars]
+
+# plain text
+def _decode(data: bytes) -> str | None:
+    if data.startswith(b"\xef\xbb\xbf"):
+        return data[3:].decode("utf-8", "replace")
+    if data.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return data.decode("utf-16", "replace")
+    head = data[:8192]
+    if b"\0" in head:
+        return None
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start >= len(data) - 3:   # cut in the middle of a character
+            return data[:e.start].decode("utf-8")
+    # Latin-1 decodes anything, only accept it when it looks like text
+    controls = sum(1 for b in head if b < 32 and b not in (9, 10, 12, 13))
+    return data.decode("latin-1") if controls <= len(head) // 100 else None
+
+# HL7 v2: segments on their own line, the field and component separators become spaces
+def _hl7(data: bytes) -> str:
+    text = (_decode(data) or "").lstrip()   # extract() allows leading blank lines
+    fs = text[3]
+    comp = re.compile("[" + re.escape(fs + (text[4:8] if len(text) > 8 else "^~\\&")) + "]+")
+    lines = []
+    for seg in re.split(r"[\r\n]+", text):
+        if seg.startswith("MSH"):
+            seg = seg[8:]   # MSH-1 and MSH-2 are the separators themselves
+        else:
+            seg = seg[4:]
+        line = comp.sub(" ", seg).strip()
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+# PDF: text operators (Tj, TJ, ', ") inside BT..ET of every content stream
+_PDF_STREAM = re.compile(rb"stream\r?\n")
+_PDF_TOKEN = re.compile(rb"\((?:\\.|[^\\)])*\)|-?\d*\.?\d+|[A-Za-z'\"*]+|\[|\]", re.S)
+_PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+_PDF_ESCAPE = re.compile(rb"\\([0-7]{1,3}|.)", re.S)
+
+def _pdf_string(raw: bytes) -> str:
+    s = _PDF_ESCAPE.sub(lambda m: bytes([int(m.group(1), 8) & 0xFF]) if m.group(1)[:1].isdigit()
+                        else _PDF_ESCAPES.get(m.group(1), m.group(1)), raw[1:-1])
+    if s.startswith(b"\xfe\xff"):
+        return s[2:].decode("utf-16-be", "replace")
+    return s.decode("latin-1")
+
+def _pdf_text(content: bytes, out: list):
+    in_text, in_array = False, False
+    for m in _PDF_TOKEN.finditer(content):
+        tok = m.group()
+        if tok == b"BT":
+            in_text = True
+        elif tok == b"ET":
+            in_text = False
+            out.append("\n")
+        elif not in_text:
+            continue
+        elif tok[:1] == b"(":
+            out.append(_pdf_string(tok))
+        elif tok == b"[":
+            in_array = True
+        elif tok == b"]":
+            in_array = False
+        elif in_array and tok[:1] in b"-0123456789.":
+            if float(tok) < -200:   # a large kerning gap inside TJ is a space between words
+                out.append(" ")
+        elif tok in (b"Td", b"TD", b"T*", b"Tm", b"'", b'"'):
+            out.append(" ")
+
+def _pdf(data: bytes, limit: int) -> str:
+    # limit caps the decompressed bytes of all streams together (Flate bombs)
+    out = []
+    for m in _PDF_STREAM.finditer(data):
+        if limit <= 0:
+            break
+        end = data.find(b"endstream", m.end())
+        if end < 0:
+            break
+        header = data[max(0, m.start() - 512):m.start()]
+        header = header[header.rfind(b"obj") + 1:]
+        raw = data[m.end():end]
+        if b"/Subtype/Image" in header.replace(b" ", b"") or b"/DCTDecode" in header:
+            continue
+        if b"/FlateDecode" in header:
+            try:
+                raw = zlib.decompressobj().decompress(raw, limit)
+            except zlib.error:
+                continue
+            limit -= len(raw)
+        elif b"/Filter" in header:
+            continue   # other filters (LZW, ASCII85, images) are not handled
+        if b"BT" in raw:
+            _pdf_text(raw, out)
+    return "".join(out)
+
+# HTML and XML
+class _HTMLText(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts, self.skip = [], 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self.skip += 1
+        elif tag in ("p", "br", "div", "li", "tr", "h1", "h2", "h3", "h4", "td"):
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self.skip:
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(data)
+
+def _html(data: bytes) -> str:
+    p = _HTMLText()
+    p.feed(_decode(data) or data.decode("latin-1"))
+    p.close()
+    return "".join(p.parts)
+
+def _xml_text(data: bytes) -> str:
+    try:
+        root = ET.fromstring(data)
+    except ET.ParseError:
+        return _html(data)
+    return "\n".join(t.strip() for t in root.itertext() if t.strip())
+
+# RTF: drop control words and groups that only hold formatting
+_RTF_SKIP = re.compile(r"\{\\\*[^{}]*\}|\{\\(?:fonttbl|colortbl|stylesheet|info|pict)(?:[^{}]|\{[^{}]*\})*\}")
+_RTF_HEX = re.compile(r"\\'([0-9a-fA-F]{2})")
+_RTF_CTRL = re.compile(r"\\(par|line|tab)\b ?|\\[a-zA-Z]+-?\d* ?|\\([{}\\])|[{}]")
+
+def _rtf(data: bytes) -> str:
+    text = _RTF_SKIP.sub("", data.decode("latin-1"))
+    text = _RTF_HEX.sub(lambda m: bytes([int(m.group(1), 16)]).decode("cp1252", "replace"), text)
+    return _RTF_CTRL.sub(lambda m: "\n" if m.group(1) in ("par", "line") else "\t" if m.group(1) == "tab"
+                         else m.group(2) or "", text)
+
+# zip based office documents, each member is read up to limit bytes (zip bombs)
+_ZIP_MEMBERS = (("docx", re.compile(r"word/document\.xml$")),
+                ("xlsx", re.compile(r"xl/sharedStrings\.xml$")),
+                ("pptx", re.compile(r"ppt/slides/slide\d+\.xml$")),
+                ("odf", re.compile(r"content\.xml$")))
+
+def _office(data: bytes, limit: int) -> tuple[str | None, str]:
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(data))
+        names = zf.namelist()
+    except (zipfile.BadZipFile, ValueError):
+        return None, ""
+    for kind, pattern in _ZIP_MEMBERS:
+        members = [n for n in names if pattern.match(n)]
+        if members:
+            parts = []
+            for name in sorted(members):
+                with zf.open(name) as f:
+                    parts.append(_xml_text(f.read(limit)))
+            return kind, "\n".join(parts)
+    return None, ""
+
+def extract(data: bytes, *, max_chars: int = 200_000) -> tuple[str | None, str]:
+    """(kind, text) of a file's contents, (None, "") when it is not a format we can read."""
+    head = data[:1024].removeprefix(b"\xef\xbb\xbf").lstrip()
+    low = head[:256].lower()
+    if data.startswith(b"%PDF"):
+        kind, text = "pdf", _pdf(data, limit=max_chars * 8)
+    elif data.startswith(b"PK\x03\x04"):
+        kind, text = _office(data, limit=max_chars * 8)
+    elif data.startswith(b"{\\rtf"):
+        kind, text = "rtf", _rtf(data)
+    elif head.startswith(b"MSH") and len(head) > 8:
+        kind, text = "hl7", _hl7(data)
+    elif b"<html" in low or b"<!doctype html" in low:
+        kind, text = "html", _html(data)
+    elif head.startswith(b"<"):
+        kind, text = "xml", _xml_text(data)
+    else:
+        text = _decode(data)
+        kind = "text" if text is not None else None
+    return kind, _tidy(text or "", max_chars) if kind else ""